@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark suite of the json server.
+
+    Run it with ``python -m benchmarks run`` and compare two result files
+    with ``python -m benchmarks compare``, see ``python -m benchmarks --help``.
+"""
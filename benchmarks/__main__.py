@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Command line of the benchmark suite.
+"""
+
+import sys
+import json
+from argparse import ArgumentParser
+
+from jsonserver.serve import SERVERS
+
+from benchmarks.bench import run
+from benchmarks.compare import compare, format_comparisons
+from benchmarks.generate import write_database
+
+
+def sizes(value):
+    """
+        Parse a comma separated list of table sizes or thread counts
+    """
+    return [int(size) for size in value.split(",") if size]
+
+
+def parse_args(args):
+    """
+        Parse the command line arguments of the benchmark suite.
+    """
+    parser = ArgumentParser(prog="python -m benchmarks", description="Benchmarks of the json server")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and write the results as json")
+    run_parser.add_argument("--output", "-o", metavar="FILE", help="the file to write the results to (default: stdout)")
+    run_parser.add_argument("--sizes", type=sizes, default=[1000, 10000, 100000], metavar="N,N,...",
+                            help="the numbers of rows per table to benchmark (default: 1000,10000,100000)")
+    run_parser.add_argument("--tables", type=int, default=3, metavar="N",
+                            help="the number of tables of the generated databases (default: %(default)s)")
+    run_parser.add_argument("--columns", type=int, default=6, metavar="N",
+                            help="the number of columns of the generated tables (default: %(default)s)")
+    run_parser.add_argument("--operations", type=int, default=1000, metavar="N",
+                            help="the number of calls per single row operation (default: %(default)s)")
+    run_parser.add_argument("--repeat", type=int, default=5, metavar="N",
+                            help="the number of times a database is opened and written (default: %(default)s)")
+    run_parser.add_argument("--duration", type=float, default=2.0, metavar="SECONDS",
+                            help="the duration of every throughput benchmark (default: %(default)s)")
+    run_parser.add_argument("--clients", type=int, default=4, metavar="N",
+                            help="the number of concurrent clients of the real http server (default: %(default)s)")
+    run_parser.add_argument("--threads", type=sizes, default=[1, 2, 4, 8], metavar="N,N,...",
+                            help="the numbers of threads reading the json server concurrently (default: 1,2,4,8)")
+    run_parser.add_argument("--server", choices=SERVERS, default="waitress",
+                            help="the production server to benchmark (default: %(default)s)")
+    run_parser.add_argument("--no-http", dest="http", action="store_false", help="skip the http benchmarks")
+    run_parser.add_argument("--seed", type=int, default=0, help="the seed of the generated data (default: %(default)s)")
+
+    compare_parser = commands.add_parser("compare", help="compare results with a baseline and flag regressions")
+    compare_parser.add_argument("baseline", help="the results of the baseline run")
+    compare_parser.add_argument("current", help="the results of the current run")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="the relative change which is flagged as regression (default: %(default)s)")
+
+    generate_parser = commands.add_parser("generate", help="write a generated database")
+    generate_parser.add_argument("output", help="the json database file to write")
+    generate_parser.add_argument("--tables", type=int, default=3, metavar="N", help="the number of tables (default: %(default)s)")
+    generate_parser.add_argument("--rows", type=int, default=1000, metavar="N", help="the number of rows per table (default: %(default)s)")
+    generate_parser.add_argument("--columns", type=int, default=6, metavar="N", help="the number of columns per table (default: %(default)s)")
+    generate_parser.add_argument("--seed", type=int, default=0, help="the seed of the generated data (default: %(default)s)")
+    return parser.parse_args(args)
+
+
+def log(name, entry):
+    """
+        Report a finished benchmark on stderr
+    """
+    if entry["unit"] == "req/s":
+        sys.stderr.write("{}: {:.0f} req/s\n".format(name, entry["value"]))
+    else:
+        sys.stderr.write("{}: median {:.4g} {unit}, p95 {:.4g} {unit}\n".format(name, entry["median"], entry["p95"], unit=entry["unit"]))
+
+
+def main(args=sys.argv[1:]):
+    """
+        Main function of the benchmark suite.
+
+        :returns: the exit code, 1 if the comparison found regressions
+    """
+    options = parse_args(args)
+    if options.command == "generate":
+        write_database(options.output, options.tables, options.rows, options.columns, options.seed)
+        return 0
+
+    if options.command == "compare":
+        with open(options.baseline) as f:
+            baseline = json.load(f)["results"]
+        with open(options.current) as f:
+            current = json.load(f)["results"]
+        comparisons = compare(baseline, current, options.threshold)
+        print(format_comparisons(comparisons))
+        regressions = [c["name"] for c in comparisons if c["status"] == "regression"]
+        if regressions:
+            sys.stderr.write("Error: {} regression(s) above {:.0%}: {}\n".format(len(regressions), options.threshold, ", ".join(regressions)))
+            return 1
+        return 0
+
+    try:
+        results = run(options.sizes, options.tables, options.columns, options.operations, options.repeat,
+                      options.duration, options.clients, options.threads, options.server, options.http, options.seed, log)
+    except (ValueError, RuntimeError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmarks of the json server core, its storage and its http routes.
+
+    Every benchmark results in an entry keyed by its name, like
+    ``core.get_row[rows=10000]``. The ``value`` of an entry is compared
+    between runs: the median latency or the requests per second.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import shutil
+import socket
+import platform
+import tempfile
+import subprocess
+import http.client
+from threading import Thread, Event, local
+from datetime import datetime, timezone
+
+import jsonserver
+from jsonserver.core import JsonServer, foreign_key
+from jsonserver.storage import JsonStorage
+from jsonserver.codec import get_codec
+from jsonserver.serve import SERVERS
+from jsonserver.main import create_app
+
+from benchmarks.generate import CATEGORIES, table_names, write_database
+
+
+def summarize(samples, unit, better="lower"):
+    """
+        Summarize the samples of a benchmark
+
+        :params list samples: the measured values
+        :params string unit: the unit of the values
+        :params string better: if lower or higher values are better
+
+        :returns: the entry of the benchmark, the median is its value
+        :rtype: dict
+    """
+    samples = sorted(samples)
+    n = len(samples)
+    median = samples[n // 2] if n % 2 else (samples[n // 2 - 1] + samples[n // 2]) / 2
+    return {"value": median, "unit": unit, "better": better, "samples": n, "min": samples[0],
+            "median": median, "mean": sum(samples) / n, "p95": samples[int(0.95 * (n - 1))], "max": samples[-1]}
+
+
+def measure_calls(func, arguments, unit="us"):
+    """
+        Measure the latency of every call of a function
+
+        :params callable func: the function to measure
+        :params list arguments: the arguments of the calls, a tuple per call
+        :params string unit: the unit of the latency, s, ms or us
+
+        :rtype: dict
+    """
+    scale = {"s": 1e9, "ms": 1e6, "us": 1e3}[unit]
+    samples = []
+    for args in arguments:
+        start = time.perf_counter_ns()
+        func(*args)
+        samples.append((time.perf_counter_ns() - start) / scale)
+    return summarize(samples, unit)
+
+
+def measure_throughput(request, duration, clients=1):
+    """
+        Measure the requests per second of concurrent clients
+
+        :params callable request: the function making a request, called with a random number generator
+        :params float duration: the seconds to run the clients
+        :params int clients: the number of client threads
+
+        :returns: the requests per second as value and the latency of the requests
+        :rtype: dict
+    """
+    latencies = []
+    stop = Event()
+
+    def client(seed):
+        rng = random.Random(seed)
+        measured = []
+        while not stop.is_set():
+            start = time.perf_counter_ns()
+            request(rng)
+            measured.append((time.perf_counter_ns() - start) / 1e3)
+        latencies.extend(measured)
+
+    threads = [Thread(target=client, args=(seed,), daemon=True) for seed in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    entry = {"value": len(latencies) / elapsed, "unit": "req/s", "better": "higher", "requests": len(latencies)}
+    if latencies:
+        latency = summarize(latencies, "us")
+        entry.update({"latency_median_us": latency["median"], "latency_p95_us": latency["p95"]})
+    return entry
+
+
+def bench_open(path, repeat):
+    """
+        Measure opening a database, eagerly and lazily
+    """
+    server = JsonServer()
+    results = {}
+    for name, lazy in (("core.open", False), ("core.open_lazy", True)):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            server.open(path, lazy=lazy)
+            samples.append(time.perf_counter() - start)
+            server.close()
+        results[name] = summarize(samples, "s")
+    return results
+
+
+def bench_operations(path, table, parent, rows, columns, operations, seed):
+    """
+        Measure the latency of the single row operations of the json server
+
+        :params string path: the database file
+        :params string table: the table to operate on
+        :params string parent: the table referenced by the table or None
+        :params int rows: the number of rows of the tables
+        :params int columns: the number of generated columns of the tables
+        :params int operations: the number of calls per operation
+        :params int seed: the seed of the random number generator
+    """
+    rng = random.Random(seed)
+    server = JsonServer()
+    server.open(path)
+    try:
+        results = {}
+        ids = [(table, rng.randint(1, rows)) for _ in range(operations)]
+        results["core.get_row"] = measure_calls(server.get_row, ids)
+
+        if parent is not None:
+            column = foreign_key(parent, server.foreign_key_naming)
+            where = lambda value: server.where(table, **{column: value})
+            results["core.where"] = measure_calls(where, [(rng.randint(1, rows),) for _ in range(operations)])
+
+        if columns > 2:  # an unindexed column, a scan touches every row
+            scans = max(10, operations * 1000 // max(rows, 1000))
+            scan = lambda value: server.where(table, category2=value)
+            results["core.where_scan"] = measure_calls(scan, [("category{}".format(rng.randrange(CATEGORIES)),) for _ in range(scans)])
+
+        updates = [(table, rng.randint(1, rows), {"views1": i}) for i in range(operations)]
+        results["core.update"] = measure_calls(server.update, updates)
+        results["core.insert"] = measure_calls(server.insert, [(table, {"title0": "row {}".format(i)}) for i in range(operations)])
+
+        removed = rng.sample(range(1, rows + 1), min(operations, rows))
+        results["core.remove"] = measure_calls(server.remove, [(table, row_id) for row_id in removed])
+    finally:
+        server.close()
+    return results
+
+
+def bench_concurrent_reads(path, table, parent, rows, duration, threads, seed):
+    """
+        Measure the reads per second of concurrent threads, alone and next to a writer
+
+        A read gets a row, a page of 50 rows and, if the table references another
+        one, the rows with a foreign key. The writer updates random rows without pause.
+
+        :params list threads: the numbers of reading threads
+    """
+    server = JsonServer()
+    server.open(path)
+    column = foreign_key(parent, server.foreign_key_naming) if parent is not None else None
+
+    def read(rng):
+        server.get_row(table, rng.randint(1, rows))
+        server.page(table, limit=50, offset=rng.randrange(rows))
+        if column is not None:
+            server.where(table, **{column: rng.randint(1, rows)})
+
+    def write(stop):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            server.update(table, rng.randint(1, rows), {"views1": rng.randrange(1000)})
+
+    results = {}
+    try:
+        for count in threads:
+            results["core.concurrent_reads[threads={}]".format(count)] = measure_throughput(read, duration, count)
+
+            stop = Event()
+            writer = Thread(target=write, args=(stop,), daemon=True)
+            writer.start()
+            try:
+                results["core.concurrent_reads_writer[threads={}]".format(count)] = measure_throughput(read, duration, count)
+            finally:
+                stop.set()
+                writer.join()
+    finally:
+        server.close()
+    return results
+
+
+def bench_storage(path, repeat):
+    """
+        Measure writing a whole database to a json file
+    """
+    copy = path + ".write"
+    shutil.copyfile(path, copy)
+    storage = JsonStorage(copy)
+    try:
+        data = storage.read()
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            storage.write(data)
+            samples.append(time.perf_counter() - start)
+    finally:
+        storage.close()
+        os.remove(copy)
+    return {"storage.write": summarize(samples, "s")}
+
+
+def http_requests(table, parent, rows):
+    """
+        Returns the requests of the http benchmarks as functions of a client and a random number generator
+
+        :returns: the request functions keyed by name
+        :rtype: dict
+    """
+    body = json.dumps({"row": {"title0": "inserted"}})
+    requests = {
+        "get_row": lambda client, rng: client("GET", "/{}/{}".format(table, rng.randint(1, rows))),
+        "insert": lambda client, rng: client("POST", "/{}".format(table), body),
+    }
+    if parent is not None:
+        column = foreign_key(parent, JsonServer().foreign_key_naming)
+        requests["query"] = lambda client, rng: client("GET", "/{}?{}={}&_limit=10".format(table, column, rng.randint(1, rows)))
+    return requests
+
+
+def bench_http_client(path, table, parent, rows, duration):
+    """
+        Measure the requests per second through the test client of the Flask app
+    """
+    server = JsonServer()
+    server.open(path)
+    app = create_app().test_client()
+
+    def client(method, url, body=None):
+        response = app.open(url, method=method, data=body, content_type="application/json")
+        response.close()
+
+    try:
+        return {"http.client." + name: measure_throughput(lambda rng: request(client, rng), duration)
+                for name, request in http_requests(table, parent, rows).items()}
+    finally:
+        server.close()
+
+
+def free_port():
+    """
+        Returns a free local port
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(path, server, port, threads, timeout=60):
+    """
+        Start the json server command serving a database with a production server
+
+        :params string path: the database file
+        :params string server: the production server, one of ``jsonserver.serve.SERVERS``
+        :params int port: the local port to listen on
+        :params int threads: the number of threads handling requests
+        :params float timeout: the seconds to wait until the server accepts connections
+
+        :returns: the server process
+        :rtype: Popen
+
+        :raises RuntimeError: if the server does not start
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(jsonserver.__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    command = [sys.executable, "-m", "jsonserver.main", path, "--serve", server,
+               "--bind", "127.0.0.1:{}".format(port), "--threads", str(threads)]
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=errors)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            errors.close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    stop_server(process)
+    errors.seek(0)
+    message = errors.read().decode("utf-8", "replace").strip().splitlines()
+    errors.close()
+    raise RuntimeError("The {} server did not start: {}".format(server, message[-1] if message else "timeout"))
+
+
+def stop_server(process):
+    """
+        Stop a server process, which closes its database on SIGTERM
+    """
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def bench_http_server(path, table, parent, rows, duration, clients, server="waitress"):
+    """
+        Measure the requests per second of concurrent clients of a real http server
+
+        The server runs in its own process with its default options,
+        every client keeps its connection open as long as the server allows it.
+    """
+    port = free_port()
+    process = start_server(path, server, port, clients)
+    connections = local()
+    opened = []
+
+    def client(method, url, body=None):
+        connection = getattr(connections, "connection", None)
+        if connection is None:
+            connection = connections.connection = http.client.HTTPConnection("127.0.0.1", port)
+            opened.append(connection)
+        connection.request(method, url, body=body, headers={"Content-Type": "application/json"})
+        connection.getresponse().read()
+
+    try:
+        return {"http.{}.{}".format(server, name): measure_throughput(lambda rng: request(client, rng), duration, clients)
+                for name, request in http_requests(table, parent, rows).items()}
+    finally:
+        for connection in opened:
+            connection.close()
+        stop_server(process)
+
+
+def metadata(config):
+    """
+        Returns the description of the environment of a benchmark run
+
+        :params dict config: the options of the run
+
+        :rtype: dict
+    """
+    return {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": "{} {}".format(platform.python_implementation(), platform.python_version()),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "codec": get_codec().name,
+        "config": config,
+    }
+
+
+def run(sizes=(1000, 10000, 100000), tables=3, columns=6, operations=1000, repeat=5, duration=2.0,
+        clients=4, threads=(1, 2, 4, 8), server="waitress", http=True, seed=0, log=None):
+    """
+        Run the benchmarks on generated databases of the given sizes
+
+        :params list sizes: the numbers of rows per table to benchmark
+        :params int tables: the number of tables of the databases
+        :params int columns: the number of columns of the tables
+        :params int operations: the number of calls per single row operation
+        :params int repeat: the number of times a database is opened and written
+        :params float duration: the seconds every throughput benchmark runs
+        :params int clients: the number of concurrent clients of the real http server
+        :params list threads: the numbers of threads reading the json server concurrently
+        :params string server: the production server, one of ``jsonserver.serve.SERVERS``
+        :params bool http: if the http benchmarks are run
+        :params int seed: the seed of the generated data and the requests
+        :params callable log: the function called with the name and the entry of every finished benchmark
+
+        :returns: the metadata and the results of the run
+        :rtype: dict
+
+        :raises ValueError: if the server is unknown
+        :raises RuntimeError: if the server does not start, e.g. because it is not installed
+    """
+    if server not in SERVERS:
+        raise ValueError("Unknown server '{}', expected one of: {}".format(server, ", ".join(SERVERS)))
+
+    config = {"sizes": list(sizes), "tables": tables, "columns": columns, "operations": operations,
+              "repeat": repeat, "duration": duration, "clients": clients, "threads": list(threads),
+              "server": server, "seed": seed}
+    names = table_names(tables)
+    table, parent = (names[1], names[0]) if tables > 1 else (names[0], None)
+
+    results = {}
+    directory = tempfile.mkdtemp(prefix="jsonserver-benchmarks-")
+    try:
+        for rows in sizes:
+            path = os.path.join(directory, "rows{}.json".format(rows))
+            write_database(path, tables, rows, columns, seed)
+
+            suites = [lambda: bench_open(path, repeat),
+                      lambda: bench_operations(path, table, parent, rows, columns, operations, seed),
+                      lambda: bench_concurrent_reads(path, table, parent, rows, duration, threads, seed),
+                      lambda: bench_storage(path, repeat)]
+            if http:
+                suites.append(lambda: bench_http_client(path, table, parent, rows, duration))
+                suites.append(lambda: bench_http_server(path, table, parent, rows, duration, clients, server))
+
+            for suite in suites:
+                for name, entry in suite().items():
+                    name = "{}[rows={}]".format(name, rows)
+                    results[name] = entry
+                    if log is not None:
+                        log(name, entry)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {"meta": metadata(config), "results": results}
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Comparison of two benchmark runs.
+"""
+
+import re
+
+#: the statuses of a compared benchmark
+STATUSES = ("regression", "improvement", "unchanged", "added", "removed")
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+        Compare the results of a run with the results of a baseline run
+
+        A benchmark regressed if its value got worse by more than the
+        threshold, relative to the baseline: a higher latency or fewer
+        requests per second.
+
+        :params dict baseline: the results of the baseline run, keyed by benchmark name
+        :params dict current: the results of the current run, keyed by benchmark name
+        :params float threshold: the relative change which is not considered noise
+
+        :returns: the comparison of every benchmark, ordered by name and size
+        :rtype: list
+    """
+    comparisons = []
+    for name in sorted(set(baseline) | set(current), key=name_key):
+        if name not in current:
+            comparisons.append({"name": name, "status": "removed", "baseline": baseline[name]["value"],
+                                "current": None, "change": None, "unit": baseline[name]["unit"]})
+            continue
+        if name not in baseline:
+            comparisons.append({"name": name, "status": "added", "baseline": None,
+                                "current": current[name]["value"], "change": None, "unit": current[name]["unit"]})
+            continue
+
+        before, after = baseline[name]["value"], current[name]["value"]
+        change = (after - before) / before if before else 0.0
+        worse = -change if current[name]["better"] == "higher" else change
+        if worse > threshold:
+            status = "regression"
+        elif worse < -threshold:
+            status = "improvement"
+        else:
+            status = "unchanged"
+        comparisons.append({"name": name, "status": status, "baseline": before, "current": after,
+                            "change": change, "unit": current[name]["unit"]})
+    return comparisons
+
+
+def name_key(name):
+    """
+        Sort key of a benchmark name, ordering the sizes numerically
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def format_comparisons(comparisons):
+    """
+        Format comparisons as a table, one line per benchmark
+
+        :params list comparisons: the comparisons returned by ``compare``
+
+        :rtype: string
+    """
+    def value(number):
+        return "-" if number is None else "{:.4g}".format(number)
+
+    width = max([len(c["name"]) for c in comparisons] + [9])
+    lines = ["{:<{}}  {:>10}  {:>10}  {:<6}  {:>8}  {}".format("benchmark", width, "baseline", "current", "unit", "change", "status")]
+    for c in comparisons:
+        change = "-" if c["change"] is None else "{:+.1%}".format(c["change"])
+        lines.append("{:<{}}  {:>10}  {:>10}  {:<6}  {:>8}  {}".format(
+            c["name"], width, value(c["baseline"]), value(c["current"]), c["unit"], change, c["status"]))
+    return "\n".join(lines)
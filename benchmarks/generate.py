@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Generator of synthetic json server databases.
+"""
+
+import json
+import random
+
+from jsonserver.core import foreign_key
+
+#: the names of the generated tables, further tables are numbered
+TABLE_NAMES = ("users", "posts", "comments", "albums", "photos", "todos")
+
+#: the number of distinct values of the category columns
+CATEGORIES = 16
+
+
+def table_names(tables):
+    """
+        Returns the names of the generated tables
+
+        :params int tables: the number of tables
+
+        :rtype: list
+    """
+    return [TABLE_NAMES[i] if i < len(TABLE_NAMES) else "table{}".format(i) for i in range(tables)]
+
+
+def generate_row(rng, row_id, columns, parent=None, parent_rows=0):
+    """
+        Generate a row with a mix of string, integer, boolean and list columns
+
+        :params Random rng: the random number generator
+        :params int row_id: the id of the row
+        :params int columns: the number of columns besides id and the foreign key
+        :params string parent: the table referenced by the row or None
+        :params int parent_rows: the number of rows of the referenced table
+
+        :rtype: dict
+    """
+    row = {"id": row_id}
+    if parent is not None:
+        row[foreign_key(parent)] = rng.randint(1, max(parent_rows, 1))
+    for column in range(columns):
+        kind = column % 4
+        if kind == 0:
+            row["title{}".format(column)] = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(24))
+        elif kind == 1:
+            row["views{}".format(column)] = rng.randint(0, 100000)
+        elif kind == 2:
+            row["category{}".format(column)] = "category{}".format(rng.randrange(CATEGORIES))
+        else:
+            row["tags{}".format(column)] = [rng.randrange(100) for _ in range(3)]
+    return row
+
+
+def generate_database(tables=3, rows=1000, columns=6, seed=0):
+    """
+        Generate a database of tables referencing the previous table
+
+        The data only depends on the arguments, thus every run of the
+        benchmarks works on the same database.
+
+        :params int tables: the number of tables
+        :params int rows: the number of rows per table
+        :params int columns: the number of columns per table besides id and the foreign key
+        :params int seed: the seed of the random number generator
+
+        :rtype: dict
+    """
+    rng = random.Random(seed)
+    names = table_names(tables)
+    database = {}
+    for i, name in enumerate(names):
+        parent = names[i - 1] if i else None
+        database[name] = [generate_row(rng, row_id, columns, parent, rows) for row_id in range(1, rows + 1)]
+    return database
+
+
+def write_database(path, tables=3, rows=1000, columns=6, seed=0):
+    """
+        Write a generated database to a json file
+
+        :params string path: the file to write
+        :params int tables: the number of tables
+        :params int rows: the number of rows per table
+        :params int columns: the number of columns per table besides id and the foreign key
+        :params int seed: the seed of the random number generator
+    """
+    with open(path, "w") as f:
+        json.dump(generate_database(tables, rows, columns, seed), f)
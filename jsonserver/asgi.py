@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Asyncio application of the json server.
+
+    The ASGI application serves the routes of the Flask blueprint on an
+    asyncio server like uvicorn. Connections are served by the event loop
+    instead of a thread per connection, thus an idle keep-alive connection
+    costs little more than its socket. Handling a request may block, e.g.
+    on a lock of a table, a scan of a large table or a flush to the storage,
+    thus requests are handled and their responses encoded in a bounded
+    thread pool. Only the socket I/O and the waits of requests for the
+    change feed run on the event loop.
+"""
+
+import sys
+import asyncio
+from io import BytesIO
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.datastructures import Headers, MultiDict
+
+from jsonserver.core import JsonServer
+from jsonserver.routes import changes_args
+from jsonserver.exceptions import ChangesExpired
+
+#: methods of requests which do not change the data
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class AsgiApp(object):
+    """
+        ASGI application dispatching requests to a WSGI application on the event loop.
+    """
+    def __init__(self, app, flush=False, threads=4):
+        """
+            Create new ASGI application.
+
+            :params app: the WSGI application, which must not flush changes itself
+            :params bool flush: if changes made by a request are flushed before responding
+            :params int threads: the number of threads handling requests and flushing changes
+        """
+        self.app = app
+        self.flush = flush
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="jsonserver")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported scope type '{}'".format(scope["type"]))
+
+    async def lifespan(self, receive, send):
+        """
+            Handle the startup and shutdown of the server
+        """
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self._executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        """
+            Handle a http request
+
+            The request is handled in the thread pool. Changes made by the
+            request are flushed there before the response is sent, if ``flush``
+            is set. The chunks of a streamed response are encoded in the
+            thread pool one by one while they are sent.
+        """
+        body = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+
+        if scope["path"] == "/_changes" and scope["method"] == "GET":
+            if await self.changes(scope, receive, send):
+                return
+
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(self._executor, self.dispatch,
+                                                             wsgi_environ(scope, b"".join(body)))
+        try:
+            if self.flush and scope["method"] not in SAFE_METHODS and status < 400:
+                await loop.run_in_executor(self._executor, JsonServer().commit)
+
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            while True:
+                chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(chunks, "close"):
+                await loop.run_in_executor(self._executor, chunks.close)
+
+    async def changes(self, scope, receive, send):
+        """
+            Handle a request for the change feed without blocking the event loop
+
+            Invalid requests are left to the WSGI application, which responds with the error.
+
+            :returns: if the request was handled
+            :rtype: bool
+        """
+        args = MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope.get("headers", ())])
+        codec = self.app.config["JSONSERVER_CODEC"]
+        feed = JsonServer().changes
+        try:
+            since, tables, timeout = changes_args(args, headers)
+            if "text/event-stream" in headers.get("Accept", ""):
+                events = feed.stream_async(since, codec, tables)
+                first = await events.__anext__()
+            else:
+                found, last = await feed.poll_async(since, tables, timeout)
+        except (ValueError, ChangesExpired):
+            return False
+
+        if "text/event-stream" not in headers.get("Accept", ""):
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": codec.dumps({"changes": found, "last": last})})
+            return True
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache")]})
+        await send({"type": "http.response.body", "body": first, "more_body": True})
+        disconnected = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            while True:
+                chunk = asyncio.ensure_future(events.__anext__())
+                await asyncio.wait((chunk, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    chunk.cancel()
+                    await asyncio.gather(chunk, return_exceptions=True)
+                    return True
+                try:
+                    body = chunk.result()
+                except StopAsyncIteration:  # the client fell behind the feed
+                    break
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        except OSError:  # the client is gone
+            pass
+        finally:
+            disconnected.cancel()
+            await events.aclose()
+        return True
+
+    def dispatch(self, environ):
+        """
+            Dispatch a request to the WSGI application, called in the thread pool
+
+            A response with a known length is already encoded, its chunks
+            are joined at once. Streamed responses are returned unencoded.
+
+            :params dict environ: the WSGI environment of the request
+
+            :returns: the status code, the headers and an iterator of the body chunks of the response
+            :rtype: tuple
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+        chunks = self.app(environ, start_response)
+        if any(name == b"content-length" for name, _ in response["headers"]):
+            try:
+                body = b"".join(chunks)
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+            chunks = iter([body])
+        return response["status"], response["headers"], iter(chunks)
+
+
+async def wait_disconnect(receive):
+    """
+        Wait until the client disconnects
+    """
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def wsgi_environ(scope, body):
+    """
+        Returns the WSGI environment of an ASGI http request
+
+        :params dict scope: the ASGI scope of the request
+        :params bytes body: the body of the request
+
+        :rtype: dict
+    """
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name != "CONTENT_TYPE":
+            name = "HTTP_" + name
+        environ[name] = environ[name] + "," + value if name in environ else value
+    return environ
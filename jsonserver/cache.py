@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Cache for the encoded responses of the json server.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class ResponseCache(object):
+    """
+        LRU cache for encoded responses limited by their total size.
+
+        Every entry is stored with the version of the data it was built from.
+        An entry is only returned for the same version, thus a change of the
+        data invalidates exactly the entries built from it. Headers which are
+        derived from the data, like the total count of a query, are stored
+        next to the body.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+            Create new response cache.
+
+            :params int max_bytes: the maximum total size of the cached responses
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """
+            The total size of the cached responses in bytes
+        """
+        return self._size
+
+    def get(self, key, version):
+        """
+            Returns a cached response
+
+            :params tuple key: the endpoint and its arguments
+            :params version: the current version of the data of the response
+
+            :returns: the cached response or None if it is not cached for this version
+            :rtype: bytes
+        """
+        entry = self.lookup(key, version)
+        return None if entry is None else entry[0]
+
+    def lookup(self, key, version):
+        """
+            Returns a cached response and its headers
+
+            :params tuple key: the endpoint and its arguments
+            :params version: the current version of the data of the response
+
+            :returns: the cached response and its headers or None if it is not cached for this version
+            :rtype: tuple
+        """
+        with self._lock:
+            try:
+                cached_version, body, headers = self._entries[key]
+            except KeyError:
+                return None
+
+            if cached_version != version:
+                self._discard(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return body, headers
+
+    def put(self, key, version, body, headers=None):
+        """
+            Cache a response
+
+            Least recently used responses are evicted to stay within ``max_bytes``.
+            Responses which are larger than ``max_bytes`` are not cached at all.
+
+            :params tuple key: the endpoint and its arguments
+            :params version: the version of the data the response was built from
+            :params bytes body: the encoded response
+            :params dict headers: the headers of the response derived from the data
+        """
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (version, body, dict(headers or {}))
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
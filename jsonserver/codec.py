@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Json codecs used by the storages and the responses of the json server.
+
+    The fastest installed json library is used by default:
+    orjson, ujson or rapidjson. The stdlib json module is the fallback.
+"""
+
+import json
+
+
+class Codec(object):
+    """
+        Base class for json codecs.
+        A codec encodes python objects to compact json bytes and decodes them again.
+    """
+    name = None
+
+    def dumps(self, obj):
+        """
+            Encode an object as compact json.
+
+            :params obj: the object to encode
+
+            :returns: the encoded json
+            :rtype: bytes
+        """
+        raise NotImplementedError("this method has to be overwritten")
+
+    def loads(self, data):
+        """
+            Decode json.
+
+            :params bytes data: the json to decode
+
+            :returns: the decoded object
+        """
+        raise NotImplementedError("this method has to be overwritten")
+
+
+class StdlibCodec(Codec):
+    """
+        Codec using the json module of the standard library.
+    """
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    """
+        Codec using orjson.
+    """
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, obj):
+        return self._orjson.dumps(obj)
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+
+class UjsonCodec(Codec):
+    """
+        Codec using ujson.
+    """
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def dumps(self, obj):
+        return self._ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+
+class RapidjsonCodec(Codec):
+    """
+        Codec using python-rapidjson.
+    """
+    name = "rapidjson"
+
+    def __init__(self):
+        import rapidjson
+        self._rapidjson = rapidjson
+
+    def dumps(self, obj):
+        return self._rapidjson.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    def loads(self, data):
+        return self._rapidjson.loads(data)
+
+
+#: codecs in the order of preference
+CODECS = (OrjsonCodec, UjsonCodec, RapidjsonCodec, StdlibCodec)
+
+
+def available_codecs():
+    """
+        Returns the names of all codecs which can be used
+
+        :rtype: list
+    """
+    names = []
+    for codec in CODECS:
+        try:
+            codec()
+        except ImportError:
+            continue
+        names.append(codec.name)
+    return names
+
+
+def get_codec(name=None):
+    """
+        Returns a codec by its name or the fastest available codec.
+
+        :params string name: the name of the codec or None
+
+        :returns: the codec
+        :rtype: Codec
+
+        :raises ValueError: if there is no codec with this name
+        :raises ImportError: if the library of the codec is not installed
+    """
+    if isinstance(name, Codec):
+        return name
+
+    for codec in CODECS:
+        if name is None:
+            try:
+                return codec()
+            except ImportError:
+                continue
+        elif codec.name == name:
+            return codec()
+
+    raise ValueError("Unknown codec '{}', expected one of: {}".format(name, ", ".join(c.name for c in CODECS)))
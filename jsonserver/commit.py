@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Group commit of flushed changes of the json server.
+"""
+
+from threading import Thread, Event, Lock
+
+
+class CommitTicket(object):
+    """
+        Ticket of a group of flush requests which are committed together.
+    """
+    def __init__(self):
+        self._done = Event()
+        self.error = None
+
+    def done(self, error=None):
+        """
+            Mark the ticket as committed
+
+            :params Exception error: the error raised by the commit
+        """
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        """
+            Wait until the ticket is committed
+
+            :raises Exception: the error raised by the commit
+        """
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class GroupCommitter(Thread):
+    """
+        Thread which coalesces the flush requests of concurrent
+        writers within a short window into a single commit.
+    """
+    def __init__(self, commit, window=0.002):
+        """
+            Create new group committer thread.
+
+            :params callable commit: the function writing all changes to the storage
+            :params float window: the time in seconds to wait for further flush requests
+        """
+        super(GroupCommitter, self).__init__(name="jsonserver-committer")
+        self.daemon = True
+        self.window = window
+        self._commit = commit
+        self._lock = Lock()
+        self._ticket = None
+        self._wakeup = Event()
+        self._stopped = Event()
+
+    def request(self):
+        """
+            Request a commit of all changes made so far
+
+            :returns: the ticket to wait for
+            :rtype: CommitTicket
+        """
+        with self._lock:
+            if self._ticket is None:
+                self._ticket = CommitTicket()
+                self._wakeup.set()
+            return self._ticket
+
+    def commit(self):
+        """
+            Request a commit of all changes made so far and wait for it
+        """
+        self.request().wait()
+
+    def stop(self):
+        """
+            Stop the committer thread after committing pending requests
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while not self._stopped.is_set() or self._ticket is not None:
+            self._wakeup.wait()
+            if self._ticket is None:
+                continue
+
+            self._stopped.wait(self.window)
+
+            with self._lock:
+                ticket, self._ticket = self._ticket, None
+                self._wakeup.clear()
+
+            try:
+                self._commit()
+            except Exception as e:
+                ticket.done(e)
+            else:
+                ticket.done()
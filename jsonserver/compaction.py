@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Background compaction of the journal of the json server.
+"""
+
+import logging
+from threading import Thread, Event
+
+logger = logging.getLogger(__name__)
+
+
+class Compactor(Thread):
+    """
+        Thread which compacts the journal of a json server
+        as soon as it exceeds a size or a number of records.
+    """
+    def __init__(self, server, max_size=64 * 1024 * 1024, max_records=100000):
+        """
+            Create new compactor thread.
+
+            :params JsonServer server: the server to compact
+            :params int max_size: the journal size in bytes triggering a compaction or 0
+            :params int max_records: the number of journal records triggering a compaction or 0
+        """
+        super(Compactor, self).__init__(name="jsonserver-compactor")
+        self.daemon = True
+        self.max_size = max_size
+        self.max_records = max_records
+        self._server = server
+        self._wakeup = Event()
+        self._stopped = Event()
+
+    def exceeded(self, storage):
+        """
+            Checks if the journal of the storage exceeds the thresholds
+
+            :params JournalStorage storage: the storage to check
+
+            :rtype: bool
+        """
+        if self.max_records and storage.journal_records >= self.max_records:
+            return True
+        return bool(self.max_size and storage.journal_size >= self.max_size)
+
+    def notify(self, storage):
+        """
+            Wake up the compactor if the journal of the storage exceeds the thresholds
+
+            :params JournalStorage storage: the storage which was written to
+        """
+        if self.exceeded(storage):
+            self._wakeup.set()
+
+    def stop(self):
+        """
+            Stop the compactor thread and wait for a running compaction
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                return
+
+            try:
+                self._server.compact()
+            except Exception:
+                logger.exception("Failed to compact the journal of '%s'", self._server.dbfile)
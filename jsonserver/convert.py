@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Conversion of json server databases between the storage formats,
+    e.g. to import a json file into a SQLite database and to export it again.
+"""
+
+import os
+import sys
+import sqlite3
+from argparse import ArgumentParser
+
+from jsonserver.core import JsonServer
+from jsonserver.storage import STORAGE_FORMATS
+
+
+def convert(source, target, source_format=None, target_format=None, journal=None):
+    """
+        Convert a database file to another format
+
+        The tables of json and SQLite databases are copied without decoding
+        them if the target format allows it, thus large databases are converted
+        without loading them into memory at once.
+
+        :params string source: the database file to convert
+        :params string target: the database file to write, which is created or replaced
+        :params string source_format: the format of the source, by default detected by the file extension
+        :params string target_format: the format of the target, by default detected by the file extension
+        :params bool journal: if the journal of the source is replayed,
+                              by default if there is a journal next to the source
+    """
+    if journal is None:
+        journal = os.path.exists(source + ".log")
+
+    server = JsonServer()
+    server.open(source, journal=journal, lazy=True, format=source_format)
+    try:
+        server.export(target, format=target_format)
+    finally:
+        server.close()
+
+
+def parse_args(args):
+    """
+        Parse the command line arguments of the conversion tool.
+    """
+    parser = ArgumentParser(prog="jsonserver-convert",
+                            description="Convert json server databases between json, msgpack and sqlite")
+    parser.add_argument("source", help="the database file to convert")
+    parser.add_argument("target", help="the database file to write")
+    parser.add_argument("--from", dest="source_format", choices=STORAGE_FORMATS,
+                        help="the format of the source (default: by file extension)")
+    parser.add_argument("--to", dest="target_format", choices=STORAGE_FORMATS,
+                        help="the format of the target (default: by file extension)")
+    parser.add_argument("--force", action="store_true", help="replace the target if it exists")
+    return parser.parse_args(args)
+
+
+def main(args=sys.argv[1:]):
+    """
+        Main function of the conversion tool.
+    """
+    options = parse_args(args)
+    if not os.path.exists(options.source):
+        sys.stderr.write("Error: database file at '%s' does not exist\n" % options.source)
+        return 1
+
+    if os.path.exists(options.target) and not options.force:
+        sys.stderr.write("Error: database file at '%s' already exists, use --force to replace it\n" % options.target)
+        return 1
+
+    try:
+        convert(options.source, options.target, options.source_format, options.target_format)
+    except (ValueError, ImportError, sqlite3.DatabaseError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -4,51 +4,638 @@
     Core module for the python json server.
 """
 
+import gc
 import os
+import stat
+import time
+import heapq
+from bisect import bisect_left, bisect_right
+from uuid import uuid4
+from itertools import count, chain
+from functools import wraps
+from contextlib import contextmanager, ExitStack
 from singleton import singleton
 from threading import Lock
 
-from jsonserver.storage import JsonStorage
-from jsonserver.exceptions import TableNotFound, TableAlreadyExists, RowNotFound
+from jsonserver.storage import MemoryStorage, DeferredTable, SEQUENCES_TABLE, open_storage, storage_format, fsync_directory
+from jsonserver.index import HashIndex
+from jsonserver.lock import RWLock
+from jsonserver.feed import ChangeFeed
+from jsonserver.query import Condition, sort_key
+from jsonserver.compaction import Compactor
+from jsonserver.commit import GroupCommitter
+from jsonserver.metrics import REGISTRY
+from jsonserver.profiling import span
+from jsonserver.exceptions import JsonServerError, TableNotFound, TableAlreadyExists, RowNotFound, IndexNotFound, IndexAlreadyExists
+
+#: the default naming of foreign key columns, like ``postId`` referencing the table ``posts``
+FOREIGN_KEY_NAMING = "{singular}Id"
+
+
+def singular(table):
+    """
+        Returns the singular of a table name by stripping a trailing ``s``
+
+        :params string table: the table name
+
+        :rtype: string
+    """
+    return table[:-1] if len(table) > 1 and table.endswith("s") else table
+
+
+def foreign_key_affixes(naming):
+    """
+        Returns the prefix and the suffix of the foreign key columns of a naming
+
+        :params string naming: the naming of foreign key columns, containing
+                               ``{table}`` or ``{singular}`` once
+
+        :rtype: tuple
+
+        :raises ValueError: if the naming does not contain a table placeholder exactly once
+    """
+    parts = naming.replace("{singular}", "{table}").split("{table}")
+    if len(parts) != 2 or any("{" in part or "}" in part for part in parts):
+        raise ValueError("Foreign key naming '{}' has to contain {{table}} or {{singular}} exactly once".format(naming))
+    return parts[0], parts[1]
+
+
+def foreign_key(table, naming=FOREIGN_KEY_NAMING):
+    """
+        Returns the name of the foreign key column referencing a table
+
+        :params string table: the referenced table
+        :params string naming: the naming of foreign key columns
+
+        :rtype: string
+    """
+    prefix, suffix = foreign_key_affixes(naming)
+    return prefix + (singular(table) if "{singular}" in naming else table) + suffix
+
+
+#: the seconds spent in the operations of the storage
+STORAGE_DURATION = REGISTRY.histogram("jsonserver_storage_duration_seconds",
+                                      "Seconds spent reading from and writing to the storage.", ("operation",))
+
+
+def is_foreign_key(column, naming=FOREIGN_KEY_NAMING):
+    """
+        Checks if a column name references another table, like ``postId``
+
+        :params string column: the column name
+        :params string naming: the naming of foreign key columns
+
+        :rtype: bool
+    """
+    prefix, suffix = foreign_key_affixes(naming)
+    return len(column) > len(prefix) + len(suffix) and column.startswith(prefix) and column.endswith(suffix)
+
+
+@contextmanager
+def gc_paused():
+    """
+        Pause the cyclic garbage collector while the data is read
+
+        Decoded json contains no reference cycles, but every new object
+        counts towards the next collection, which traverses all objects again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def forwarded(method):
+    """
+        Forward calls of a method changing the data to the writer of a replica
+
+        :params callable method: the method of the json server
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._writer is not None:
+            return self._writer.call(method.__name__, *args, **kwargs)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class RowIds(object):
+    """
+        Sequence of the ids of a list of rows, used to bisect rows ordered by id.
+    """
+    def __init__(self, rows):
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        return self._rows[index]["id"]
 
 
 @singleton()
 class JsonServer(object):
     """
         Instance of the json server.
+
+        Every table is guarded by a readers-writer lock, thus any number of
+        readers of a table proceed in parallel while writers of the table
+        are serialized. Creating and dropping tables locks the whole database.
+
+        Published rows are never changed: an update replaces the row by an
+        updated copy and reads return new lists. Thus the results of a read
+        are isolated from later writes, even after the lock is released.
+
+        Every change is published with a sequence number to the listeners
+        registered with ``subscribe``. A replica of the database in another
+        process applies these changes and forwards its writes to the writer.
     """
+    #: automatically create secondary indexes for foreign key columns
+    auto_index = True
+    #: the naming of foreign key columns, see ``foreign_key``
+    foreign_key_naming = FOREIGN_KEY_NAMING
+
     def __init__(self):
         self._dbfile = None
         self._db = None
-        self._autoincrement_id_lock = Lock()
+        self._lazy = False
+        self._data = {}
+        self._deferred = {}
+        self._index = {}
+        self._secondary = {}
+        self._sequences = {}
+        self._saved_sequences = {}
+        self._ordered = {}
+        self._positions = {}
+        self._removed = {}
+        self._epoch = uuid4().hex[:8]
+        self._clock = count(1)
+        self._version = self._loaded = 0
+        self._versions = {}
+        self._row_versions = {}
+        self._modified = {}
+        self._modified_at = self._loaded_at = time.time()
+        self._compactor = None
+        self._committer = None
+        self._schema = RWLock("schema")
+        self._locks = {}
+        self._clock_lock = Lock()
+        self._purge_lock = Lock()
+        self._load_lock = Lock()
+        self._storage_lock = Lock()
+        self._publish_lock = Lock()
+        self._listeners = []
+        self._sequence = 0
+        self._changes = ChangeFeed()
+        self._writer = None
+        REGISTRY.gauge("jsonserver_table_rows", "Rows of the tables, tables which are not loaded yet are left out.",
+                       ("table",), self._table_rows)
+        REGISTRY.gauge("jsonserver_journal_bytes", "Size of the journal.", (), lambda: self._journal("journal_size"))
+        REGISTRY.gauge("jsonserver_journal_records", "Records in the journal.", (), lambda: self._journal("journal_records"))
 
     @property
     def dbfile(self):
         return self._dbfile
 
-    def open(self, dbfile):
+    def open(self, dbfile, journal=False, durability="flush", codec=None, lazy=False, format=None):
+        """
+            Open a json database file
+
+            :params string dbfile: the json database file
+            :params bool journal: if changes are appended to a journal next to
+                                  the database file instead of rewriting it
+            :params string durability: the durability level of flushed changes, one of: none, flush, fsync
+            :params string codec: the json codec of the storage, by default the fastest available
+            :params bool lazy: if the database file is memory-mapped and
+                               tables are only decoded on their first access
+            :params string format: the format of the database file, one of: json, msgpack, sqlite,
+                                   by default detected by the file extension
+        """
         if not os.path.exists(dbfile):
             raise OSError("Json database file not found at '%s'" % dbfile)
 
+        self.close()
         self._dbfile = dbfile
-        self._db = JsonStorage(dbfile)
+        self._lazy = lazy
+        self._db = open_storage(dbfile, format=format, journal=journal, durability=durability, codec=codec)
         self._data = {}
+        self._index = {}
+        self._secondary = {}
+        self._sequences = {}
+        self._saved_sequences = {}
+        self._ordered = {}
+        self._positions = {}
+        self._removed = {}
         self.read(flush_previous=False)
 
+    def open_replica(self, writer, data, sequence, indexes=None):
+        """
+            Open a replica of the database of another json server
+
+            The replica is kept up to date by applying the changes published
+            by the other server with ``apply``. Writes to the replica are
+            forwarded to the other server by calling ``writer.call`` with
+            the name and the arguments of the method.
+
+            :params writer: the forwarder of the writes
+            :params dict data: a snapshot of the data of the other server
+            :params int sequence: the sequence number of the last change contained in the snapshot
+            :params dict indexes: the indexed columns of the other server keyed by table
+        """
+        self.close()
+        self._dbfile = None
+        self._lazy = False
+        self._db = MemoryStorage(data)
+        self._secondary = {}
+        self.read(flush_previous=False)
+        for table, columns in (indexes or {}).items():
+            for column in columns:
+                self._replay({"op": "index", "table": table, "column": column})
+
+        self._sequence = sequence
+        self._changes.reset(sequence)
+        self._writer = writer
+
     def close(self):
+        """
+            Close the database and stop its background threads
+
+            Opening another database closes the previous one first.
+        """
+        self.stop_committer()
+        self.stop_compactor()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
         if self._db:
             self._db.close()
 
+    def start_compactor(self, max_size=64 * 1024 * 1024, max_records=100000):
+        """
+            Start compacting the journal in a background thread
+            as soon as it exceeds the given size or number of records.
+
+            :params int max_size: the journal size in bytes triggering a compaction or 0
+            :params int max_records: the number of journal records triggering a compaction or 0
+        """
+        if not self._db.journaled:
+            raise JsonServerError("Compaction requires a journaled storage")
+
+        self.stop_compactor()
+        self._compactor = Compactor(self, max_size=max_size, max_records=max_records)
+        self._compactor.start()
+        self._compactor.notify(self._db)
+
+    def stop_compactor(self):
+        """
+            Stop the background compaction of the journal
+        """
+        if self._compactor:
+            self._compactor.stop()
+            self._compactor = None
+
+    def start_committer(self, window=0.002):
+        """
+            Start committing flushed changes in a background thread.
+
+            Flushes requested by concurrent writers within the given
+            window are coalesced into a single write to the storage.
+            Every writer still waits until its changes are written.
+
+            :params float window: the time in seconds to wait for further flushes
+        """
+        self.stop_committer()
+        self._committer = GroupCommitter(self._write_through, window=window)
+        self._committer.start()
+
+    def stop_committer(self):
+        """
+            Stop the background committer after writing pending flushes
+        """
+        if self._committer:
+            self._committer.stop()
+            self._committer = None
+
     def read(self, flush_previous=True):
         if flush_previous:
             self.flush()
-        self._data = self._db.read()
 
+        with self._schema.write(), gc_paused():
+            declared = {table: list(indexes) for table, indexes in self._secondary.items()}
+            declared.update(self._deferred)
+            with STORAGE_DURATION.time(("read",)):
+                self._data = self._db.read_lazy() if self._lazy else self._db.read()
+                sequences = self._data.pop(SEQUENCES_TABLE, None)
+                if isinstance(sequences, DeferredTable):
+                    sequences = sequences.load()
+            self._saved_sequences = {row["id"]: row["sequence"] for row in sequences or ()}
+            self._deferred = {}
+            self._locks = {}
+            self._removed = {}
+            self._index = {}
+            self._secondary = {}
+            self._sequences = {}
+            self._ordered = {}
+            self._positions = {}
+            self._versions = {}
+            self._row_versions = {}
+            self._modified = {}
+            self._version = self._loaded = next(self._clock)
+            self._modified_at = self._loaded_at = os.path.getmtime(self._dbfile) if self._dbfile else time.time()
+            for table, rows in self._data.items():
+                if isinstance(rows, DeferredTable):
+                    self._locks[table] = RWLock()
+                    self._deferred[table] = declared.get(table, ())
+                else:
+                    self._index_table(table, rows, declared.get(table, ()))
+
+            if self._db.journaled:
+                with STORAGE_DURATION.time(("replay",)):
+                    for record in self._db.records():
+                        self._replay(record)
+            self._changes.reset(self._sequence)
+
+    @forwarded
     def flush(self):
         """
             Flush all data to storage
+
+            Writers are only blocked until a snapshot of the data is taken,
+            unless the storage is journaled: a journal is truncated by the write.
+            Tables of a lazily read database which were not accessed yet are
+            copied to the storage without decoding them.
+        """
+        with self._storage_lock:
+            if self._db.journaled:
+                with self._reading(load=False), STORAGE_DURATION.time(("write",)):
+                    self._db.write(self._snapshot(sequences=True))
+            else:
+                with self._reading(load=False):
+                    snapshot = self._snapshot(sequences=True)
+                with STORAGE_DURATION.time(("write",)):
+                    self._db.write(snapshot)
+
+    def snapshot(self):
+        """
+            Returns a copy of all data which is not affected by later changes
+
+            :rtype: dict
+        """
+        with self._reading():
+            return self._snapshot()
+
+    def export(self, path, format=None):
+        """
+            Write a snapshot of all data to another database file
+
+            Tables of a lazily read database which were not accessed yet
+            are copied without decoding them, if the formats allow it.
+
+            The snapshot is written to a temporary file which is then renamed over
+            the database file, thus an existing file is replaced whatever its format.
+
+            :params string path: the database file to write, which is created or replaced
+            :params string format: the format of the database file, one of: json, msgpack, sqlite,
+                                   by default detected by the file extension
+        """
+        format = storage_format(path, format)
+        tmpfile = path + ".tmp"
+        open(tmpfile, "wb").close()
+        try:
+            storage = open_storage(tmpfile, format=format, durability="fsync")
+            try:
+                with self._reading(load=False):
+                    snapshot = self._snapshot(sequences=True)
+                storage.write(snapshot)
+            finally:
+                storage.close()
+            if os.path.exists(path):
+                os.chmod(tmpfile, stat.S_IMODE(os.stat(path).st_mode))
+            os.replace(tmpfile, path)
+        except BaseException:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            raise
+        fsync_directory(path)
+
+    def _snapshot(self, sequences=False):
+        """
+            Returns a copy of all data, the tables have to be locked
+
+            :params bool sequences: if the sequences of the tables whose highest id was
+                                    removed are added as ``SEQUENCES_TABLE`` for the storage
+        """
+        snapshot = {table: rows if isinstance(rows, DeferredTable) else list(self._rows(table))
+                    for table, rows in list(self._data.items())}
+        if sequences:
+            rows = []
+            for table in snapshot:
+                if table in self._deferred:
+                    sequence = self._saved_sequences.get(table)
+                else:
+                    sequence = self._sequences[table]
+                    if sequence in self._index[table]:
+                        continue  # the sequence is seeded from the ids again
+                if sequence:
+                    rows.append({"id": table, "sequence": sequence})
+            if rows:
+                snapshot[SEQUENCES_TABLE] = rows
+        return snapshot
+
+    @forwarded
+    def compact(self):
         """
-        self._db.write(self._data)
+            Write a snapshot of all data to the storage
+            and discard the journal records contained in it.
+
+            Changes made while the snapshot is taken are kept in the journal.
+        """
+        with self._storage_lock:
+            mark = self._db.mark()
+            with self._reading(load=False):
+                snapshot = self._snapshot(sequences=True)
+            with STORAGE_DURATION.time(("compact",)):
+                self._db.compact(snapshot, mark)
+
+    def _index_table(self, table, rows, columns=()):
+        """
+            Build the primary key index of a table and
+            seed its autoincrement sequence with the highest integer id,
+            or with the saved sequence if the highest id was removed.
+
+            Secondary indexes are built for the given columns and,
+            if ``auto_index`` is enabled, for every foreign key column.
+
+            :params string table: the table to index
+            :params list rows: the rows of the table
+            :params list columns: the columns to build secondary indexes for
+        """
+        self._locks.setdefault(table, RWLock())
+        self._index[table] = index = {row["id"]: row for row in rows if "id" in row}
+        sequence = max((row_id for row_id in index if isinstance(row_id, int)), default=0)
+        saved = self._saved_sequences.get(table)
+        self._sequences[table] = saved if saved is not None and saved > sequence else sequence
+        try:
+            self._ordered[table] = len(index) == len(rows) and all(a["id"] < b["id"] for a, b in zip(rows, rows[1:]))
+        except TypeError:  # ids of different types
+            self._ordered[table] = False
+
+        columns = set(columns)
+        if self.auto_index:
+            keys = set()
+            for row in rows:
+                keys.update(row)
+            columns.update(key for key in keys if is_foreign_key(key, self.foreign_key_naming))
+        self._secondary[table] = {column: HashIndex(column, rows) for column in columns}
+
+    def _load(self, table):
+        """
+            Decode a table of a lazily read database on its first access
+
+            The table is indexed before it replaces the deferred table,
+            thus concurrent readers never see a partially loaded table.
+
+            :params string table: the table to load
+        """
+        if table not in self._deferred:
+            return
+
+        with self._load_lock, gc_paused():
+            if table not in self._deferred:  # loaded by a concurrent reader
+                return
+            with STORAGE_DURATION.time(("load",)):
+                rows = self._data[table].load()
+            self._index_table(table, rows, self._deferred[table])
+            self._data[table] = rows
+            del self._deferred[table]
+
+    def _auto_index_row(self, table, row):
+        """
+            Create secondary indexes for new foreign key columns of a row
+
+            :params string table: the table of the row
+            :params dict row: the row to check
+        """
+        if not self.auto_index:
+            return
+
+        indexes = self._secondary[table]
+        for column in row:
+            if column not in indexes and is_foreign_key(column, self.foreign_key_naming):
+                indexes[column] = HashIndex(column, self._index[table].values())
+
+    def _rows(self, table):
+        """
+            Returns the rows of a table.
+
+            Removed rows are only marked in ``self._removed`` and are
+            purged from the row list the next time the whole table is accessed.
+            The table has to be locked, concurrent readers purge it only once.
+            Purging renumbers the positions of the rows, see ``_position``.
+
+            :params string table: the table to get the rows from
+
+            :returns: the rows of the table
+            :rtype: list
+        """
+        rows = self._data[table]
+        if self._removed.get(table):
+            with self._purge_lock:
+                removed = self._removed.get(table)
+                if removed:
+                    rows[:] = [r for r in rows if id(r) not in removed]
+                    removed.clear()
+                    if table in self._positions:
+                        self._positions[table] = {id(r): i for i, r in enumerate(rows)}
+        return rows
+
+    @contextmanager
+    def _reading(self, *tables, load=True):
+        """
+            Lock the given tables or all tables for reading
+
+            Tables which do not exist are not locked. Tables of a lazily
+            read database are decoded first, unless ``load`` is disabled.
+        """
+        with self._schema.read(), ExitStack() as stack:
+            for table in sorted(set(tables or self._data)):
+                if table in self._locks:
+                    if load:
+                        self._load(table)
+                    stack.enter_context(self._locks[table].read())
+            yield
+
+    @contextmanager
+    def _writing(self, table):
+        """
+            Lock a table for writing
+
+            The table is not locked if it does not exist.
+        """
+        with span("write"), self._schema.read(), ExitStack() as stack:
+            if table in self._locks:
+                self._load(table)
+                stack.enter_context(self._locks[table].write())
+            yield
+
+    @property
+    def epoch(self):
+        """
+            Random token identifying this server process.
+
+            Versions are only unique in combination with the epoch,
+            because they start over in every process.
+        """
+        return self._epoch
+
+    def version(self, table=None, row_id=None):
+        """
+            Returns the version of a row, a table or of the whole database.
+
+            Versions are increased with every change and never reused,
+            not even for a dropped and recreated table or a reread database.
+
+            :params string table: the table or None for the whole database
+            :params int row_id: the row or None for the whole table
+
+            :returns: the version or None if the row does not exist
+            :rtype: int
+        """
+        if table is None:
+            return self._version
+        if row_id is None:
+            return self._versions.get(table, self._loaded)
+
+        if not self.table_exists(table) or not self.row_exists(table, row_id):
+            return None
+        return self._row_versions.get(table, {}).get(row_id, self._loaded)
+
+    def modified(self, table=None):
+        """
+            Returns the time of the last change of a table or of the whole database.
+
+            :params string table: the table or None for the whole database
+
+            :returns: the time as seconds since the epoch
+            :rtype: float
+        """
+        if table is None:
+            return self._modified_at
+        return self._modified.get(table, self._loaded_at)
+
+    def _touch(self, table, row_id=None):
+        """
+            Increase the version of a changed table and row
+        """
+        with self._clock_lock:
+            version = next(self._clock)
+            if row_id is not None:
+                self._row_versions.setdefault(table, {})[row_id] = version
+            self._versions[table] = self._version = version
+            self._modified[table] = self._modified_at = time.time()
 
     def table_exists(self, table):
         """
@@ -76,14 +663,15 @@ class JsonServer(object):
             :returns: if the row exists or not
             :rtype: bool
         """
-        table_data = self.get_table(table)[table]
-        for row in table_data:
-            if row["id"] == row_id:
-                return True
-        return False
+        self._load(table)
+        try:
+            return row_id in self._index[table]
+        except KeyError:
+            raise TableNotFound(table)
 
     def all(self):
-        return self._data
+        with span("lookup"):
+            return self.snapshot()
 
     def get(self, **kwargs):
         if not kwargs:
@@ -99,59 +687,417 @@ class JsonServer(object):
             return self.get_table(kwargs["table"])
 
     def get_table(self, table):
+        with span("lookup"), self._reading(table):
+            try:
+                return {table: list(self._rows(table))}
+            except KeyError:
+                raise TableNotFound(table)
+
+    def page(self, table, limit=None, offset=0, after=None):
+        """
+            Returns a page of the rows of a table
+
+            Pages are either selected by an offset or by the id of the last row
+            of the previous page. The latter is stable under inserts and removes.
+            If the rows of the table are ordered by id, only the rows of the
+            page are touched, otherwise the table has to be scanned once.
+
+            :params string table: the table name
+            :params int limit: the maximum number of rows or None for all rows
+            :params int offset: the number of rows to skip
+            :params int after: only return rows with a higher id than this one
+
+            :returns: the rows of the page and the number of rows in the table
+            :rtype: tuple
+        """
+        with span("lookup"), self._reading(table):
+            return self._page(table, limit, offset, after)
+
+    def _page(self, table, limit, offset, after):
         try:
-            return {table: self._data[table]}
+            rows = self._rows(table)
         except KeyError:
             raise TableNotFound(table)
 
-    def get_row(self, table, id):
-        rows = self.where(table, id=id)
-        if not rows:
-            raise RowNotFound(table, id)
+        total = len(rows)
+        if after is not None:
+            try:
+                position = bisect_right(RowIds(rows), after) if self._ordered[table] else None
+            except TypeError:  # ids of another type than the given one
+                position = None
+            if position is not None:
+                offset += position
+            else:
+                after_id = Condition("id", "gt", after)  # ids of another type are not after it
+                candidates = (row for row in rows if after_id.matches(row))
+                if limit is None:
+                    rows = sorted(candidates, key=lambda row: row["id"])
+                else:
+                    rows = heapq.nsmallest(offset + limit, candidates, key=lambda row: row["id"])
 
-        return rows[0]
+        end = None if limit is None else offset + limit
+        return rows[offset:end], total
 
-    def get_row_sub_table(self, table, id, subtable):
-        if table.endswith("s"):
-            foreign_id = "{}Id".format(table[:-1])
-        else:
-            foreign_id = "{}Id".format(table)
+    def get_row(self, table, id, embed=(), expand=()):
+        """
+            Returns a row of a table
+
+            :params string table: the table name
+            :params id: the id of the row
+            :params list embed: the tables whose rows referencing the row are embedded, see ``embed``
+            :params list expand: the tables whose row referenced by the row is embedded, see ``embed``
+
+            :rtype: dict
+        """
+        with span("lookup"), self._reading(table):
+            try:
+                index = self._index[table]
+            except KeyError:
+                raise TableNotFound(table)
+
+            try:
+                row = index[id]
+            except KeyError:
+                raise RowNotFound(table, id)
 
-        if not self.row_exists(table, id):
-            raise RowNotFound(table, id)
+        if embed or expand:
+            return self.embed(table, [row], embed, expand)[0]
+        return row
 
-        rows = self.where(subtable, **{foreign_id: id})
+    def get_row_sub_table(self, table, id, subtable):
+        with span("lookup"), self._reading(table, subtable):
+            if not self.row_exists(table, id):
+                raise RowNotFound(table, id)
+            if not self.table_exists(subtable):
+                raise TableNotFound(subtable)
+
+            rows = self._join(table, subtable, [id]).get(id, [])
         return {subtable: rows}
 
+    def embed(self, table, rows, embed=(), expand=()):
+        """
+            Embed the related rows of other tables into rows of a table
+
+            The rows of an ``embed`` table referencing a row by their foreign key
+            column, like ``postId`` for the table ``posts``, are embedded as a list
+            under the name of their table. The row of an ``expand`` table referenced
+            by the foreign key column of a row, like ``userId``, is embedded under
+            the singular of its table name, like ``user``.
+
+            Every relation is resolved at once for all rows by a hash join
+            instead of a lookup per row, see ``_join``.
+
+            :params string table: the table of the rows
+            :params list rows: the rows to embed the related rows into
+            :params list embed: the tables whose rows reference the rows
+            :params list expand: the tables whose rows are referenced by the rows
+
+            :returns: copies of the rows including the related rows
+            :rtype: list
+        """
+        with span("lookup"), self._reading(*chain(embed, expand)):
+            for related in chain(embed, expand):
+                if not self.table_exists(related):
+                    raise TableNotFound(related)
+
+            rows = [dict(row) for row in rows]
+            for child in embed:
+                children = self._join(table, child, [row["id"] for row in rows if "id" in row])
+                for row in rows:
+                    row[child] = children.get(row.get("id"), [])
+
+            for parent in expand:
+                column = foreign_key(parent, self.foreign_key_naming)
+                name = singular(parent)
+                index = self._index[parent]
+                for row in rows:
+                    if column in row:
+                        try:
+                            row[name] = index.get(row[column])
+                        except TypeError:  # unhashable values reference no row
+                            row[name] = None
+        return rows
+
+    def _join(self, table, child, ids):
+        """
+            Returns the rows of a child table referencing the given rows of a table
+
+            The rows are looked up in the index of the foreign key column
+            of the child table if there is one. Otherwise, the child table
+            is scanned once for all ids. The tables have to be locked.
+
+            :params string table: the table of the referenced rows
+            :params string child: the table of the referencing rows
+            :params list ids: the ids of the referenced rows
+
+            :returns: the referencing rows in the order of their ids or of the child table,
+                      keyed by the id of the referenced row
+            :rtype: dict
+        """
+        column = foreign_key(table, self.foreign_key_naming)
+        index = self._secondary[child].get(column)
+        if index is not None:
+            groups = {}
+            for row_id in ids:
+                posting = index.lookup(row_id) or {}
+                try:
+                    groups[row_id] = [posting[child_id] for child_id in sorted(posting)]
+                except TypeError:  # ids of different types are returned in index order
+                    groups[row_id] = list(posting.values())
+            return groups
+
+        groups = {row_id: [] for row_id in ids}
+        for row in self._rows(child):
+            try:
+                group = groups.get(row[column])
+            except (KeyError, TypeError):  # no or an unhashable reference
+                continue
+            if group is not None:
+                group.append(row)
+        return groups
+
+    def indexes(self, table):
+        """
+            Returns the columns of a table which have a secondary index
+
+            :params string table: the table name
+
+            :rtype: list
+        """
+        with self._reading(table):
+            try:
+                return sorted(self._secondary[table])
+            except KeyError:
+                raise TableNotFound(table)
+
+    @forwarded
+    def create_index(self, table, column):
+        """
+            Create a secondary hash index on a column of a table
+
+            :params string table: the table name
+            :params string column: the column to index
+        """
+        with self._writing(table):
+            if not self.table_exists(table):
+                raise TableNotFound(table)
+
+            indexes = self._secondary[table]
+            if column == "id" or column in indexes:
+                raise IndexAlreadyExists(table, column)
+
+            indexes[column] = HashIndex(column, self._index[table].values())
+            self._publish({"op": "index", "table": table, "column": column})
+        return True
+
+    @forwarded
+    def drop_index(self, table, column):
+        """
+            Drop a secondary index of a table
+
+            :params string table: the table name
+            :params string column: the indexed column
+        """
+        with self._writing(table):
+            if not self.table_exists(table):
+                raise TableNotFound(table)
+
+            try:
+                del self._secondary[table][column]
+            except KeyError:
+                raise IndexNotFound(table, column)
+            self._publish({"op": "unindex", "table": table, "column": column})
+
+        return True
+
+    def _lookup(self, table, column, value):
+        """
+            Lookup the rows of a table with the given column value in an index
+
+            :params string table: the table name
+            :params string column: the column name
+            :params value: the value to lookup
+
+            :returns: the matching rows keyed by their id or
+                      None if there is no usable index for this column
+            :rtype: dict
+        """
+        if column == "id":
+            try:
+                row = self._index[table].get(value)
+            except TypeError:
+                return None
+            return {} if row is None else {row["id"]: row}
+
+        index = self._secondary[table].get(column)
+        if index is None:
+            return None
+        return index.lookup(value)
+
     def where(self, table, **kwargs):
-        table_data = self.get_table(table)[table]
-        matches = []
-        for row in table_data:
-            does_match = True
-            for key, value in kwargs.items():
-                if row[key] != value:
-                    does_match = False
-
-            if does_match:
-                matches.append(row)
+        """
+            Find all rows of a table matching the given column values
+
+            :params string table: the table name
+            :params kwargs: the column values to match
+
+            :returns: the matching rows
+            :rtype: list
+        """
+        with span("lookup"), self._reading(table):
+            if not self.table_exists(table):
+                raise TableNotFound(table)
+
+            return self._select(table, [Condition(key, "eq", value) for key, value in kwargs.items()])
+
+    def query(self, table, conditions=(), sort=None, order="asc", fields=None, limit=None, offset=0, after=None,
+              embed=(), expand=()):
+        """
+            Query the rows of a table
+
+            The rows are filtered by the given conditions, see ``where``
+            for how indexes are used. If a limit is given, only the rows
+            of the requested page are sorted using a bounded heap.
+            Only the rows of the page get their related rows embedded
+            and are projected to the requested fields.
+
+            :params string table: the table name
+            :params list conditions: the ``Condition`` objects the rows have to fulfill
+            :params string sort: the column to sort by or None to keep the table order
+            :params string order: the sort order, asc or desc
+            :params list fields: the columns to return or None for all columns
+            :params int limit: the maximum number of rows or None for all rows
+            :params int offset: the number of rows to skip
+            :params int after: only return rows with a higher id than this one
+            :params list embed: the tables whose rows referencing the rows are embedded, see ``embed``
+            :params list expand: the tables whose rows referenced by the rows are embedded, see ``embed``
+
+            :returns: the rows of the page and the number of matching rows
+            :rtype: tuple
+
+            :raises ValueError: if the sort order is unknown
+        """
+        if order not in ("asc", "desc"):
+            raise ValueError("Unknown sort order '{}', expected asc or desc".format(order))
+
+        if not conditions and sort is None:
+            rows, total = self.page(table, limit=limit, offset=offset, after=after)
+        else:
+            with span("lookup"), self._reading(table):
+                if not self.table_exists(table):
+                    raise TableNotFound(table)
+
+                conditions = list(conditions)
+                if after is not None:
+                    conditions.append(Condition("id", "gt", after))
+                    if sort is None and not self._ordered[table]:
+                        sort = "id"
+
+                rows = self._select(table, conditions)
+            total = len(rows)
+            if sort is not None:
+                key = sort_key(sort)
+                with span("sort"):
+                    if limit is None:
+                        rows = sorted(rows, key=key, reverse=order == "desc")
+                    elif order == "desc":
+                        rows = heapq.nlargest(offset + limit, rows, key=key)
+                    else:
+                        rows = heapq.nsmallest(offset + limit, rows, key=key)
+            rows = rows[offset:None if limit is None else offset + limit]
+
+        if embed or expand:
+            rows = self.embed(table, rows, embed, expand)
+        if fields:
+            fields = list(chain(fields, embed, (singular(parent) for parent in expand)))
+            rows = [{field: row[field] for field in fields if field in row} for row in rows]
+        return rows, total
+
+    def _select(self, table, conditions):
+        """
+            Returns the rows of a table fulfilling all conditions
+
+            If indexes exist for some of the conditions the rows are looked up
+            in the most selective index and intersected with the other indexes.
+            Only the remaining conditions are checked row by row.
+
+            :params string table: the table name
+            :params list conditions: the ``Condition`` objects the rows have to fulfill
+
+            :returns: the matching rows in the order of the table or of their ids
+            :rtype: list
+        """
+        postings = []
+        remaining = []
+        for condition in conditions:
+            posting = self._lookup_condition(table, condition)
+            if posting is None:
+                remaining.append(condition)
+            else:
+                postings.append(posting)
+
+        if postings:
+            postings.sort(key=len)
+            candidates = postings[0]
+            for posting in postings[1:]:
+                candidates = {row_id: row for row_id, row in candidates.items() if row_id in posting}
+            try:
+                rows = [candidates[row_id] for row_id in sorted(candidates)]
+            except TypeError:  # ids of different types are returned in index order
+                rows = list(candidates.values())
+        else:
+            rows = self._rows(table)
+
+        if not remaining:
+            return list(rows)
+        with span("filter"):
+            return [row for row in rows if all(condition.matches(row) for condition in remaining)]
+
+    def _lookup_condition(self, table, condition):
+        """
+            Lookup the rows fulfilling a condition in an index
+
+            :params string table: the table name
+            :params Condition condition: the condition
+
+            :returns: the matching rows keyed by their id or
+                      None if there is no usable index for this condition
+            :rtype: dict
+        """
+        if not condition.indexable:
+            return None
+
+        postings = [self._lookup(table, condition.column, value) for value in condition.values]
+        if None in postings:
+            return None
+        if len(postings) == 1:
+            return postings[0]
+
+        matches = {}
+        for posting in postings:
+            matches.update(posting)
         return matches
 
+    @forwarded
     def create(self, name, flush=False):
         """
             Create a new table
 
             :param string name: the name of the table to create
         """
-        if self.table_exists(name):
-            raise TableAlreadyExists(name)
+        with self._schema.write():
+            if self.table_exists(name):
+                raise TableAlreadyExists(name)
+            if name == SEQUENCES_TABLE:
+                raise JsonServerError("The table name '{}' is reserved".format(name))
 
-        self._data[name] = []
-
-        if flush:
-            self.flush()
+            self._create_table(name)
+            self._log({"op": "create", "table": name})
+        self._commit(flush)
 
         return True
 
+    @forwarded
     def drop(self, table, flush=False):
         """
             Drop a table
@@ -159,39 +1105,40 @@ class JsonServer(object):
             :param string table: the name of the table to drop
         """
         # FIXME: implement cascade
-        if not self.table_exists(table):
-            raise TableNotFound(table)
-
-        del self._data[table]
+        with self._schema.write():
+            if not self.table_exists(table):
+                raise TableNotFound(table)
 
-        if flush:
-            self.flush()
+            self._drop_table(table)
+            self._log({"op": "drop", "table": table})
+        self._commit(flush)
 
         return True
 
+    @forwarded
     def insert(self, table, row, flush=False):
         """
             Insert row into a given table
 
             :params string table: the table name
             :params dict row: the row to insert
-        """
-        if not self.table_exists(table):
-            raise TableNotFound(table)
 
-        with self._autoincrement_id_lock:
-            if not self._data[table]:
-                highest_id = 0
-            else:
-                highest_id = max(row["id"] for row in self._data[table])
-            row["id"] = highest_id + 1
-            self._data[table].append(row)
+            :returns: the id of the inserted row
+            :rtype: int
+        """
+        with self._writing(table):
+            if not self.table_exists(table):
+                raise TableNotFound(table)
 
-            if flush:
-                self.flush()
+            self._sequences[table] += 1
+            row["id"] = self._sequences[table]
+            self._add_row(table, row)
+            self._log({"op": "insert", "table": table, "row": row})
+        self._commit(flush)
 
-        return True
+        return row["id"]
 
+    @forwarded
     def remove(self, table, row_id, flush=False):
         """
             Remove a row from a table
@@ -199,29 +1146,441 @@ class JsonServer(object):
             :params string table: the table name
             :params dict row_id: the id of the row to remove
         """
-        if not self.row_exists(table, row_id):
-            raise RowNotFound(table, row_id)
-
-        self._data[table][:] = [r for r in self._data[table] if r["id"] != row_id]
+        with self._writing(table):
+            if not self.row_exists(table, row_id):
+                raise RowNotFound(table, row_id)
 
-        if flush:
-            self.flush()
+            self._remove_row(table, row_id)
+            self._log(self._remove_record(table, row_id))
+        self._commit(flush)
 
         return True
 
+    @forwarded
     def update(self, table, row_id, data, flush=False):
         """
             Update a row in a table
 
+            The primary key of a row cannot be changed, thus
+            an ``id`` within the given data is ignored.
+
             :params string table: the table name
             :params int row_id: the id of the row to remove
             :params dict data: the row data
         """
-        row = self.get_row(table, row_id)
-        for key, value in data.items():
-            row[key] = value
+        data = {key: value for key, value in data.items() if key != "id"}
+        with self._writing(table):
+            if not self.row_exists(table, row_id):
+                raise RowNotFound(table, row_id)
+
+            self._update_row(table, self._index[table][row_id], data)
+            self._log({"op": "update", "table": table, "id": row_id, "data": data})
+        self._commit(flush)
 
+        return True
+
+    def insert_many(self, table, rows, flush=False):
+        """
+            Insert rows into a given table at once
+
+            :params string table: the table name
+            :params list rows: the rows to insert
+
+            :returns: the ids of the inserted rows
+            :rtype: list
+        """
+        return self.bulk(table, insert=rows, flush=flush)["insert"]
+
+    def update_many(self, table, updates, flush=False):
+        """
+            Update rows of a table at once
+
+            :params string table: the table name
+            :params dict updates: the data to update keyed by the row id
+
+            :returns: the ids of the updated rows
+            :rtype: list
+        """
+        return self.bulk(table, update=updates, flush=flush)["update"]
+
+    def remove_many(self, table, row_ids, flush=False):
+        """
+            Remove rows from a table at once
+
+            :params string table: the table name
+            :params list row_ids: the ids of the rows to remove
+
+            :returns: the ids of the removed rows
+            :rtype: list
+        """
+        return self.bulk(table, remove=row_ids, flush=flush)["remove"]
+
+    @forwarded
+    def bulk(self, table, insert=(), update=None, remove=(), flush=False):
+        """
+            Insert, update and remove rows of a table in a single batch
+
+            The batch is applied atomically within a single write lock of the table:
+            all rows to insert and to update and all rows to remove are checked first
+            and nothing is changed if one of them is not a dict or does not exist. The ids of the inserted rows are allocated
+            at once and the batch is persisted as a single journal record with at most
+            one write through.
+
+            Updates are applied before removes and inserts.
+
+            :params string table: the table name
+            :params list insert: the rows to insert
+            :params dict update: the data to update keyed by the row id or a list of (id, data) pairs
+            :params list remove: the ids of the rows to remove
+
+            :returns: the ids of the inserted, updated and removed rows keyed by
+                      ``insert``, ``update`` and ``remove``
+            :rtype: dict
+
+            :raises TableNotFound: if the table does not exist
+            :raises RowNotFound: if a row to update or to remove does not exist
+            :raises TypeError: if a row to insert or the data to update a row with is not a dict
+        """
+        insert = list(insert)
+        update = dict(update or {})
+        if not all(isinstance(row, dict) for row in chain(insert, update.values())):
+            raise TypeError("The rows to insert and the data to update rows with have to be dicts")
+        update = {row_id: {key: value for key, value in data.items() if key != "id"}
+                  for row_id, data in update.items()}
+        remove = list(dict.fromkeys(remove))
+        if not insert and not update and not remove:
+            return {"insert": [], "update": [], "remove": []}
+
+        records = []
+        with self._writing(table):
+            if not self.table_exists(table):
+                raise TableNotFound(table)
+
+            index = self._index[table]
+            for row_id in list(update) + remove:
+                if row_id not in index:
+                    raise RowNotFound(table, row_id)
+
+            for row_id, data in update.items():
+                self._update_row(table, index[row_id], data)
+                records.append({"op": "update", "table": table, "id": row_id, "data": data})
+
+            for row_id in remove:
+                self._remove_row(table, row_id)
+                records.append(self._remove_record(table, row_id))
+
+            first = self._sequences[table] + 1
+            self._sequences[table] += len(insert)
+            for row_id, row in enumerate(insert, first):
+                row["id"] = row_id
+                self._add_row(table, row)
+                records.append({"op": "insert", "table": table, "row": row})
+            self._log({"op": "batch", "table": table, "records": records})
+        self._commit(flush)
+
+        return {"insert": [row["id"] for row in insert], "update": list(update), "remove": remove}
+
+    def _remove_record(self, table, row_id):
+        """
+            Returns the change record of a removed row
+
+            If the row had the highest id assigned so far, the record carries the
+            sequence of the table, thus storages without a replayed journal keep it.
+        """
+        record = {"op": "remove", "table": table, "id": row_id}
+        if row_id == self._sequences[table]:
+            record["sequence"] = row_id
+        return record
+
+    @forwarded
+    def commit(self):
+        """
+            Write all changes made so far through to the storage
+
+            Flushes of concurrent writers are coalesced if the committer is running.
+        """
+        self._commit(True)
+
+    def _log(self, record):
+        """
+            Append a change to the journal if the storage is journaled and publish it
+
+            Changes are logged while the changed table is locked,
+            thus the journal records are in the order of the changes.
+
+            :params dict record: the change to persist
+        """
+        if self._db.journaled:
+            start = time.perf_counter()
+            self._db.append(record)
+            STORAGE_DURATION.observe(time.perf_counter() - start, ("append",))
+            if self._compactor:
+                self._compactor.notify(self._db)
+        self._publish(record)
+
+    def _publish(self, record, sequence=None):
+        """
+            Pass a change with the next sequence number to the listeners
+
+            :params dict record: the change
+            :params int sequence: the sequence number assigned by a writer or None
+        """
+        with self._publish_lock:
+            self._sequence = self._sequence + 1 if sequence is None else sequence
+            for listener in self._listeners:
+                listener(self._sequence, record)
+            self._changes.append(self._sequence, record)
+
+    @property
+    def sequence(self):
+        """
+            The sequence number of the last published change
+        """
+        return self._sequence
+
+    @property
+    def changes(self):
+        """
+            The feed of the latest changes of the data
+
+            :rtype: ChangeFeed
+        """
+        return self._changes
+
+    def _table_rows(self):
+        """
+            Returns the number of rows of the loaded tables for the metrics
+
+            :rtype: dict
+        """
+        return {(table,): len(index) for table, index in list(self._index.items())}
+
+    def _journal(self, attribute):
+        """
+            Returns the size or the number of records of the journal for the metrics
+
+            :params string attribute: the property of the storage
+
+            :rtype: dict
+        """
+        db = self._db
+        if db is None or not db.journaled:
+            return {}
+        try:
+            return {(): getattr(db, attribute)}
+        except ValueError:  # closed
+            return {}
+
+    def subscribe(self, listener):
+        """
+            Register a listener for the changes of the data
+
+            The listener is called with the sequence number and the change record
+            of every change while the changed table is locked, thus it must not block.
+            Changes are published in the order of the sequence numbers.
+
+            :params callable listener: the function to call
+
+            :returns: a snapshot of the data, the sequence number of the last change
+                      contained in it and the indexed columns keyed by table
+            :rtype: tuple
+        """
+        with self._reading():
+            with self._publish_lock:
+                self._listeners.append(listener)
+                sequence = self._sequence
+            indexes = {table: sorted(indexes) for table, indexes in self._secondary.items() if indexes}
+            return self._snapshot(), sequence, indexes
+
+    def unsubscribe(self, listener):
+        """
+            Unregister a listener for the changes of the data
+
+            :params callable listener: the registered function
+        """
+        with self._publish_lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def apply(self, record, sequence=None):
+        """
+            Apply a change published by another json server
+
+            The change is published again to the own listeners.
+
+            :params dict record: the change
+            :params int sequence: the sequence number of the change
+        """
+        if record["op"] in ("create", "drop"):
+            lock = self._schema.write()
+        else:
+            lock = self._writing(record["table"])
+
+        with lock:
+            self._replay(record)
+            self._publish(record, sequence)
+
+    def _commit(self, flush):
+        """
+            Persist the changes to the storage if ``flush`` is set
+
+            Journaled storages only write the journal through,
+            otherwise the whole data is written.
+
+            :params bool flush: if the changes have to be written through
+        """
         if flush:
+            with span("flush"):
+                if self._committer:
+                    self._committer.commit()
+                else:
+                    self._write_through()
+
+    def _write_through(self):
+        """
+            Write all changes made so far to the storage
+        """
+        if self._db.journaled:
+            with STORAGE_DURATION.time(("sync",)):
+                self._db.sync()
+        else:
             self.flush()
 
-        return True
+    def _replay(self, record):
+        """
+            Apply a change record from the journal
+
+            Records are applied idempotently, thus replaying a journal
+            over a snapshot which already contains some of its changes is safe.
+
+            :params dict record: the change to apply
+        """
+        op = record["op"]
+        table = record["table"]
+        if op not in ("create", "drop"):
+            self._load(table)
+
+        if op == "batch":
+            for change in record["records"]:
+                self._replay(change)
+        elif op == "create":
+            if not self.table_exists(table):
+                self._create_table(table)
+        elif op == "drop":
+            if self.table_exists(table):
+                self._drop_table(table)
+        elif op == "insert":
+            row = record["row"]
+            if self.row_exists(table, row["id"]):
+                self._remove_row(table, row["id"])
+            self._add_row(table, row)
+            self._sequences[table] = max(self._sequences[table], row["id"])
+        elif op == "remove":
+            if self.row_exists(table, record["id"]):
+                self._remove_row(table, record["id"])
+            if "sequence" in record and self.table_exists(table):
+                self._sequences[table] = max(self._sequences[table], record["sequence"])
+        elif op == "update":
+            if self.row_exists(table, record["id"]):
+                self._update_row(table, self._index[table][record["id"]], record["data"])
+        elif op == "index":
+            if self.table_exists(table) and record["column"] not in self._secondary[table]:
+                self._secondary[table][record["column"]] = HashIndex(record["column"], self._index[table].values())
+        elif op == "unindex":
+            if self.table_exists(table):
+                self._secondary[table].pop(record["column"], None)
+
+    def _create_table(self, name):
+        self._saved_sequences.pop(name, None)
+        self._data[name] = []
+        self._locks[name] = RWLock()
+        self._index[name] = {}
+        self._secondary[name] = {}
+        self._sequences[name] = 0
+        self._ordered[name] = True
+        self._touch(name)
+
+    def _drop_table(self, table):
+        del self._data[table]
+        del self._locks[table]
+        if self._deferred.pop(table, None) is None:  # a table which was never loaded is not indexed
+            del self._index[table]
+            del self._secondary[table]
+            del self._sequences[table]
+            del self._ordered[table]
+        self._saved_sequences.pop(table, None)
+        self._positions.pop(table, None)
+        self._removed.pop(table, None)
+        self._row_versions.pop(table, None)
+        self._touch(table)
+
+    def _add_row(self, table, row):
+        rows = self._data[table]
+        if self._ordered[table] and rows:
+            try:
+                self._ordered[table] = rows[-1]["id"] < row["id"]
+            except TypeError:
+                self._ordered[table] = False
+        positions = self._positions.get(table)
+        if positions is not None:
+            positions[id(row)] = len(rows)
+        rows.append(row)
+        self._index[table][row["id"]] = row
+
+        self._auto_index_row(table, row)
+        for index in self._secondary[table].values():
+            index.add(row)
+        self._touch(table, row["id"])
+
+    def _remove_row(self, table, row_id):
+        row = self._index[table].pop(row_id)
+        self._removed.setdefault(table, set()).add(id(row))
+        for index in self._secondary[table].values():
+            index.discard(row)
+        self._row_versions.get(table, {}).pop(row_id, None)
+        self._touch(table)
+
+    def _position(self, table, row):
+        """
+            Returns the position of a row in the row list of its table
+
+            The rows of a table ordered by id are found by bisection. For
+            other tables the positions are kept in a map from the rows to
+            their positions, which is built on the first update and then
+            maintained on appends, updates and purges.
+
+            :params string table: the table name
+            :params dict row: the row, which has to be in the row list
+
+            :rtype: int
+        """
+        rows = self._data[table]
+        if self._ordered[table]:
+            position = bisect_left(RowIds(rows), row["id"])
+            if position < len(rows) and rows[position] is row:
+                return position
+
+        positions = self._positions.get(table)
+        if positions is None:
+            positions = self._positions[table] = {id(r): i for i, r in enumerate(rows)}
+        return positions[id(row)]
+
+    def _update_row(self, table, row, data):
+        updated = dict(row)
+        updated.update(data)
+
+        rows = self._data[table]
+        position = self._position(table, row)
+        rows[position] = updated
+        positions = self._positions.get(table)
+        if positions is not None:
+            del positions[id(row)]
+            positions[id(updated)] = position
+        self._index[table][row["id"]] = updated
+
+        for column, index in self._secondary[table].items():
+            if column in data:
+                index.discard(row)
+            index.add(updated)
+        self._auto_index_row(table, data)
+        self._touch(table, row["id"])
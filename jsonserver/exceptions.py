@@ -30,3 +30,28 @@ class RowNotFound(JsonServerError):
     """
     def __init__(self, table, id):
         super(RowNotFound, self).__init__("Row with id '{}' in table '{}' not found".format(id, table))
+
+
+class IndexNotFound(JsonServerError):
+    """
+        Exception which is raised when a requested index of a table could not be found.
+    """
+    def __init__(self, table, column):
+        super(IndexNotFound, self).__init__("Index on column '{}' of table '{}' not found".format(column, table))
+
+
+class IndexAlreadyExists(JsonServerError):
+    """
+        Exception which is raised when the index to create already exists.
+    """
+    def __init__(self, table, column):
+        super(IndexAlreadyExists, self).__init__("Index on column '{}' of table '{}' already exists".format(column, table))
+
+
+class ChangesExpired(JsonServerError):
+    """
+        Exception which is raised when requested changes were already dropped from the change feed.
+    """
+    def __init__(self, sequence, dropped):
+        super(ChangesExpired, self).__init__(
+            "Changes after sequence number '{}' expired, the feed starts after '{}'".format(sequence, dropped))
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Change feed of the json server.
+"""
+
+import time
+import asyncio
+from collections import deque
+from threading import Condition
+
+from jsonserver.exceptions import ChangesExpired
+
+#: operations of the change records which change the data
+DATA_OPERATIONS = ("create", "drop", "insert", "remove", "update")
+
+#: seconds between the keep-alive comments of an event stream
+HEARTBEAT_INTERVAL = 15
+
+
+def sse(name, data, codec, sequence=None):
+    """
+        Encode a server-sent event
+
+        :params string name: the name of the event
+        :params data: the data of the event
+        :params Codec codec: the json codec of the data
+        :params int sequence: the id of the event or None
+
+        :rtype: bytes
+    """
+    head = "id: {}\n".format(sequence) if sequence is not None else ""
+    return "{}event: {}\ndata: ".format(head, name).encode("utf-8") + codec.dumps(data) + b"\n\n"
+
+
+def events(sequence, record):
+    """
+        Returns the change events of a change record
+
+        A batch record results in an event for every change of the batch,
+        all with the same sequence number. Records which do not change
+        the data, like index changes, result in no events.
+
+        :params int sequence: the sequence number of the record
+        :params dict record: the change record
+
+        :rtype: list
+    """
+    if record["op"] == "batch":
+        return [e for change in record["records"] for e in events(sequence, change)]
+    if record["op"] not in DATA_OPERATIONS:
+        return []
+
+    event = {"seq": sequence, "op": record["op"], "table": record["table"]}
+    if record["op"] == "insert":
+        event["id"] = record["row"]["id"]
+        event["row"] = record["row"]
+    elif record["op"] == "update":
+        event["id"] = record["id"]
+        event["data"] = record["data"]
+    elif record["op"] == "remove":
+        event["id"] = record["id"]
+    return [event]
+
+
+class ChangeFeed(object):
+    """
+        Bounded ring buffer of the latest change events of a json server.
+
+        Readers ask for the events after the last sequence number they have seen.
+        If older events than that were already dropped from the buffer,
+        the reader has to load the data again.
+    """
+    def __init__(self, max_size=10000):
+        """
+            Create new change feed.
+
+            :params int max_size: the maximum number of events kept
+        """
+        self._events = deque(maxlen=max_size)
+        self._last = 0
+        self._dropped = 0
+        self._condition = Condition()
+        self._waiters = set()
+
+    @property
+    def max_size(self):
+        """
+            The maximum number of events kept
+        """
+        return self._events.maxlen
+
+    @property
+    def last(self):
+        """
+            The sequence number of the last change
+        """
+        return self._last
+
+    def resize(self, max_size):
+        """
+            Change the maximum number of events kept
+
+            :params int max_size: the maximum number of events kept
+        """
+        with self._condition:
+            events = list(self._events)
+            self._events = deque(events[-max_size:] if max_size else [], maxlen=max_size)
+            if len(events) > len(self._events):
+                self._dropped = max(self._dropped, events[len(events) - len(self._events) - 1]["seq"])
+
+    def reset(self, sequence):
+        """
+            Drop all events, e.g. because the data was loaded again
+
+            :params int sequence: the sequence number of the loaded data
+        """
+        with self._condition:
+            self._events.clear()
+            self._last = self._dropped = sequence
+            self._condition.notify_all()
+
+    def append(self, sequence, record):
+        """
+            Add the events of a change record and wake up the waiting readers
+
+            :params int sequence: the sequence number of the record
+            :params dict record: the change record
+        """
+        with self._condition:
+            for event in events(sequence, record):
+                if len(self._events) == self._events.maxlen:
+                    self._dropped = self._events[0]["seq"] if self._events else sequence
+                self._events.append(event)
+            self._last = sequence
+            self._condition.notify_all()
+            waiters = list(self._waiters)
+
+        for waiter in waiters:
+            waiter()
+
+    def since(self, sequence, tables=None):
+        """
+            Returns the events after a sequence number
+
+            :params int sequence: the last sequence number seen by the reader
+            :params list tables: the tables to return events for or None for all tables
+
+            :returns: the events and the sequence number of the last change
+            :rtype: tuple
+
+            :raises ChangesExpired: if events after the sequence number were already dropped
+                                    or the sequence number is from before a restart of the server
+        """
+        with self._condition:
+            if sequence < self._dropped or sequence > self._last:
+                raise ChangesExpired(sequence, self._dropped)
+
+            found = []
+            for event in reversed(self._events):
+                if event["seq"] <= sequence:
+                    break
+                if tables is None or event["table"] in tables:
+                    found.append(event)
+            found.reverse()
+            return found, self._last
+
+    def wait(self, sequence, timeout):
+        """
+            Wait until a change after the sequence number is made
+
+            :params int sequence: the last sequence number seen by the reader
+            :params float timeout: the maximum time to wait in seconds
+
+            :returns: if a change was made
+            :rtype: bool
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._last > sequence, timeout)
+
+    async def wait_async(self, sequence, timeout):
+        """
+            Wait on the event loop until a change after the sequence number is made
+
+            :params int sequence: the last sequence number seen by the reader
+            :params float timeout: the maximum time to wait in seconds
+
+            :returns: if a change was made
+            :rtype: bool
+        """
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        waiter = lambda: loop.call_soon_threadsafe(changed.set)
+        with self._condition:
+            self._waiters.add(waiter)
+        try:
+            if self._last > sequence:
+                return True
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+            return True
+        finally:
+            with self._condition:
+                self._waiters.discard(waiter)
+
+    def poll(self, sequence, tables=None, timeout=0):
+        """
+            Returns the events after a sequence number, waiting for them if there are none yet
+
+            :params int sequence: the last sequence number seen by the reader or
+                                  None to only get the sequence number of the last change
+            :params list tables: the tables to return events for or None for all tables
+            :params float timeout: the maximum time to wait in seconds
+
+            :returns: the events and the sequence number of the last change
+            :rtype: tuple
+
+            :raises ChangesExpired: if events after the sequence number were already dropped
+        """
+        if sequence is None:
+            return [], self._last
+
+        deadline = time.monotonic() + timeout
+        found, last = self.since(sequence, tables)
+        while not found and time.monotonic() < deadline:
+            self.wait(last, deadline - time.monotonic())
+            found, last = self.since(sequence, tables)
+        return found, last
+
+    async def poll_async(self, sequence, tables=None, timeout=0):
+        """
+            Like ``poll``, but waits on the event loop
+        """
+        if sequence is None:
+            return [], self._last
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        found, last = self.since(sequence, tables)
+        while not found and loop.time() < deadline:
+            await self.wait_async(last, deadline - loop.time())
+            found, last = self.since(sequence, tables)
+        return found, last
+
+    def stream(self, sequence, codec, tables=None, heartbeat=HEARTBEAT_INTERVAL):
+        """
+            Generate the events after a sequence number as server-sent events
+
+            The stream never ends, a comment is sent if there was no change
+            within the heartbeat interval. If the reader falls behind the size
+            of the feed, an ``expired`` event is sent and the stream ends.
+
+            :params int sequence: the last sequence number seen by the reader or None to start now
+            :params Codec codec: the json codec of the events
+            :params list tables: the tables to send events for or None for all tables
+            :params float heartbeat: the seconds between keep-alive comments
+
+            :raises ChangesExpired: if events after the sequence number were already dropped
+        """
+        found, last = self.since(self._last if sequence is None else sequence, tables)
+        yield b"retry: 1000\n\n"
+        while True:
+            for event in found:
+                yield sse("change", event, codec, event["seq"])
+            if not self.wait(last, heartbeat):
+                yield b": keep-alive\n\n"
+            try:
+                found, last = self.since(last, tables)
+            except ChangesExpired as e:
+                yield sse("expired", {"error": str(e)}, codec)
+                return
+
+    async def stream_async(self, sequence, codec, tables=None, heartbeat=HEARTBEAT_INTERVAL):
+        """
+            Like ``stream``, but waits on the event loop
+        """
+        found, last = self.since(self._last if sequence is None else sequence, tables)
+        yield b"retry: 1000\n\n"
+        while True:
+            for event in found:
+                yield sse("change", event, codec, event["seq"])
+            if not await self.wait_async(last, heartbeat):
+                yield b": keep-alive\n\n"
+            try:
+                found, last = self.since(last, tables)
+            except ChangesExpired as e:
+                yield sse("expired", {"error": str(e)}, codec)
+                return
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Secondary indexes for the tables of the json server.
+"""
+
+
+class HashIndex(object):
+    """
+        Hash index over a single column of a table.
+
+        The index maps each value of the column to a posting list which
+        holds the rows containing this value, keyed by the id of the row.
+        Rows without the column or with an unhashable value are not indexed.
+    """
+    def __init__(self, column, rows=()):
+        """
+            Create new hash index.
+
+            :params string column: the column to index
+            :params list rows: the rows to build the index from
+        """
+        self.column = column
+        self._postings = {}
+        for row in rows:
+            self.add(row)
+
+    def add(self, row):
+        """
+            Add a row to the index
+
+            :params dict row: the row to add
+        """
+        try:
+            value = row[self.column]
+            row_id = row["id"]
+        except KeyError:
+            return
+
+        try:
+            self._postings.setdefault(value, {})[row_id] = row
+        except TypeError:  # unhashable values are not indexed
+            pass
+
+    def discard(self, row):
+        """
+            Remove a row from the index if it is indexed
+
+            :params dict row: the row to remove
+        """
+        try:
+            value = row[self.column]
+            posting = self._postings[value]
+            del posting[row["id"]]
+        except (KeyError, TypeError):
+            return
+
+        if not posting:
+            del self._postings[value]
+
+    def lookup(self, value):
+        """
+            Returns the posting list of a value
+
+            :params value: the value to lookup
+
+            :returns: the matching rows keyed by their id or
+                      None if the value cannot be looked up in a hash index
+            :rtype: dict
+        """
+        try:
+            return self._postings.get(value, {})
+        except TypeError:
+            return None
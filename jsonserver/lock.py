@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Locks coordinating the readers and writers of the json server.
+"""
+
+import time
+from contextlib import contextmanager
+from threading import Condition, Lock
+
+from jsonserver.metrics import REGISTRY
+
+#: the seconds threads waited for a readers-writer lock
+LOCK_WAIT = REGISTRY.histogram("jsonserver_lock_wait_seconds",
+                               "Seconds threads waited for a lock, only acquisitions which had to wait are observed.",
+                               ("lock", "mode"))
+
+
+class RWLock(object):
+    """
+        Readers-writer lock.
+
+        Any number of readers can hold the lock at the same time,
+        while a writer holds it exclusively. Waiting writers take
+        precedence over new readers, thus readers cannot starve a writer.
+
+        The lock is not reentrant: a thread holding it must not acquire it again.
+
+        The time threads have to wait for the lock is recorded in ``LOCK_WAIT``,
+        acquiring an uncontended lock records nothing.
+    """
+    def __init__(self, name="table"):
+        """
+            Create new readers-writer lock.
+
+            :params string name: the name of the lock in the metrics
+        """
+        self.name = name
+        self._condition = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+
+    def acquire_read(self):
+        """
+            Acquire the lock for reading
+        """
+        waited = None
+        with self._condition:
+            if self._writer or self._waiting:
+                start = time.perf_counter()
+                while self._writer or self._waiting:
+                    self._condition.wait()
+                waited = time.perf_counter() - start
+            self._readers += 1
+        if waited is not None:
+            LOCK_WAIT.observe(waited, (self.name, "read"))
+
+    def release_read(self):
+        """
+            Release the lock acquired for reading
+        """
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        """
+            Acquire the lock for writing
+        """
+        waited = None
+        with self._condition:
+            self._waiting += 1
+            if self._writer or self._readers:
+                start = time.perf_counter()
+                while self._writer or self._readers:
+                    self._condition.wait()
+                waited = time.perf_counter() - start
+            self._waiting -= 1
+            self._writer = True
+        if waited is not None:
+            LOCK_WAIT.observe(waited, (self.name, "write"))
+
+    def release_write(self):
+        """
+            Release the lock acquired for writing
+        """
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        """
+            Hold the lock for reading within a with statement
+        """
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        """
+            Hold the lock for writing within a with statement
+        """
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
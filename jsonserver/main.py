@@ -6,46 +6,173 @@
 
 import sys
 import os
+from argparse import ArgumentParser
 from flask import Flask
 
-from jsonserver.core import JsonServer
+from jsonserver.core import JsonServer, FOREIGN_KEY_NAMING, foreign_key_affixes
+from jsonserver.storage import DURABILITY_LEVELS, STORAGE_FORMATS
+from jsonserver.codec import CODECS, get_codec
+from jsonserver.cache import ResponseCache
 from jsonserver.routes import api
+from jsonserver.asgi import AsgiApp
+from jsonserver.profiling import Profiler
+from jsonserver.serve import SERVERS, serve
 
 
-def create_jsonserver(dbfile):
+def create_jsonserver(dbfile, journal=False, compact_size=0, compact_records=0, durability="flush", commit_window=0,
+                      codec=None, feed_size=None, lazy=False, storage=None):
     server = JsonServer()
-    server.open(dbfile)
+    server.open(dbfile, journal=journal, durability=durability, codec=codec, lazy=lazy, format=storage)
+    if feed_size is not None:
+        server.changes.resize(feed_size)
+    if journal and (compact_size or compact_records):
+        server.start_compactor(max_size=compact_size, max_records=compact_records)
+    if commit_window:
+        server.start_committer(window=commit_window)
 
     return server
 
 
-def create_app():
+def create_app(flush=False, codec=None, cache_size=0, stream_threshold=0, metrics=True, profiler=None):
     # flask app instance
     app = Flask(__name__)
+    app.config["JSONSERVER_FLUSH"] = flush
+    app.config["JSONSERVER_METRICS"] = metrics
+    app.config["JSONSERVER_PROFILER"] = profiler or Profiler()
+    app.config["JSONSERVER_CODEC"] = get_codec(codec)
+    app.config["JSONSERVER_CACHE"] = ResponseCache(cache_size) if cache_size else None
+    app.config["JSONSERVER_STREAM_THRESHOLD"] = stream_threshold
     app.register_blueprint(api)
 
     return app
 
 
+def create_asgi_app(flush=False, codec=None, cache_size=0, stream_threshold=0, threads=4, metrics=True,
+                    profiler=None):
+    # asyncio app instance serving the same routes, handling requests in a thread pool
+    app = create_app(codec=codec, cache_size=cache_size, stream_threshold=stream_threshold, metrics=metrics,
+                     profiler=profiler)
+    return AsgiApp(app, flush=flush, threads=threads)
+
+
+def foreign_key_naming(naming):
+    """
+        Validate the naming of foreign key columns given on the command line.
+    """
+    foreign_key_affixes(naming)
+    return naming
+
+
+def parse_args(args):
+    """
+        Parse the command line arguments of the json server.
+    """
+    parser = ArgumentParser(prog="jsonserver", description="Simple pythonic json backend server")
+    parser.add_argument("dbfile", nargs="?", help="the json database file")
+    parser.add_argument("--journal", action="store_true",
+                        help="append changes to a journal next to the database file instead of rewriting it")
+    parser.add_argument("--storage", choices=STORAGE_FORMATS,
+                        help="the format of the database file (default: by file extension, "
+                             ".msgpack for msgpack, .sqlite or .db for sqlite, otherwise json)")
+    parser.add_argument("--lazy", action="store_true",
+                        help="memory-map the database file and decode every table on its first access")
+    parser.add_argument("--foreign-key", type=foreign_key_naming, default=FOREIGN_KEY_NAMING, metavar="NAMING",
+                        help="the naming of foreign key columns, {table} is replaced by the referenced table "
+                             "and {singular} by its name without a trailing s (default: %(default)s)")
+    parser.add_argument("--codec", choices=[c.name for c in CODECS],
+                        help="the json library to use (default: fastest installed)")
+    parser.add_argument("--cache-size", type=int, default=64 * 1024 * 1024, metavar="BYTES",
+                        help="cache encoded responses up to this total size, 0 to disable (default: %(default)s)")
+    parser.add_argument("--stream-threshold", type=int, default=10000, metavar="ROWS",
+                        help="stream responses with more rows than this in chunks, 0 to disable (default: %(default)s)")
+    parser.add_argument("--durability", choices=DURABILITY_LEVELS, default="flush",
+                        help="how far flushed changes are written: leave them to the storage, "
+                             "hand them to the operating system or sync them to disk (default: %(default)s)")
+    parser.add_argument("--flush", action="store_true",
+                        help="write every change made through the api to the database file before responding")
+    parser.add_argument("--commit-window", type=float, default=0.002, metavar="SECONDS",
+                        help="coalesce flushes of concurrent requests within this window "
+                             "into a single write, 0 to disable (default: %(default)s)")
+    parser.add_argument("--compact-size", type=int, default=64 * 1024 * 1024, metavar="BYTES",
+                        help="compact the journal when it exceeds this size, 0 to disable (default: %(default)s)")
+    parser.add_argument("--compact-records", type=int, default=100000, metavar="N",
+                        help="compact the journal when it exceeds this number of records, 0 to disable (default: %(default)s)")
+    parser.add_argument("--feed-size", type=int, default=10000, metavar="N",
+                        help="keep this many changes for clients of the change feed (default: %(default)s)")
+    parser.add_argument("--no-metrics", dest="metrics", action="store_false",
+                        help="do not record metrics and serve them at /_metrics")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile every request, not only those sending the X-Profile header")
+    parser.add_argument("--slow-request", type=float, default=1.0, metavar="SECONDS",
+                        help="log requests taking longer than this, 0 to disable (default: %(default)s)")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="run profiled requests under cProfile and keep the stats of the slowest in this directory")
+    parser.add_argument("--profile-count", type=int, default=10, metavar="N",
+                        help="keep the stats of this many slowest requests (default: %(default)s)")
+    parser.add_argument("--serve", choices=SERVERS,
+                        help="serve with a production server instead of the development server")
+    parser.add_argument("--bind", default="127.0.0.1:5000", metavar="HOST:PORT",
+                        help="the address the production server listens on (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="the number of worker processes of the production server (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=8, metavar="N",
+                        help="the number of threads handling requests in the production server (default: %(default)s)")
+    parser.add_argument("--keep-alive", type=int, default=5, metavar="SECONDS",
+                        help="keep idle connections of the production server open this long (default: %(default)s)")
+    return parser.parse_args(args)
+
+
 def main(args=sys.argv[1:]):
     """
         Main function for the json server.
     """
-    if not args:
+    options = parse_args(args)
+    if not options.dbfile:
         sys.stderr.write("Error: no json database file given as first argument\n")
         return 1
 
-    if not os.path.exists(args[0]):
-        sys.stderr.write("Error: json database file at '%s' does not exist\n" % args[0])
+    if not os.path.exists(options.dbfile):
+        sys.stderr.write("Error: json database file at '%s' does not exist\n" % options.dbfile)
         return 1
 
-    server = create_jsonserver(args[0])
-
-    # flask app instance
-    app = create_app()
+    # set before the database is loaded and before workers are forked
+    JsonServer().foreign_key_naming = options.foreign_key
+
+    def load():
+        create_jsonserver(options.dbfile, journal=options.journal,
+                          compact_size=options.compact_size, compact_records=options.compact_records,
+                          durability=options.durability, commit_window=options.commit_window,
+                          codec=options.codec, feed_size=options.feed_size, lazy=options.lazy,
+                          storage=options.storage)
+
+    def factory():
+        profiler = Profiler(always=options.profile, slow_threshold=options.slow_request,
+                            dump_dir=options.profile_dir, dump_count=options.profile_count)
+        if options.serve == "uvicorn":
+            return create_asgi_app(flush=options.flush, codec=options.codec, cache_size=options.cache_size,
+                                   stream_threshold=options.stream_threshold, threads=options.threads,
+                                   metrics=options.metrics, profiler=profiler)
+
+        # flask app instance
+        return create_app(flush=options.flush, codec=options.codec, cache_size=options.cache_size,
+                          stream_threshold=options.stream_threshold, metrics=options.metrics, profiler=profiler)
+
+    if options.serve:
+        try:
+            serve(load, factory, server=options.serve, bind=options.bind, workers=options.workers,
+                  threads=options.threads, keep_alive=options.keep_alive)
+        except (ValueError, ImportError, RuntimeError) as e:
+            sys.stderr.write("Error: %s\n" % e)
+            return 1
+        finally:
+            JsonServer().close()
+        return 0
+
+    load()
+    app = factory()
     app.run(debug=True)
 
-    server.close()
+    JsonServer().close()
 
 
 if __name__ == "__main__":
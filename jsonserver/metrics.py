@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Metrics of the json server in the Prometheus text format.
+
+    Recording a metric takes no lock: every thread counts into its own
+    shard, which no other thread changes. The shards of a metric are only
+    summed up when the metrics are collected, thus recording stays cheap
+    while many threads serve requests.
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock, get_ident
+
+#: the buckets of duration histograms in seconds
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+#: the buckets of size histograms in bytes
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608, 33554432)
+
+#: the content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    """
+        Escape a label value of the text format
+    """
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_value(value):
+    """
+        Format a sample value of the text format
+    """
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    """
+        Format the labels of a sample
+
+        :params tuple names: the label names
+        :params tuple values: the label values
+        :params tuple extra: additional label name and value pairs
+    """
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join("{}=\"{}\"".format(name, escape(value)) for name, value in pairs) + "}"
+
+
+class Metric(object):
+    """
+        Base class of metrics recorded in a shard per thread.
+
+        A thread only ever changes its own shard. Shards are kept by thread
+        ident, thus a new thread reusing the ident of a finished thread
+        continues its counts and the number of shards stays bounded.
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        """
+            Create new metric.
+
+            :params string name: the name of the metric
+            :params string help: the description of the metric
+            :params tuple labels: the names of the labels of the metric
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._shards = {}
+        self._lock = Lock()
+
+    def _shard(self):
+        """
+            Returns the shard of the current thread
+        """
+        ident = get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            with self._lock:
+                shard = self._shards[ident] = {}
+        return shard
+
+    def _merged(self, merge):
+        """
+            Returns the values of all shards summed up by labels
+
+            :params callable merge: the function adding the value of a shard to a total or None
+
+            :rtype: dict
+        """
+        totals = {}
+        for shard in list(self._shards.values()):
+            for labels, value in list(shard.items()):
+                totals[labels] = merge(totals.get(labels), value)
+        return totals
+
+    def samples(self):
+        """
+            Returns the samples of the metric
+
+            :returns: the suffix of the name, the labels and the value of every sample
+            :rtype: list
+        """
+        raise NotImplementedError("this method has to be overwritten")
+
+    def render(self):
+        """
+            Render the metric in the text format
+
+            :rtype: list
+        """
+        lines = ["# HELP {} {}".format(self.name, self.help.replace("\\", "\\\\").replace("\n", "\\n")),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        for suffix, labels, value in self.samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, labels, format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    """
+        Counter which only ever increases.
+    """
+    type = "counter"
+
+    def inc(self, labels=(), amount=1):
+        """
+            Increase the counter
+
+            :params tuple labels: the label values
+            :params amount: the amount to add
+        """
+        shard = self._shards.get(get_ident())
+        if shard is None:
+            shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        """
+            Returns the current value of the counter
+        """
+        return self._merged(lambda total, value: (total or 0) + value).get(tuple(labels), 0)
+
+    def samples(self):
+        totals = self._merged(lambda total, value: (total or 0) + value)
+        return [("", format_labels(self.labels, labels), value) for labels, value in sorted(totals.items())]
+
+
+class Histogram(Metric):
+    """
+        Histogram counting observations in fixed buckets.
+
+        The buckets are fixed when the histogram is created, thus an
+        observation only increases the count of its bucket and the sum.
+    """
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        """
+            Create new histogram.
+
+            :params string name: the name of the metric
+            :params string help: the description of the metric
+            :params tuple labels: the names of the labels of the metric
+            :params tuple buckets: the ascending upper bounds of the buckets
+        """
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        """
+            Count an observation
+
+            :params value: the observed value
+            :params tuple labels: the label values
+        """
+        shard = self._shards.get(get_ident())
+        if shard is None:
+            shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, labels=()):
+        """
+            Observe the seconds spent within a with statement
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, labels)
+
+    def counts(self, labels=()):
+        """
+            Returns the number of observations and their sum
+
+            :rtype: tuple
+        """
+        counts = self._merged(self._merge).get(tuple(labels))
+        if counts is None:
+            return 0, 0
+        return sum(counts[:-1]), counts[-1]
+
+    @staticmethod
+    def _merge(total, counts):
+        if total is None:
+            return list(counts)
+        return [a + b for a, b in zip(total, counts)]
+
+    def samples(self):
+        samples = []
+        for labels, counts in sorted(self._merged(self._merge).items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", format_labels(self.labels, labels, [("le", format_value(bound))]), cumulative))
+            samples.append(("_sum", format_labels(self.labels, labels), counts[-1]))
+            samples.append(("_count", format_labels(self.labels, labels), cumulative))
+        return samples
+
+
+class Gauge(Metric):
+    """
+        Gauge whose values are read by a function when the metrics are collected.
+    """
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None):
+        """
+            Create new gauge.
+
+            :params string name: the name of the metric
+            :params string help: the description of the metric
+            :params tuple labels: the names of the labels of the metric
+            :params callable function: the function returning the values keyed by label values
+        """
+        super(Gauge, self).__init__(name, help, labels)
+        self.function = function
+
+    def samples(self):
+        values = self.function() if self.function is not None else {}
+        return [("", format_labels(self.labels, labels), value) for labels, value in sorted(values.items())]
+
+
+class Registry(object):
+    """
+        Registry of the metrics rendered by the metrics endpoint.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def register(self, metric):
+        """
+            Register a metric
+
+            :params Metric metric: the metric to register
+
+            :returns: the metric
+            :rtype: Metric
+
+            :raises ValueError: if a metric with the same name is already registered
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("Metric '{}' is already registered".format(metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        """
+            Register a new counter
+        """
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        """
+            Register a new histogram
+        """
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels=(), function=None):
+        """
+            Register a new gauge
+        """
+        return self.register(Gauge(name, help, labels, function))
+
+    def get(self, name):
+        """
+            Returns a registered metric
+
+            :raises KeyError: if no metric with this name is registered
+        """
+        return self._metrics[name]
+
+    def render(self):
+        """
+            Render all metrics in the Prometheus text format
+
+            :rtype: string
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+#: the metrics of the json server in this process
+REGISTRY = Registry()
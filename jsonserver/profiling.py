@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Profiling of single requests of the json server.
+
+    A profiled request records the seconds spent in spans like ``lookup``,
+    ``filter``, ``sort``, ``serialize`` and ``flush``. Spans are timed
+    exclusively: a span nested in another one is not counted twice, thus
+    the spans of a request add up to at most its duration. The profile of a
+    request is kept per thread, spans outside of a profiled request cost a
+    single attribute lookup.
+"""
+
+import os
+import re
+import json
+import time
+import heapq
+import logging
+import cProfile
+from itertools import count
+from threading import Lock, local
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+_local = local()
+
+#: the span of threads without a profiled request
+NO_SPAN = nullcontext()
+
+#: held by the request running under cProfile, cProfile can only profile one request of the process at a time
+_capturing = Lock()
+
+
+def span(name):
+    """
+        Returns a context manager timing a span of the profiled request of the current thread
+
+        :params string name: the name of the span
+    """
+    profile = getattr(_local, "profile", None)
+    return NO_SPAN if profile is None else profile.span(name)
+
+
+def activate(profile):
+    """
+        Make a profile the profile of the current thread, or None to stop recording spans
+    """
+    _local.profile = profile
+
+
+class Profile(object):
+    """
+        Profile of a single request.
+    """
+    def __init__(self, spans=False, profiler=False):
+        """
+            Create new profile and start it.
+
+            :params bool spans: if the spans of the request are recorded
+            :params bool profiler: if the request is profiled by cProfile as well, unless another request already is
+        """
+        self.spans = {} if spans else None
+        self.duration = None
+        self.profiler = cProfile.Profile() if profiler and _capturing.acquire(blocking=False) else None
+        self._nested = []
+        self._started = time.perf_counter()
+        if spans:
+            activate(self)
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    @contextmanager
+    def span(self, name):
+        """
+            Time a span, excluding the spans nested into it
+        """
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            self.spans[name] = self.spans.get(name, 0.0) + elapsed - nested
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def stop(self):
+        """
+            Stop the profile, stopping it again has no effect
+
+            :returns: the duration of the request in seconds
+            :rtype: float
+        """
+        if self.duration is None:
+            if self.profiler is not None:
+                self.profiler.disable()
+                _capturing.release()
+            if getattr(_local, "profile", None) is self:
+                activate(None)
+            self.duration = time.perf_counter() - self._started
+        return self.duration
+
+    def breakdown(self):
+        """
+            Returns the milliseconds of the spans and of the rest of the request as ``other``
+
+            :rtype: dict
+        """
+        spans = {name: round(seconds * 1000, 3) for name, seconds in sorted(self.spans.items())}
+        spans["other"] = round(max(self.duration - sum(self.spans.values()), 0.0) * 1000, 3)
+        return spans
+
+    def server_timing(self):
+        """
+            Returns the spans as ``Server-Timing`` header
+        """
+        timings = ["{};dur={}".format(name, ms) for name, ms in self.breakdown().items()]
+        return ", ".join(timings + ["total;dur={}".format(round(self.duration * 1000, 3))])
+
+
+class Profiler(object):
+    """
+        Profiler of the requests of an app.
+
+        Requests are profiled if profiling is enabled for all requests or if
+        the request asks for it. Every request slower than the threshold is
+        logged as a json object, including its spans if it was profiled. If a
+        directory is given, profiled requests run under cProfile and the stats
+        of the slowest ones are kept there for ``python -m pstats``. Only one
+        request runs under cProfile at a time, the requests profiled meanwhile
+        record their spans only.
+    """
+    def __init__(self, always=False, slow_threshold=0, dump_dir=None, dump_count=10):
+        """
+            Create new profiler.
+
+            :params bool always: if every request is profiled
+            :params float slow_threshold: the seconds after which a request is logged as slow, 0 to disable
+            :params string dump_dir: the directory to keep the cProfile stats in or None to disable cProfile
+            :params int dump_count: the number of slowest requests whose stats are kept
+        """
+        self.always = always
+        self.slow_threshold = slow_threshold
+        self.dump_dir = dump_dir
+        self.dump_count = dump_count
+        self._slowest = []
+        self._lock = Lock()
+        self._counter = count()
+        if dump_dir:
+            os.makedirs(dump_dir, exist_ok=True)
+
+    def start(self, requested=False):
+        """
+            Start the profile of a request
+
+            :params bool requested: if the request asks to be profiled
+
+            :rtype: Profile
+        """
+        profiled = self.always or requested
+        return Profile(spans=profiled, profiler=profiled and bool(self.dump_dir))
+
+    def finish(self, profile, method, path, status):
+        """
+            Stop the profile of a request, log it if it was slow and keep its stats if it is one of the slowest
+
+            :params Profile profile: the profile of the request
+            :params string method: the method of the request
+            :params string path: the path and the query of the request
+            :params int status: the status code of the response
+
+            :returns: the file the cProfile stats were written to or None
+            :rtype: string
+        """
+        duration = profile.stop()
+        dump = self._dump(profile, method, path) if profile.profiler is not None else None
+        if self.slow_threshold and duration >= self.slow_threshold:
+            entry = {"method": method, "path": path, "status": status, "duration_ms": round(duration * 1000, 3)}
+            if profile.spans is not None:
+                entry["spans"] = profile.breakdown()
+            if dump is not None:
+                entry["profile"] = dump
+            logger.warning("slow request %s", json.dumps(entry))
+        return dump
+
+    def _dump(self, profile, method, path):
+        """
+            Write the cProfile stats of a request if it is one of the ``dump_count`` slowest
+
+            The stats of the request it displaces are removed.
+        """
+        name = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")[:64] or "root"
+        dump = os.path.join(self.dump_dir, "{:.0f}ms-{}-{}-{}.prof".format(
+            profile.duration * 1000, method, name, next(self._counter)))
+        with self._lock:
+            entry = (profile.duration, dump)
+            if len(self._slowest) < self.dump_count:
+                heapq.heappush(self._slowest, entry)
+                displaced = None
+            elif self._slowest and entry > self._slowest[0]:
+                displaced = heapq.heapreplace(self._slowest, entry)[1]
+            else:
+                return None
+            profile.profiler.dump_stats(dump)
+        if displaced is not None:
+            try:
+                os.remove(displaced)
+            except OSError:
+                pass
+        return dump
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Conditions and sorting used by the query engine of the json server.
+"""
+
+import re
+import json
+
+#: marker for columns missing in a row
+MISSING = object()
+
+
+class Condition(object):
+    """
+        Condition on a column of a row.
+
+        A condition compares the column against one or more representations
+        of a value, e.g. the number ``1`` and the string ``"1"`` parsed from
+        a query string. It holds if it holds for any of the representations.
+    """
+    #: operators and their query string suffixes
+    OPERATORS = ("eq", "ne", "gt", "gte", "lt", "lte", "like")
+
+    def __init__(self, column, operator, *values):
+        """
+            Create new condition.
+
+            :params string column: the column to compare
+            :params string operator: the operator, one of ``OPERATORS``
+            :params values: the representations of the value to compare with
+
+            :raises ValueError: if the operator is unknown or the like pattern is invalid
+        """
+        if operator not in self.OPERATORS:
+            raise ValueError("Unknown operator '{}'".format(operator))
+
+        self.column = column
+        self.operator = operator
+        self.values = values
+
+        if operator == "like":
+            try:
+                self._pattern = re.compile(str(values[-1]), re.IGNORECASE)
+            except re.error as e:
+                raise ValueError("Invalid pattern for column '{}': {}".format(column, e))
+
+    def __repr__(self):
+        return "Condition({!r}, {!r}, {})".format(self.column, self.operator, ", ".join(repr(v) for v in self.values))
+
+    @classmethod
+    def parse(cls, key, value):
+        """
+            Parse a condition from a query string argument like ``views_gte=10``
+
+            The value is compared both as json value (number, boolean or null)
+            and as plain string.
+
+            :params string key: the column with an optional operator suffix
+            :params string value: the value to compare with
+
+            :rtype: Condition
+        """
+        column, operator = key, "eq"
+        if "_" in key:
+            name, suffix = key.rsplit("_", 1)
+            if name and suffix in cls.OPERATORS:
+                column, operator = name, suffix
+
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            parsed = value
+        if isinstance(parsed, (list, dict, str)):
+            return cls(column, operator, value)
+        return cls(column, operator, parsed, value)
+
+    @property
+    def indexable(self):
+        """
+            If the condition can be looked up in a hash index
+        """
+        return self.operator == "eq"
+
+    def matches(self, row):
+        """
+            Checks if a row fulfills the condition
+
+            :params dict row: the row to check
+
+            :rtype: bool
+        """
+        value = row.get(self.column, MISSING)
+        if self.operator == "eq":
+            return value is not MISSING and any(value == v for v in self.values)
+        if self.operator == "ne":
+            return all(value != v for v in self.values)
+        if value is MISSING or value is None:
+            return False
+        if self.operator == "like":
+            return self._pattern.search(value if isinstance(value, str) else json.dumps(value)) is not None
+
+        for v in self.values:
+            try:
+                if self.operator == "gt":
+                    return value > v
+                if self.operator == "gte":
+                    return value >= v
+                if self.operator == "lt":
+                    return value < v
+                return value <= v
+            except TypeError:  # try the next representation
+                continue
+        return False
+
+
+def sort_key(column):
+    """
+        Returns a sort key function for a column of rows
+
+        Values of different types are ordered: numbers, strings, other
+        values and finally rows missing the column or having a null value.
+
+        :params string column: the column to sort by
+
+        :rtype: callable
+    """
+    def key(row):
+        value = row.get(column)
+        if value is None:
+            return (3, 0)
+        if isinstance(value, (int, float)):
+            return (0, value)
+        if isinstance(value, str):
+            return (1, value)
+        return (2, json.dumps(value, sort_keys=True))
+    return key
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Replication of the json server to several processes.
+
+    A single writer process owns the database and its storage. Reader
+    processes hold a replica of the data, which is kept up to date by
+    a change feed over a Unix socket. Writes to a replica are forwarded
+    to the writer, thus all writes are applied in a single order.
+
+    Messages are json objects, one per line:
+
+    * ``{"op": "subscribe"}`` is answered with a ``snapshot`` message
+      followed by a ``change`` message for every change of the data.
+    * ``{"op": "call", "method": ..., "kwargs": ...}`` calls a method
+      of the writer and is answered with its result or error and the
+      sequence number of the last change at that time.
+"""
+
+import os
+import queue
+import socket
+import builtins
+import logging
+from inspect import signature
+from threading import Thread, Condition, Lock, local
+
+from jsonserver import exceptions
+from jsonserver.core import JsonServer
+from jsonserver.codec import get_codec
+from jsonserver.exceptions import JsonServerError
+
+logger = logging.getLogger(__name__)
+
+#: the methods of the writer which can be called by replicas
+METHODS = ("create", "drop", "insert", "remove", "update", "bulk",
+           "create_index", "drop_index", "flush", "commit", "compact")
+
+
+def remote_error(name, message):
+    """
+        Returns an exception raised by the writer
+
+        :params string name: the name of the exception class
+        :params string message: the message of the exception
+
+        :rtype: Exception
+    """
+    cls = getattr(exceptions, name, None) or getattr(builtins, name, None)
+    if not isinstance(cls, type) or not issubclass(cls, Exception):
+        cls = JsonServerError
+
+    error = cls.__new__(cls)
+    Exception.__init__(error, message)
+    return error
+
+
+class ReplicationServer(Thread):
+    """
+        Thread serving the change feed and the writes of the replicas
+        of a json server on a Unix socket.
+    """
+    def __init__(self, server, path, codec=None):
+        """
+            Create new replication server thread.
+
+            :params JsonServer server: the writer
+            :params string path: the path of the Unix socket to listen on
+            :params string codec: the json codec of the messages
+        """
+        super(ReplicationServer, self).__init__(name="jsonserver-replication")
+        self.daemon = True
+        self.path = path
+        self.codec = get_codec(codec)
+        self._server = server
+        self._feeds = set()
+        self._connections = set()
+        self._lock = Lock()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        self._socket.listen(128)
+
+    def stop(self):
+        """
+            Stop serving and close all connections
+        """
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+        with self._lock:
+            for feed in self._feeds:
+                feed.put(None)
+            for connection in self._connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        if self.is_alive():
+            self.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def run(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:  # stopped
+                return
+
+            with self._lock:
+                self._connections.add(connection)
+            Thread(target=self._handle, args=(connection,), name="jsonserver-replication-connection", daemon=True).start()
+
+    def _handle(self, connection):
+        try:
+            for line in connection.makefile("rb"):
+                message = self.codec.loads(line)
+                if message["op"] == "subscribe":
+                    self._feed(connection)
+                    return
+                connection.sendall(self.codec.dumps(self._call(message)) + b"\n")
+        except OSError:
+            pass
+        except Exception:
+            logger.exception("Failed to serve replica")
+        finally:
+            with self._lock:
+                self._connections.discard(connection)
+            connection.close()
+
+    def _call(self, message):
+        """
+            Call a method of the writer requested by a replica
+
+            :params dict message: the call message
+
+            :returns: the reply message
+            :rtype: dict
+        """
+        method = message["method"]
+        if method not in METHODS:
+            return {"error": "JsonServerError", "message": "Method '{}' cannot be called by replicas".format(method)}
+
+        try:
+            result = getattr(self._server, method)(**message["kwargs"])
+        except Exception as e:
+            return {"error": type(e).__name__, "message": str(e)}
+        return {"result": result, "sequence": self._server.sequence}
+
+    def _feed(self, connection):
+        """
+            Send a snapshot and all later changes to a replica
+
+            :params socket connection: the connection of the replica
+        """
+        changes = queue.Queue()
+        listener = lambda sequence, record: changes.put({"op": "change", "sequence": sequence, "record": record})
+        with self._lock:
+            self._feeds.add(changes)
+
+        data, sequence, indexes = self._server.subscribe(listener)
+        try:
+            snapshot = {"op": "snapshot", "sequence": sequence, "data": data, "indexes": indexes}
+            connection.sendall(self.codec.dumps(snapshot) + b"\n")
+            del data, snapshot  # release the copy of the data while following the changes
+
+            while True:
+                messages = [changes.get()]
+                while not changes.empty():  # send all pending changes at once
+                    messages.append(changes.get())
+                if None in messages:
+                    return
+                connection.sendall(b"".join(self.codec.dumps(m) + b"\n" for m in messages))
+        finally:
+            self._server.unsubscribe(listener)
+            with self._lock:
+                self._feeds.discard(changes)
+
+
+class Replica(object):
+    """
+        Replica of the database of a writer process.
+
+        The replica applies the change feed of the writer to the local json
+        server in a background thread. Writes to the local json server are
+        forwarded to the writer. They return as soon as their change is applied
+        to the replica, thus a client always reads its own writes.
+    """
+    def __init__(self, server, path, codec=None):
+        """
+            Create new replica.
+
+            :params JsonServer server: the local json server
+            :params string path: the path of the Unix socket of the writer
+            :params string codec: the json codec of the messages
+        """
+        self.path = path
+        self.codec = get_codec(codec)
+        self._server = server
+        self._sequence = 0
+        self._closed = False
+        self._condition = Condition()
+        self._connections = local()
+        self._feed = None
+        self._thread = None
+
+    @property
+    def sequence(self):
+        """
+            The sequence number of the last change applied to the replica
+        """
+        return self._sequence
+
+    def start(self):
+        """
+            Load a snapshot from the writer and follow its changes
+        """
+        self._feed = self._connect()
+        self._feed.sendall(self.codec.dumps({"op": "subscribe"}) + b"\n")
+        lines = self._feed.makefile("rb")
+        snapshot = self.codec.loads(lines.readline())
+
+        self._sequence = snapshot["sequence"]
+        self._server.open_replica(self, snapshot["data"], snapshot["sequence"], snapshot["indexes"])
+        self._thread = Thread(target=self._follow, args=(lines,), name="jsonserver-replica", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+            Stop following the writer
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        if self._feed is not None:
+            try:
+                self._feed.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._feed.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(self.path)
+        return connection
+
+    def _follow(self, lines):
+        try:
+            for line in lines:
+                message = self.codec.loads(line)
+                self._server.apply(message["record"], message["sequence"])
+                with self._condition:
+                    self._sequence = message["sequence"]
+                    self._condition.notify_all()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self._condition:
+                if not self._closed:
+                    logger.error("Lost the change feed of the writer at '%s'", self.path)
+                self._closed = True
+                self._condition.notify_all()
+
+    def wait(self, sequence):
+        """
+            Wait until a change is applied to the replica
+
+            :params int sequence: the sequence number of the change
+
+            :raises JsonServerError: if the change feed of the writer is lost
+        """
+        with self._condition:
+            while self._sequence < sequence:
+                if self._closed:
+                    raise JsonServerError("Lost the change feed of the writer at '{}'".format(self.path))
+                self._condition.wait()
+
+    def call(self, method, *args, **kwargs):
+        """
+            Call a method of the writer and wait until its changes are applied to the replica
+
+            :params string method: the name of the method
+            :params args: the positional arguments of the method
+            :params kwargs: the keyword arguments of the method
+
+            :returns: the result of the method
+        """
+        arguments = signature(getattr(JsonServer, method)).bind(None, *args, **kwargs).arguments
+        arguments.pop("self")
+        if isinstance(arguments.get("update"), dict):  # json objects only have string keys
+            arguments["update"] = list(arguments["update"].items())
+
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            connection = self._connections.connection = self._connect()
+            self._connections.lines = connection.makefile("rb")
+
+        try:
+            connection.sendall(self.codec.dumps({"op": "call", "method": method, "kwargs": arguments}) + b"\n")
+            line = self._connections.lines.readline()
+            if not line:
+                raise OSError("connection closed")
+        except OSError as e:
+            connection.close()
+            self._connections.connection = None
+            raise JsonServerError("Lost the connection to the writer at '{}': {}".format(self.path, e))
+
+        reply = self.codec.loads(line)
+        if "error" in reply:
+            raise remote_error(reply["error"], reply["message"])
+
+        self.wait(reply["sequence"])
+        return reply["result"]
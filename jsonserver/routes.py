@@ -1,59 +1,533 @@
 # -*- coding: utf-8 -*-
 
-from flask import Blueprint, jsonify, request
+import time
+from itertools import chain
+from urllib.parse import urlencode
+from flask import Blueprint, Response, abort, current_app, g, request
 
 from jsonserver.core import JsonServer
+from jsonserver.codec import get_codec
+from jsonserver.query import Condition
+from jsonserver.metrics import REGISTRY, SIZE_BUCKETS, CONTENT_TYPE
+from jsonserver.profiling import span
+from jsonserver.exceptions import ChangesExpired
 
 api = Blueprint("api", __name__)
 
+#: the requests handled by route, method and status
+REQUESTS = REGISTRY.counter("jsonserver_http_requests_total", "Requests handled.", ("method", "route", "status"))
+
+#: the seconds spent handling the requests by route and method
+REQUEST_DURATION = REGISTRY.histogram("jsonserver_http_request_duration_seconds",
+                                      "Seconds spent handling requests.", ("method", "route"))
+
+#: the sizes of the response bodies by route and method, streamed responses are left out
+RESPONSE_SIZE = REGISTRY.histogram("jsonserver_http_response_size_bytes",
+                                   "Sizes of the response bodies.", ("method", "route"), SIZE_BUCKETS)
+
+
+def flush():
+    """
+        Returns if changes made by a request are flushed before responding
+    """
+    return current_app.config.get("JSONSERVER_FLUSH", False)
+
+
+def app_codec():
+    """
+        Returns the json codec of the app
+    """
+    codec = current_app.config.get("JSONSERVER_CODEC")
+    if codec is None:
+        codec = current_app.config["JSONSERVER_CODEC"] = get_codec()
+    return codec
+
+
+def metrics_enabled():
+    """
+        Returns if the app records and serves metrics
+    """
+    return current_app.config.get("JSONSERVER_METRICS", True)
+
+
+@api.before_app_request
+def start_request():
+    if metrics_enabled():
+        g.jsonserver_started = time.perf_counter()
+
+
+@api.after_app_request
+def record_request(response):
+    """
+        Record the duration, the status and the size of the response of a request
+    """
+    started = g.pop("jsonserver_started", None)
+    if started is None:
+        return response
+
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    labels = (request.method, route)
+    REQUEST_DURATION.observe(time.perf_counter() - started, labels)
+    REQUESTS.inc(labels + (str(response.status_code),))
+    if response.content_length is not None:  # streamed responses have no length, they are not buffered to count it
+        RESPONSE_SIZE.observe(response.content_length, labels)
+    return response
+
+
+#: the header asking for a profile of a single request
+PROFILE_HEADER = "X-Profile"
+
+
+@api.before_app_request
+def start_profile():
+    profiler = current_app.config.get("JSONSERVER_PROFILER")
+    if profiler is not None:
+        g.jsonserver_profile = profiler.start(requested=PROFILE_HEADER in request.headers)
+
+
+@api.after_app_request
+def finish_profile(response):
+    """
+        Finish the profile of a request, its spans are sent in the ``Server-Timing`` header
+
+        The chunks of a streamed response are encoded after the request is finished, thus they are not profiled.
+    """
+    profile = g.pop("jsonserver_profile", None)
+    if profile is None:
+        return response
+
+    current_app.config["JSONSERVER_PROFILER"].finish(profile, request.method, request.full_path.rstrip("?"),
+                                                      response.status_code)
+    if profile.spans is not None:
+        response.headers["Server-Timing"] = profile.server_timing()
+    return response
+
+
+@api.teardown_app_request
+def stop_profile(exc=None):
+    # stops the profile of a request which failed before it was finished
+    profile = g.pop("jsonserver_profile", None)
+    if profile is not None:
+        profile.stop()
+
+
+def encode(data):
+    """
+        Encode data with the codec of the app
+    """
+    with span("serialize"):
+        return app_codec().dumps(data)
+
+
+def jsonify(data, status=200):
+    """
+        Create a json response encoded with the codec of the app
+    """
+    return Response(encode(data), status=status, mimetype="application/json")
+
+
+#: number of rows encoded at once in a streamed response
+STREAM_BATCH_SIZE = 500
+
+
+def streamable(data):
+    """
+        Returns if the data is a large set of tables which is streamed instead of encoded at once
+    """
+    threshold = current_app.config.get("JSONSERVER_STREAM_THRESHOLD")
+    if not threshold or not isinstance(data, dict):
+        return False
+    if any(not isinstance(rows, list) for rows in data.values()):
+        return False
+    return sum(len(rows) for rows in data.values()) > threshold
+
+
+def stream(data, cache=None, key=None, version=None, headers=None):
+    """
+        Create a streamed json response for a set of tables
+
+        The rows are encoded in small batches while the response is sent,
+        thus the encoded document is never held in memory as a whole.
+        If a cache is given, the response is cached as well as long as
+        it fits into the cache.
+
+        :params dict data: the tables to stream
+        :params ResponseCache cache: the cache to store the response in
+        :params tuple key: the endpoint and its arguments
+        :params version: the version of the data, read before the data is built
+        :params dict headers: the headers of the response derived from the data
+    """
+    codec = app_codec()
+    tables = [(name, list(rows)) for name, rows in data.items()]
+
+    def generate():
+        yield b"{"
+        for i, (name, rows) in enumerate(tables):
+            yield (b"," if i else b"") + codec.dumps(name) + b":["
+            for start in range(0, len(rows), STREAM_BATCH_SIZE):
+                batch = codec.dumps(rows[start:start + STREAM_BATCH_SIZE])[1:-1]
+                yield (b"," if start else b"") + batch
+            yield b"]"
+        yield b"}"
+
+    def generate_cached():
+        chunks, size = [], 0
+        for chunk in generate():
+            if chunks is not None:
+                size += len(chunk)
+                if size <= cache.max_bytes:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+            yield chunk
+        if chunks is not None:
+            cache.put(key, version, b"".join(chunks), headers)
+
+    return Response(generate() if cache is None else generate_cached(), mimetype="application/json", headers=headers)
+
+
+def cached(key, version, get_data, headers=None):
+    """
+        Create a json response which is cached for the given data version
+
+        :params tuple key: the endpoint and its arguments
+        :params version: the version of the data, read before the data is built
+        :params callable get_data: the function returning the data of the response
+        :params dict headers: the headers of the response derived from the data,
+                              filled by ``get_data`` and cached with the response
+    """
+    cache = current_app.config.get("JSONSERVER_CACHE")
+    if cache is not None:
+        entry = cache.lookup(key, version)
+        if entry is not None:
+            return Response(entry[0], mimetype="application/json", headers=entry[1])
+
+    data = get_data()
+    if streamable(data):
+        return stream(data, cache, key, version, headers)
+
+    body = encode(data)
+    if cache is not None:
+        cache.put(key, version, body, headers)
+    return Response(body, mimetype="application/json", headers=headers)
+
+
+def conditional(key, version, modified, get_data, headers=None):
+    """
+        Create a conditional json response for the given data version
+
+        The ETag is built from the version of the data and the
+        modification time is sent as Last-Modified. If the client
+        already has this version, an empty ``304 Not Modified`` response
+        is returned without building the data at all.
+
+        HTTP dates have whole seconds, thus Last-Modified is the end of the
+        second of the last change once that second is over, and the data
+        is only not modified if it was changed before If-Modified-Since.
+        A change made after a response was sent is never before its date.
+
+        :params tuple key: the endpoint and its arguments
+        :params tuple version: the versions of the data, read before the data is built
+        :params float modified: the time of the last change of the data
+        :params callable get_data: the function returning the data of the response
+        :params dict headers: the headers of the response derived from the data, filled by ``get_data``,
+                              they are left out of a ``304 Not Modified`` response, the client keeps its own
+    """
+    if None in version:  # the requested row does not exist
+        response = jsonify(get_data())
+        response.headers.extend(headers or {})
+        return response
+
+    etag = "-".join([JsonServer().epoch, app_codec().name] + [str(v) for v in version])
+    last_modified = min(int(modified) + 1, int(time.time()))
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        not_modified = since is not None and modified < since.timestamp()
+
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = cached(key, version, get_data, headers)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+
+def int_arg(name, default=None):
+    """
+        Returns a non-negative integer query argument
+
+        :raises BadRequest: if the argument is not a non-negative integer
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+
+    try:
+        value = int(value)
+    except ValueError:
+        value = -1
+    if value < 0:
+        abort(400, "Query argument '{}' has to be a non-negative integer".format(name))
+    return value
+
+
+def list_arg(name):
+    """
+        Returns the values of a query argument given several times or separated by commas
+    """
+    return [value for arg in request.args.getlist(name) for value in arg.split(",") if value]
+
+
+def relations():
+    """
+        Returns the tables of the ``_embed`` and ``_expand`` query arguments
+        and the versions of the tables
+
+        :returns: the tables to embed, the tables to expand and the versions of both
+        :rtype: tuple
+    """
+    server = JsonServer()
+    embed, expand = list_arg("_embed"), list_arg("_expand")
+    return embed, expand, tuple(server.version(related) for related in embed + expand)
+
+
+def page_links(limit, offset, after, rows, total):
+    """
+        Returns the Link header for a page of rows
+    """
+    def link(rel, **args):
+        query = request.args.to_dict()
+        for key, value in args.items():
+            if value is None:
+                query.pop(key, None)
+            else:
+                query[key] = value
+        return '<{}?{}>; rel="{}"'.format(request.base_url, urlencode(sorted(query.items())), rel)
+
+    links = []
+    if after is not None:
+        if limit is not None and len(rows) == limit and rows and "id" in rows[-1]:
+            links.append(link("next", _after=rows[-1]["id"], _offset=None))
+    elif limit:
+        links.append(link("first", _offset=0))
+        if offset > 0:
+            links.append(link("prev", _offset=max(offset - limit, 0)))
+        if offset + limit < total:
+            links.append(link("next", _offset=offset + limit))
+        links.append(link("last", _offset=max(total - 1, 0) // limit * limit))
+    return ", ".join(links)
+
+
+def query_table(table):
+    """
+        Create the response for the rows of a table selected by the query arguments
+
+        Supported are ``_limit``, ``_offset`` and ``_after`` for paging,
+        ``_sort`` and ``_order`` for sorting, ``_fields`` for projecting the rows
+        to some columns, ``_embed`` and ``_expand`` for embedding related rows
+        and ``<column>[_<operator>]=<value>`` for filtering.
+    """
+    server = JsonServer()
+    limit = int_arg("_limit")
+    offset = int_arg("_offset", 0)
+    after = int_arg("_after")
+    sort = request.args.get("_sort") or None
+    order = request.args.get("_order", "asc").lower()
+    fields = list_arg("_fields") or None
+    embed, expand, related = relations()
+
+    try:
+        conditions = [Condition.parse(key, value) for key, value in request.args.items(multi=True)
+                      if not key.startswith("_")]
+        if order not in ("asc", "desc"):
+            raise ValueError("Query argument '_order' has to be asc or desc")
+    except ValueError as e:
+        abort(400, str(e))
+
+    version = (server.version(table),) + related
+    modified = max(server.modified(t) for t in [table] + embed + expand)
+    key = ("query", table, tuple(sorted(request.args.items(multi=True))))
+    headers = {}
+
+    def get_data():
+        rows, total = server.query(table, conditions, sort=sort, order=order, fields=fields,
+                                   limit=limit, offset=offset, after=after, embed=embed, expand=expand)
+        headers["X-Total-Count"] = str(total)
+        links = page_links(limit, offset, None if sort else after, rows, total)
+        if links:
+            headers["Link"] = links
+        return {table: rows}
+
+    return conditional(key, version, modified, get_data, headers)
+
 
 @api.route("/", methods=["GET"])
 def all():
-    data = JsonServer().all()
-    return jsonify(data)
+    server = JsonServer()
+    return conditional(("all",), (server.version(),), server.modified(), server.all)
+
+
+#: maximum seconds a long-poll request for changes waits
+MAX_POLL_TIMEOUT = 60
+
+
+def changes_args(args, headers):
+    """
+        Returns the sequence number, the tables and the timeout of a request for changes
+
+        The sequence number is taken from the ``since`` query argument or the
+        ``Last-Event-ID`` header, which a reconnecting event source sends.
+
+        :params args: the query arguments
+        :params headers: the request headers
+
+        :raises ValueError: if an argument is not a non-negative integer
+    """
+    since = args.get("since", headers.get("Last-Event-ID"))
+    timeout = args.get("timeout", "0")
+    if (since is not None and not since.isdigit()) or not timeout.isdigit():
+        raise ValueError("Query arguments 'since' and 'timeout' have to be non-negative integers")
+    tables = args.getlist("table") or None
+    return None if since is None else int(since), tables, min(int(timeout), MAX_POLL_TIMEOUT)
+
+
+@api.route("/_changes", methods=["GET"])
+def changes():
+    """
+        Returns the changes after the ``since`` sequence number
+
+        The request waits up to ``timeout`` seconds for a change if there is none yet.
+        Clients accepting ``text/event-stream`` get the changes as server-sent events instead.
+        If the changes were already dropped from the feed, ``410 Gone`` is returned
+        and the client has to load the data again.
+    """
+    feed = JsonServer().changes
+    try:
+        since, tables, timeout = changes_args(request.args, request.headers)
+        if "text/event-stream" in request.headers.get("Accept", ""):
+            events = feed.stream(since, app_codec(), tables)
+            first = next(events)  # raises if the changes already expired
+            return Response(chain([first], events), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+        found, last = feed.poll(since, tables, timeout)
+    except ValueError as e:
+        abort(400, str(e))
+    except ChangesExpired as e:
+        abort(410, str(e))
+    return jsonify({"changes": found, "last": last})
+
+
+@api.route("/_metrics", methods=["GET"])
+def metrics():
+    """
+        Returns the metrics of this process in the Prometheus text format
+    """
+    if not metrics_enabled():
+        abort(404)
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 
 @api.route("/<table>", methods=["GET"])
 def get_table(table):
-    data = JsonServer().get(table=table)
-    return jsonify(data)
+    if request.args:
+        return query_table(table)
+
+    server = JsonServer()
+    return conditional(("table", table), (server.version(table),), server.modified(table),
+                       lambda: server.get(table=table))
 
 
 @api.route("/<table>/<id>", methods=["GET"])
 def get_row(table, id):
-    data = JsonServer().get(table=table, id=int(id))
-    return jsonify(data)
+    """
+        Returns a row, including the related rows of the ``_embed`` and ``_expand`` tables
+    """
+    server = JsonServer()
+    embed, expand, related = relations()
+    version = (server.version(table, int(id)),) + related
+    modified = max(server.modified(t) for t in [table] + embed + expand)
+    return conditional(("row", table, int(id), tuple(embed), tuple(expand)), version, modified,
+                       lambda: server.get_row(table, int(id), embed=embed, expand=expand))
 
 
 @api.route("/<table1>/<id>/<table2>", methods=["GET"])
 def get_row_sub_table(table1, id, table2):
-    data = JsonServer().get(table=table1, id=int(id), subtable=table2)
-    return jsonify(data)
+    server = JsonServer()
+    version = (server.version(table1, int(id)), server.version(table2))
+    modified = max(server.modified(table1), server.modified(table2))
+    return conditional(("subtable", table1, int(id), table2), version, modified,
+                       lambda: server.get(table=table1, id=int(id), subtable=table2))
 
 
 @api.route("/", methods=["POST"])
 def create_table():
     table = request.get_json()["table"]
-    JsonServer().create(table)
+    JsonServer().create(table, flush=flush())
+    return jsonify({table: []}, status=201)
 
 
 @api.route("/<table>", methods=["DELETE"])
 def drop_table(table):
-    JsonServer().drop(table)
+    JsonServer().drop(table, flush=flush())
+    return Response(status=204)
 
 
 @api.route("/<table>", methods=["POST"])
 def insert_row(table):
     row = request.get_json()["row"]
-    JsonServer().insert(table, row)
+    row["id"] = JsonServer().insert(table, row, flush=flush())
+    return jsonify(row, status=201)
 
 
 @api.route("/<table>/<row>", methods=["DELETE"])
 def remove_row(table, row):
-    JsonServer().remove(table, int(row))
+    JsonServer().remove(table, int(row), flush=flush())
+    return Response(status=204)
 
 
 @api.route("/<table>/<row_id>", methods=["PUT", "PATCH"])
 def update_row(table, row_id):
     row = request.get_json()["row"]
-    JsonServer().update(table, int(row_id), row)
+    server = JsonServer()
+    server.update(table, int(row_id), row, flush=flush())
+    return jsonify(server.get_row(table, int(row_id)))
+
+
+@api.route("/<table>/_bulk", methods=["POST"])
+def bulk(table):
+    batch = request.get_json()
+    if not isinstance(batch, dict):
+        abort(400, "The batch has to be an object")
+    insert, update, remove = batch.get("insert", []), batch.get("update", []), batch.get("remove", [])
+    if any(not isinstance(rows, list) for rows in (insert, update, remove)):
+        abort(400, "The rows to insert, update and remove have to be lists")
+    if any(not isinstance(row, dict) for row in insert):
+        abort(400, "The rows to insert have to be objects")
+    if any(not isinstance(row, dict) or "id" not in row for row in update):
+        abort(400, "The rows to update have to be objects with an id")
+    try:
+        updates = {int(row["id"]): row for row in update}
+        remove = [int(row_id) for row_id in remove]
+    except (TypeError, ValueError):
+        abort(400, "The ids of the rows to update and to remove have to be integers")
+    result = JsonServer().bulk(table, insert=insert, update=updates, remove=remove, flush=flush())
+    return jsonify(result)
+
+
+@api.route("/<table>/_indexes", methods=["POST"])
+def create_index(table):
+    column = request.get_json()["column"]
+    server = JsonServer()
+    server.create_index(table, column)
+    return jsonify({"indexes": server.indexes(table)})
+
+
+@api.route("/<table>/_indexes/<column>", methods=["DELETE"])
+def drop_index(table, column):
+    server = JsonServer()
+    server.drop_index(table, column)
+    return jsonify({"indexes": server.indexes(table)})
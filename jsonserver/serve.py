@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Production servers for the json server.
+
+    The servers are optional dependencies: waitress (``pip install waitress``),
+    gunicorn (``pip install gunicorn``) or uvicorn (``pip install uvicorn``).
+    uvicorn serves the asyncio application, the others the Flask application.
+"""
+
+import os
+import shutil
+import signal
+import logging
+import tempfile
+
+from jsonserver.core import JsonServer
+from jsonserver.replication import ReplicationServer, Replica
+
+logger = logging.getLogger(__name__)
+
+#: the supported production servers
+SERVERS = ("waitress", "gunicorn", "uvicorn")
+
+
+def serve(load, factory, server="waitress", bind="127.0.0.1:5000", workers=1, threads=8, keep_alive=5):
+    """
+        Serve the app created by the factory with a production server.
+
+        With a single worker, the database is loaded once within the process
+        serving the requests and shared by all threads.
+
+        With several workers (gunicorn only), the database is loaded by
+        a separate writer process. Every worker holds a replica of it which
+        follows the changes of the writer and forwards its writes to it.
+
+        :params callable load: the function opening the database
+        :params callable factory: the function creating the app
+        :params string server: the server to use, one of ``SERVERS``
+        :params string bind: the address to listen on as host:port
+        :params int workers: the number of worker processes
+        :params int threads: the number of threads handling requests
+        :params int keep_alive: the seconds to keep idle connections open
+
+        :raises ValueError: if the server is unknown or the options are invalid
+        :raises ImportError: if the server is not installed
+    """
+    if server not in SERVERS:
+        raise ValueError("Unknown server '{}', expected one of: {}".format(server, ", ".join(SERVERS)))
+    if workers < 1:
+        raise ValueError("At least one worker process is required to serve requests")
+    if workers > 1 and server != "gunicorn":
+        raise ValueError("Several worker processes are only supported by gunicorn")
+    if threads < 1:
+        raise ValueError("At least one thread is required to serve requests")
+
+    if server == "waitress":
+        serve_waitress(load, factory, bind, threads, keep_alive)
+    elif server == "uvicorn":
+        serve_uvicorn(load, factory, bind, keep_alive)
+    else:
+        serve_gunicorn(load, factory, bind, workers, threads, keep_alive)
+
+
+def serve_waitress(load, factory, bind, threads, keep_alive):
+    """
+        Serve the app created by the factory with waitress
+
+        A SIGTERM stops waitress like a SIGINT, thus the database is closed properly.
+    """
+    import waitress
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    load()
+    waitress.serve(factory(), listen=bind, threads=threads, channel_timeout=keep_alive)
+
+
+def serve_uvicorn(load, factory, bind, keep_alive):
+    """
+        Serve the asyncio app created by the factory with uvicorn
+    """
+    import uvicorn
+    host, _, port = bind.rpartition(":")
+    load()
+    uvicorn.run(factory(), host=host or "127.0.0.1", port=int(port), loop="asyncio",
+                timeout_keep_alive=keep_alive, lifespan="on", log_level="info")
+
+
+def serve_gunicorn(load, factory, bind, workers, threads, keep_alive):
+    """
+        Serve the app created by the factory with gunicorn
+
+        The database is loaded after the fork of the workers,
+        because background threads of the json server do not survive a fork.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    directory = path = writer = None
+    if workers > 1:
+        directory = tempfile.mkdtemp(prefix="jsonserver-")
+        path = os.path.join(directory, "writer.sock")
+        writer = start_writer(load, path)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", [bind])
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("keepalive", keep_alive)
+            self.cfg.set("worker_exit", lambda arbiter, worker: JsonServer().close())
+
+        def load(self):
+            if path is None:
+                load()
+            else:
+                Replica(JsonServer(), path).start()
+            return factory()
+
+    master = os.getpid()
+    try:
+        Application().run()
+    finally:
+        if writer is not None and os.getpid() == master:  # workers exit through here as well
+            stop_writer(writer)
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def start_writer(load, path):
+    """
+        Fork the writer process owning the database
+
+        The process is forked before any thread of the json server is started.
+
+        :params callable load: the function opening the database
+        :params string path: the path of the Unix socket serving the replicas
+
+        :returns: the process id of the writer
+        :rtype: int
+
+        :raises RuntimeError: if the writer fails to open the database
+    """
+    ready_fd, notify_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(ready_fd)
+        code = 1
+        try:
+            run_writer(load, path, lambda: os.write(notify_fd, b"."))
+            code = 0
+        except Exception:
+            logger.exception("The writer process failed")
+        finally:
+            os._exit(code)
+
+    os.close(notify_fd)
+    ready = os.read(ready_fd, 1)
+    os.close(ready_fd)
+    if not ready:
+        stop_writer(pid)
+        raise RuntimeError("The writer process failed to open the database")
+    return pid
+
+
+def stop_writer(pid):
+    """
+        Stop the writer process and wait until it closed the database
+
+        :params int pid: the process id of the writer
+    """
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:  # already reaped
+        pass
+
+
+def run_writer(load, path, ready):
+    """
+        Open the database and serve it to the replicas until SIGTERM
+
+        :params callable load: the function opening the database
+        :params string path: the path of the Unix socket serving the replicas
+        :params callable ready: the function to call as soon as the replicas can connect
+    """
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    server = JsonServer()
+    replication = None
+    try:
+        load()
+        replication = ReplicationServer(server, path)
+        replication.start()
+        ready()
+        while replication.is_alive():
+            replication.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if replication is not None:
+            replication.stop()
+        server.close()
@@ -3,14 +3,260 @@
 from abc import ABCMeta, abstractmethod
 
 import os
+import re
+import stat
+import mmap
 import json
+import sqlite3
+import tempfile
+from threading import Lock
+
+from jsonserver.codec import get_codec
+from jsonserver.metrics import REGISTRY
+
+#: durability levels of written data:
+#: ``none`` leaves it to the storage when data reaches the file,
+#: ``flush`` hands data over to the operating system and
+#: ``fsync`` waits until data is synced to disk.
+DURABILITY_LEVELS = ("none", "flush", "fsync")
+
+#: the reserved table keeping the sequence of every table whose highest id was removed,
+#: as rows with the table name as id, thus ids are never reused after the data is read again
+SEQUENCES_TABLE = "_sequences"
+
+#: formats of database files
+STORAGE_FORMATS = ("json", "msgpack", "sqlite")
+
+#: formats of database files by their file extension, json is the default
+STORAGE_EXTENSIONS = {".msgpack": "msgpack", ".mpk": "msgpack", ".sqlite": "sqlite", ".sqlite3": "sqlite", ".db": "sqlite"}
+
+#: json text up to the next bracket which is not within a string, the bracket is the group
+STRUCTURE = re.compile(rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*([\[\]{}])', re.S)
+
+#: the rest of a json string including its closing quote
+STRING_END = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+#: json strings within the quotes and brackets of json text without escapes
+STRINGS = re.compile(rb'"[^"]*"')
+
+#: all bytes except quotes, brackets and backslashes
+NON_STRUCTURAL = bytes(b for b in range(256) if b not in b'"[]{}\\')
+
+#: number of bytes of a table skipped at once while scanning a json database
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+
+def fsync_directory(path):
+    """
+        Sync the directory containing the given path,
+        to make sure a rename of the path is persisted.
+
+        :params string path: the path within the directory
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:  # directories cannot be opened on some platforms
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def scan_tables(buffer, chunk_size=SCAN_CHUNK_SIZE):
+    """
+        Find the tables of a json database without decoding them.
+
+        Only the brackets outside of strings are looked at. Within a table,
+        chunks of json without escapes are skipped at once if they cannot
+        contain the end of the table, thus the scan is much faster than decoding.
+        A chunk which may contain the end of the table is retried in smaller
+        chunks, until the rest is scanned bracket by bracket.
+
+        :params buffer: the json database, bytes or a memory map
+        :params int chunk_size: the number of bytes skipped at once
+
+        :returns: the start and end offset of the json array of every table keyed by table
+        :rtype: dict
+
+        :raises ValueError: if the json is no object of arrays
+    """
+    tables = {}
+    depth = 0
+    name = start = None
+    key_start = position = 0
+    in_string = False
+    step = chunk_size
+    while position < len(buffer):
+        if in_string:
+            match = STRING_END.match(buffer, position)
+            if match is None:
+                break
+            position, in_string = match.end(), False
+
+        end = position + step
+        if depth >= 2:
+            chunk = buffer[position:end]
+            if b"\\" not in chunk:
+                # removing adjacent quotes keeps every bracket within or outside its string
+                brackets = chunk.translate(None, NON_STRUCTURAL).replace(b'""', b"")
+                brackets = STRINGS.sub(b"", brackets)
+                quote = brackets.find(b'"')  # a string continued by the next chunk
+                if quote >= 0:
+                    brackets = brackets[:quote]
+                while True:  # cancel matching brackets until only the unmatched ones are left
+                    matched = brackets.replace(b"[]", b"").replace(b"{}", b"")
+                    if len(matched) == len(brackets):
+                        break
+                    brackets = matched
+                opening = brackets.lstrip(b"]}")
+                closing = len(brackets) - len(opening)
+                if depth - closing >= 2 and not opening.strip(b"[{"):
+                    depth += len(opening) - closing
+                    position, in_string = end, quote >= 0
+                    step = min(step * 2, chunk_size)
+                    continue
+                if step > chunk_size // 256 + 1:
+                    step = max(step // 16, chunk_size // 256, 1)
+                    continue
+
+        for match in STRUCTURE.finditer(buffer, position):
+            bracket = match.group(1)
+            if bracket in b"[{":
+                depth += 1
+                if depth == 1:
+                    if bracket != b"{" or buffer[:match.start(1)].strip():
+                        raise ValueError("The json database has to be an object")
+                    key_start = match.end()
+                elif depth == 2:
+                    key = buffer[key_start:match.start(1)].strip().lstrip(b",").strip()
+                    if bracket != b"[" or not key.endswith(b":"):
+                        raise ValueError("The tables of the json database have to be arrays")
+                    name = json.loads(key[:-1].decode("utf-8"))
+                    if not isinstance(name, str):
+                        raise ValueError("Invalid table name in the json database")
+                    start = match.start(1)
+            else:
+                depth -= 1
+                if depth == 1:
+                    tables[name] = (start, match.end())
+                    key_start = match.end()
+                elif depth == 0:
+                    if buffer[key_start:match.start(1)].strip():
+                        raise ValueError("The tables of the json database have to be arrays")
+                    if buffer[match.end():].strip():
+                        raise ValueError("The json database is followed by more data")
+                    return tables
+                elif depth < 0:
+                    raise ValueError("The json database is no valid json object")
+
+            if depth >= 2 and match.end() >= end:
+                position = match.end()
+                break
+        else:
+            break
+    raise ValueError("The json database is no valid json object")
+
+
+#: the bytes read from, written to and appended to the storages
+STORAGE_BYTES = REGISTRY.counter("jsonserver_storage_bytes_total", "Bytes read from and written to the storage.",
+                                 ("operation",))
+
+
+class DeferredTable(object):
+    """
+        Table of a json database which is decoded on first access.
+    """
+    def __init__(self, buffer, start, end, codec):
+        """
+            Create new deferred table.
+
+            :params buffer: the json database, bytes or a memory map
+            :params int start: the offset of the json array of the table
+            :params int end: the offset after the json array of the table
+            :params Codec codec: the json codec to decode the table with
+        """
+        self._buffer = buffer
+        self.start = start
+        self.end = end
+        self.codec = codec
+
+    def load(self):
+        """
+            Decode the rows of the table
+
+            :rtype: list
+        """
+        STORAGE_BYTES.inc(("read",), self.end - self.start)
+        return self.codec.loads(self._buffer[self.start:self.end])
+
+    def raw(self):
+        """
+            Returns the json array of the table without copying it
+
+            :rtype: memoryview
+        """
+        return memoryview(self._buffer)[self.start:self.end]
+
+
+def storage_format(path, format=None):
+    """
+        Returns the format of a database file
+
+        :params string path: the database file
+        :params string format: the format to use or None to detect it by the file extension
+
+        :rtype: string
+
+        :raises ValueError: if the format is unknown
+    """
+    if format is None:
+        return STORAGE_EXTENSIONS.get(os.path.splitext(path)[1].lower(), "json")
+    if format not in STORAGE_FORMATS:
+        raise ValueError("Unknown storage format '{}', expected one of: {}".format(format, ", ".join(STORAGE_FORMATS)))
+    return format
+
+
+def open_storage(path, format=None, journal=False, durability="flush", codec=None):
+    """
+        Open the storage of a database file
+
+        A SQLite database applies every change to its rows, thus it is always journaled.
+
+        :params string path: the database file
+        :params string format: the format of the file, see ``STORAGE_FORMATS``,
+                               or None to detect it by the file extension
+        :params bool journal: if changes are appended to a journal next to the file
+        :params string durability: the durability level of written data, see ``DURABILITY_LEVELS``
+        :params string codec: the json codec to use, see ``jsonserver.codec``
+
+        :rtype: Storage
+
+        :raises ValueError: if the format is unknown
+        :raises ImportError: if the library of the format is not installed
+    """
+    format = storage_format(path, format)
+    if format == "sqlite":
+        return SqliteStorage(path, durability=durability, codec=codec)
+    if format == "msgpack":
+        storage = MsgpackJournalStorage if journal else MsgpackStorage
+    else:
+        storage = JournalStorage if journal else JsonStorage
+    return storage(path, durability=durability, codec=codec)
 
 
 class Storage(metaclass=ABCMeta):
     """
         Base class for storage classes.
         A storage class provides the functionality to serialize/deserialize written data.
+
+        Journaled storages additionally persist single changes with ``append``
+        and provide them again with ``records`` to be replayed over the data.
     """
+    journaled = False
+
     @abstractmethod
     def read(self):
         """
@@ -23,6 +269,17 @@ class Storage(metaclass=ABCMeta):
         """
         raise NotImplementedError("this method has to be overwritten")
 
+    def read_lazy(self):
+        """
+            Read latest state from the stored data, deferring the decoding of tables.
+
+            Storages which cannot defer decoding read all data at once.
+
+            :returns: the tables keyed by name, either decoded or as ``DeferredTable``
+            :rtype: dict
+        """
+        return self.read()
+
     @abstractmethod
     def write(self, data):
         """
@@ -37,40 +294,602 @@ class Storage(metaclass=ABCMeta):
         """
         raise NotImplementedError("this method has to be overwritten")
 
+    def append(self, record, flush=False):
+        """
+            Append a change record to the journal.
+
+            :params dict record: the change to persist
+            :params bool flush: if the record has to be written through
+
+            :raises NotImplementedError: if the storage is not journaled.
+        """
+        raise NotImplementedError("storage is not journaled")
+
+    def records(self):
+        """
+            Read the change records from the journal.
+
+            :returns: the change records in the order they were appended
+            :rtype: iterator
+
+            :raises NotImplementedError: if the storage is not journaled.
+        """
+        raise NotImplementedError("storage is not journaled")
+
+
+class MemoryStorage(Storage):
+    """
+        Class to keep data in memory only.
+
+        Used by replicas of a database, which never write it themselves.
+    """
+    def __init__(self, data=None):
+        """
+            Create new memory storage object.
+
+            :params dict data: the initial data
+        """
+        super(MemoryStorage, self).__init__()
+        self._data = data if data is not None else {}
+
+    def close(self):
+        pass
+
+    def read(self):
+        return self._data
+
+    def write(self, data):
+        self._data = data
+
 
 class JsonStorage(Storage):
     """
         Class to store data as json file.
+
+        The json file is never overwritten in place. Data is written
+        to a temporary file which is renamed over the json file.
     """
-    def __init__(self, jsonfile):
+    def __init__(self, jsonfile, durability="flush", codec=None):
         """
             Create new json storage object.
 
             :params string jsonfile: the file to load from
+            :params string durability: the durability level of written data, see ``DURABILITY_LEVELS``
+            :params string codec: the json codec to use, see ``jsonserver.codec``
         """
         super(JsonStorage, self).__init__()
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError("Unknown durability '{}', expected one of: {}".format(durability, ", ".join(DURABILITY_LEVELS)))
+
         self._jsonfile = jsonfile
+        self.durability = durability
+        self.codec = get_codec(codec)
 
-        self._handle = open(jsonfile, "r+")
+        self._handle = open(jsonfile, "r+b")
+        self._map = None
 
     def __del__(self):
-        self.close()
+        if hasattr(self, "_handle"):
+            self.close()
 
     def close(self):
         """
             Close storage handle
         """
         self._handle.close()
+        self._map = None  # closed as soon as no deferred table refers to it anymore
 
     def read(self):
         if os.path.getsize(self._jsonfile) == 0:  # return empty object if database has no entries
             return {}
 
         self._handle.seek(0)
-        return json.load(self._handle)
+        data = self._handle.read()
+        STORAGE_BYTES.inc(("read",), len(data))
+        return self.codec.loads(data)
+
+    def read_lazy(self):
+        """
+            Read latest state from the json file, deferring the decoding of tables.
+
+            The json file is memory-mapped and scanned for the tables, which
+            are decoded by ``DeferredTable.load``. The memory map outlives
+            later writes of the json file, because these replace the file.
+            If the file is no object of arrays, it is read at once.
+
+            :returns: the tables keyed by name as ``DeferredTable``
+            :rtype: dict
+        """
+        if os.path.getsize(self._jsonfile) == 0:
+            return {}
+
+        buffer = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            tables = scan_tables(buffer)
+        except ValueError:
+            buffer.close()
+            return self.read()
+        if hasattr(mmap, "MADV_DONTNEED"):  # the scanned pages are read from the page cache again when needed
+            buffer.madvise(mmap.MADV_DONTNEED)
+
+        self._map = buffer
+        return {name: DeferredTable(buffer, start, end, self.codec) for name, (start, end) in tables.items()}
 
     def write(self, data):
+        self.replace(data, sync=self.durability == "fsync")
+
+    def encode(self, data):
+        """
+            Encode data as json in chunks
+
+            Deferred tables are copied from the json file as they are.
+
+            :params dict data: the data to serialize
+
+            :rtype: iterator
+        """
+        if not any(isinstance(rows, DeferredTable) for rows in data.values()):
+            yield self.codec.dumps(data)
+            return
+
+        yield b"{"
+        for i, (table, rows) in enumerate(data.items()):
+            yield (b"," if i else b"") + self.codec.dumps(table) + b":"
+            yield rows.raw() if isinstance(rows, DeferredTable) else self.codec.dumps(rows)
+        yield b"}"
+
+    def replace(self, data, sync=True):
+        """
+            Atomically replace the json file with the given data.
+
+            The data is written to a temporary file in the same directory
+            which is then renamed over the json file. Thus, a crash while
+            writing never leaves a partially written json file behind.
+
+            :params dict data: the data to serialize
+            :params bool sync: if the data and the rename are synced to disk
+        """
+        directory = os.path.dirname(os.path.abspath(self._jsonfile))
+        fd, tmpfile = tempfile.mkstemp(prefix=os.path.basename(self._jsonfile) + ".", suffix=".tmp", dir=directory)
+        written = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self.encode(data):
+                    f.write(chunk)
+                    written += len(chunk)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.chmod(tmpfile, stat.S_IMODE(os.stat(self._jsonfile).st_mode))
+
+            self._handle.close()  # open files cannot be replaced on every platform
+            try:
+                os.replace(tmpfile, self._jsonfile)
+            finally:
+                self._handle = open(self._jsonfile, "r+b")
+        except BaseException:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            raise
+
+        STORAGE_BYTES.inc(("write",), written)
+        if sync:
+            fsync_directory(self._jsonfile)
+
+
+class JournalStorage(JsonStorage):
+    """
+        Class to store data as json file with an append-only journal.
+
+        Every change is appended as a compact json line to a journal file
+        next to the json file. Writing a snapshot of the data truncates the journal.
+    """
+    journaled = True
+
+    def __init__(self, jsonfile, durability="flush", codec=None):
+        """
+            Create new journal storage object.
+
+            :params string jsonfile: the file to load from
+            :params string durability: the durability level of written data, see ``DURABILITY_LEVELS``
+            :params string codec: the json codec to use, see ``jsonserver.codec``
+        """
+        super(JournalStorage, self).__init__(jsonfile, durability, codec)
+        self._journalfile = jsonfile + ".log"
+        self._records = 0
+        self._lock = Lock()
+
+        self._journal = open(self._journalfile, "a+b")
+
+    @property
+    def journalfile(self):
+        return self._journalfile
+
+    @property
+    def journal_size(self):
+        """
+            The size of the journal in bytes
+        """
+        return self._journal.tell()
+
+    @property
+    def journal_records(self):
+        """
+            The number of records in the journal
+        """
+        return self._records
+
+    def close(self):
+        """
+            Close storage and journal handles
+        """
+        super(JournalStorage, self).close()
+        self._journal.close()
+
+    def records(self):
+        with self._lock:
+            self._journal.seek(0)
+            self._records = 0
+            offset = 0
+            for line in iter(self._journal.readline, b""):
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = self.codec.loads(line)
+                except ValueError:  # torn write at the end of the journal
+                    self._journal.truncate(offset)
+                    break
+                offset += len(line)
+                self._records += 1
+                yield record
+            self._journal.seek(0, os.SEEK_END)
+            STORAGE_BYTES.inc(("read",), offset)
+
+    def append(self, record, flush=False):
+        line = self.codec.dumps(record) + b"\n"
+        with self._lock:
+            self._journal.write(line)
+            self._records += 1
+        STORAGE_BYTES.inc(("append",), len(line))
+
+        if flush:
+            self.sync()
+
+    def sync(self):
+        """
+            Write the appended records through according to the durability level
+
+            Only the buffer is written under the lock, records are appended
+            while the journal is synced to disk.
+        """
+        if self.durability == "none":
+            return
+
+        with self._lock:
+            self._journal.flush()
+            journal = self._journal
+        if self.durability == "fsync":
+            try:
+                os.fsync(journal.fileno())
+            except ValueError:  # replaced by a compaction, which synced the records left in the journal
+                pass
+
+    def write(self, data):
+        with self._lock:
+            super(JournalStorage, self).write(data)
+            self._journal.flush()
+            self._journal.truncate(0)
+            self._records = 0
+
+    def mark(self):
+        """
+            Returns the current end of the journal.
+
+            All records appended before the mark are discarded
+            by compacting the journal with this mark.
+
+            :rtype: tuple
+        """
+        with self._lock:
+            self._journal.flush()
+            return self._journal.tell(), self._records
+
+    def compact(self, data, mark):
+        """
+            Replace the json file with a snapshot of the data
+            and discard the journal records before the given mark.
+
+            The snapshot has to contain all changes recorded before the mark.
+            Records after the mark are kept, replaying them over
+            the snapshot is safe because records are applied idempotently.
+
+            :params dict data: the snapshot of the data
+            :params tuple mark: the mark returned by ``mark``
+        """
+        offset, records = mark
+        self.replace(data)
+
+        with self._lock:
+            self._journal.flush()
+            self._journal.seek(offset)
+            tail = self._journal.read()
+
+            tmpfile = self._journalfile + ".tmp"
+            with open(tmpfile, "wb") as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmpfile, self._journalfile)
+            fsync_directory(self._journalfile)
+
+            self._journal.close()
+            self._journal = open(self._journalfile, "a+b")
+            self._records -= records
+
+
+class MsgpackStorage(JsonStorage):
+    """
+        Class to store data as MessagePack file.
+
+        MessagePack is a binary json, which is smaller and faster to
+        read and to write than json text. The file is replaced like a json file.
+    """
+    def __init__(self, path, durability="flush", codec=None):
+        """
+            Create new MessagePack storage object.
+
+            :params string path: the file to load from
+            :params string durability: the durability level of written data, see ``DURABILITY_LEVELS``
+            :params string codec: the json codec of the journal, see ``jsonserver.codec``
+        """
+        import msgpack
+        self._msgpack = msgpack
+        super(MsgpackStorage, self).__init__(path, durability, codec)
+
+    def read(self):
+        if os.path.getsize(self._jsonfile) == 0:  # return empty object if database has no entries
+            return {}
+
         self._handle.seek(0)
-        json.dump(data, self._handle)
-        self._handle.flush()
-        self._handle.truncate()
+        data = self._handle.read()
+        STORAGE_BYTES.inc(("read",), len(data))
+        return self._msgpack.unpackb(data)
+
+    def read_lazy(self):
+        return self.read()
+
+    def encode(self, data):
+        yield self._msgpack.packb({table: rows.load() if isinstance(rows, DeferredTable) else rows
+                                   for table, rows in data.items()})
+
+
+class MsgpackJournalStorage(MsgpackStorage, JournalStorage):
+    """
+        Class to store data as MessagePack file with an append-only journal.
+
+        The journal consists of json lines like the journal of a json file.
+    """
+
+
+class SqliteTable(DeferredTable):
+    """
+        Table of a SQLite database which is read on first access.
+    """
+    def __init__(self, storage, name):
+        """
+            Create new deferred SQLite table.
+
+            :params SqliteStorage storage: the storage of the table
+            :params string name: the name of the table
+        """
+        self.storage = storage
+        self.name = name
+
+    def load(self):
+        rows = self.storage.rows(self.name)
+        STORAGE_BYTES.inc(("read",), sum(len(row) for row in rows))
+        return [self.storage.codec.loads(row) for row in rows]
+
+    def raw(self):
+        return b"[" + b",".join(self.storage.rows(self.name)) + b"]"
+
+
+class SqliteStorage(Storage):
+    """
+        Class to store data in a SQLite database.
+
+        Every table is stored in a SQLite table with a json encoded row per row.
+        Changes are applied to single rows instead of rewriting the database,
+        thus the storage is journaled without a separate journal: the changes
+        are written through by committing them, ``records`` is always empty.
+        With ``read_lazy``, tables are only read on their first access.
+    """
+    journaled = True
+
+    #: the synchronous mode of SQLite for every durability level
+    SYNCHRONOUS = {"none": "OFF", "flush": "NORMAL", "fsync": "FULL"}
+
+    def __init__(self, path, durability="flush", codec=None):
+        """
+            Create new SQLite storage object.
+
+            :params string path: the SQLite database file, which may be empty
+            :params string durability: the durability level of written data, see ``DURABILITY_LEVELS``
+            :params string codec: the json codec of the rows, see ``jsonserver.codec``
+        """
+        super(SqliteStorage, self).__init__()
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError("Unknown durability '{}', expected one of: {}".format(durability, ", ".join(DURABILITY_LEVELS)))
+
+        self.path = path
+        self.durability = durability
+        self.codec = get_codec(codec)
+        self._lock = Lock()
+        self._records = 0
+
+        # transactions are started explicitly and span all changes until the next sync
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous={}".format(self.SYNCHRONOUS[durability]))
+        self._connection.execute("CREATE TABLE IF NOT EXISTS jsonserver_tables "
+                                 "(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL)")
+        self._tables = dict(self._connection.execute("SELECT name, id FROM jsonserver_tables ORDER BY id"))
+
+    @property
+    def journal_size(self):
+        return 0
+
+    @property
+    def journal_records(self):
+        """
+            The number of changes which are not committed yet
+        """
+        return self._records
+
+    def close(self):
+        """
+            Commit pending changes and close the database
+        """
+        with self._lock:
+            if self._connection is None:
+                return
+            if self._connection.in_transaction:
+                self._connection.execute("COMMIT")
+            self._connection.close()
+            self._connection = None
+
+    def rows(self, table):
+        """
+            Returns the json encoded rows of a table in their order
+
+            :params string table: the table name
+
+            :rtype: list
+        """
+        with self._lock:
+            return [row for row, in self._connection.execute(
+                "SELECT row FROM rows_{} ORDER BY position".format(self._tables[table]))]
+
+    def read(self):
+        return {table: SqliteTable(self, table).load() for table in list(self._tables)}
+
+    def read_lazy(self):
+        return {table: SqliteTable(self, table) for table in list(self._tables)}
+
+    def write(self, data):
+        written = [0]
+
+        def encoded(rows):
+            for row in rows:
+                blob = self.codec.dumps(row)
+                written[0] += len(blob)
+                yield row.get("id"), blob
+
+        with self._lock:
+            tables = dict(self._tables)
+            self._begin()
+            try:
+                for table in list(self._tables):
+                    rows = data.get(table)
+                    if not isinstance(rows, SqliteTable) or rows.storage is not self:
+                        self._drop(table)
+                for table, rows in data.items():
+                    if table not in self._tables:
+                        self._create(table)
+                        rows = rows.load() if isinstance(rows, DeferredTable) else rows
+                        self._connection.executemany(
+                            "INSERT INTO rows_{} (id, row) VALUES (?, ?)".format(self._tables[table]), encoded(rows))
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")  # discards the changes appended since the last sync as well
+                self._tables = tables
+                raise
+            self._records = 0
+        STORAGE_BYTES.inc(("write",), written[0])
+
+    def records(self):
+        return iter(())
+
+    def append(self, record, flush=False):
+        with self._lock:
+            self._begin()
+            self._apply(record)
+            self._records += 1
+
+        if flush:
+            self.sync()
+
+    def sync(self):
+        """
+            Commit the changes applied so far
+        """
+        with self._lock:
+            if self._connection.in_transaction:
+                self._connection.execute("COMMIT")
+            self._records = 0
+
+    def mark(self):
+        return None
+
+    def compact(self, data, mark):
+        """
+            Replace the database with a snapshot of the data
+
+            The changes are already applied, thus this only rewrites the tables.
+        """
+        self.write(data)
+
+    def _begin(self):
+        if not self._connection.in_transaction:
+            self._connection.execute("BEGIN")
+
+    def _create(self, table):
+        cursor = self._connection.execute("INSERT INTO jsonserver_tables (name) VALUES (?)", (table,))
+        self._tables[table] = cursor.lastrowid
+        self._connection.execute("CREATE TABLE rows_{} (position INTEGER PRIMARY KEY, id UNIQUE, row BLOB NOT NULL)"
+                                 .format(cursor.lastrowid))
+
+    def _drop(self, table):
+        self._connection.execute("DROP TABLE rows_{}".format(self._tables.pop(table)))
+        self._connection.execute("DELETE FROM jsonserver_tables WHERE name = ?", (table,))
+
+    def _apply(self, record):
+        """
+            Apply a change record to the rows of the database
+
+            :params dict record: the change to apply
+        """
+        op = record["op"]
+        table = record["table"]
+        if op == "batch":
+            for change in record["records"]:
+                self._apply(change)
+        elif op == "create":
+            if table not in self._tables:
+                self._create(table)
+        elif op == "drop":
+            if table in self._tables:
+                self._drop(table)
+        elif op == "insert":
+            rows = "rows_{}".format(self._tables[table])
+            row = record["row"]
+            encoded = self.codec.dumps(row)
+            self._connection.execute("DELETE FROM {} WHERE id = ?".format(rows), (row["id"],))
+            self._connection.execute("INSERT INTO {} (id, row) VALUES (?, ?)".format(rows), (row["id"], encoded))
+            STORAGE_BYTES.inc(("append",), len(encoded))
+        elif op == "remove":
+            self._connection.execute("DELETE FROM rows_{} WHERE id = ?".format(self._tables[table]), (record["id"],))
+            if "sequence" in record:  # the highest id was removed
+                if SEQUENCES_TABLE not in self._tables:
+                    self._create(SEQUENCES_TABLE)
+                self._apply({"op": "insert", "table": SEQUENCES_TABLE,
+                             "row": {"id": table, "sequence": record["sequence"]}})
+        elif op == "update":
+            rows = "rows_{}".format(self._tables[table])
+            found = self._connection.execute("SELECT row FROM {} WHERE id = ?".format(rows), (record["id"],)).fetchone()
+            if found is not None:
+                row = self.codec.loads(found[0])
+                row.update(record["data"])
+                encoded = self.codec.dumps(row)
+                self._connection.execute("UPDATE {} SET row = ? WHERE id = ?".format(rows), (encoded, record["id"]))
+                STORAGE_BYTES.inc(("append",), len(encoded))
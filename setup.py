@@ -19,8 +19,10 @@ setup(
     url="http://github.com/timofurrer/jsonserver",
     download_url="http://github.com/timofurrer/jsonserver",
     install_requires=[""],
+    extras_require={"waitress": ["waitress"], "gunicorn": ["gunicorn"], "uvicorn": ["uvicorn"], "msgpack": ["msgpack"]},
     packages=["jsonserver"],
-    entry_points={"console_scripts": ["jsonserver = jsonserver.main:main"]},
+    entry_points={"console_scripts": ["jsonserver = jsonserver.main:main",
+                                      "jsonserver-convert = jsonserver.convert:main"]},
     package_data={"jsonserver": ["*.md"]},
     classifiers=[
         "Development Status :: 4 - Beta",
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sure
 from nose.tools import nottest
 import json
@@ -36,9 +37,11 @@ def with_json_db(database=None):
 
 
 @nottest
-def with_jsonserver(database=None):
+def with_jsonserver(database=None, **options):
     """
         Create a json server with the given json database.
+
+        Additional options are passed to ``JsonServer.open``.
     """
     def _decorator(func):
         @wraps(func)
@@ -49,8 +52,13 @@ def with_jsonserver(database=None):
                     tmpfile.flush()
 
                 server = JsonServer()
-                server.open(tmpfile.name)
-                ret = func(self, server, *args, **kwargs)
+                server.open(tmpfile.name, **options)
+                try:
+                    ret = func(self, server, *args, **kwargs)
+                finally:
+                    server.close()
+                    if os.path.exists(tmpfile.name + ".log"):
+                        os.remove(tmpfile.name + ".log")
             return ret
         return _wrapper
     return _decorator
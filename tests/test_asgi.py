@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+import asyncio
+from unittest import TestCase
+
+from jsonserver.main import create_asgi_app
+
+
+def call(app, method, path, query=b"", body=None, headers=()):
+    """
+        Send a request to an ASGI app and return the status, headers and body of the response
+    """
+    return asyncio.run(request(app, method, path, query, body, headers))
+
+
+async def request(app, method, path, query=b"", body=None, headers=()):
+    """
+        Like ``call``, but on the running event loop
+    """
+    body = json.dumps(body).encode("utf-8") if body is not None else b""
+    scope = {"type": "http", "method": method, "path": path, "query_string": query, "http_version": "1.1",
+             "headers": [(b"host", b"localhost"), (b"content-type", b"application/json")] + list(headers)}
+    messages = [{"type": "http.request", "body": body[:3], "more_body": True},
+                {"type": "http.request", "body": body[3:], "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    sent[0]["type"].should.be.equal("http.response.start")
+    sent[-1].get("more_body", False).should.be.false
+    headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in sent[0]["headers"]}
+    return sent[0]["status"], headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+class AsgiAppTest(TestCase):
+    """
+        Test the asyncio application of the json server.
+    """
+
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}, {"id": 2, "author": "luck"}]})
+    def test_read_routes(self, server):
+        """
+            Test ASGI: read tables and rows with conditional requests
+        """
+        app = create_asgi_app(cache_size=1024)
+        status, headers, body = call(app, "GET", "/posts")
+        status.should.be.equal(200)
+        json.loads(body).should.be.equal({"posts": [{"id": 1, "author": "tuxtimo"}, {"id": 2, "author": "luck"}]})
+
+        status, _, body = call(app, "GET", "/posts", headers=[(b"if-none-match", headers["etag"].encode("latin-1"))])
+        status.should.be.equal(304)
+        body.should.be.equal(b"")
+
+        status, headers, body = call(app, "GET", "/posts", query=b"author=luck&_limit=1")
+        json.loads(body).should.be.equal({"posts": [{"id": 2, "author": "luck"}]})
+        headers["x-total-count"].should.be.equal("1")
+
+        call(app, "GET", "/posts/3")[0].should.be.equal(500)
+        call(app, "GET", "/posts", query=b"_limit=x")[0].should.be.equal(400)
+
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}]})
+    def test_write_routes(self, server):
+        """
+            Test ASGI: changes are flushed before responding
+        """
+        app = create_asgi_app(flush=True)
+        status, _, body = call(app, "POST", "/posts", body={"row": {"author": "luck"}})
+        status.should.be.equal(201)
+        json.loads(body).should.be.equal({"id": 2, "author": "luck"})
+
+        with open(server.dbfile) as f:
+            json.load(f).should.be.equal({"posts": [{"id": 1, "author": "tuxtimo"}, {"id": 2, "author": "luck"}]})
+
+        call(app, "PATCH", "/posts/1", body={"row": {"author": "obi"}})[2].should.be.equal(b'{"id":1,"author":"obi"}')
+        call(app, "DELETE", "/posts/2")[0].should.be.equal(204)
+        with open(server.dbfile) as f:
+            json.load(f).should.be.equal({"posts": [{"id": 1, "author": "obi"}],
+                                          "_sequences": [{"id": "posts", "sequence": 2}]})
+
+    @with_jsonserver({"posts": [{"id": i} for i in range(1, 1001)]})
+    def test_streamed_response(self, server):
+        """
+            Test ASGI: large tables are sent in chunks
+        """
+        app = create_asgi_app(stream_threshold=100)
+        status, headers, body = call(app, "GET", "/posts")
+        status.should.be.equal(200)
+        headers.shouldnt.have.key("content-length")
+        json.loads(body).should.be.equal({"posts": [{"id": i} for i in range(1, 1001)]})
+
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}], "comments": [{"id": 1, "postId": 1}]})
+    def test_blocked_request(self, server):
+        """
+            Test ASGI: a request waiting for a lock does not block other requests
+        """
+        app = create_asgi_app()
+
+        async def requests():
+            with server._writing("posts"):
+                blocked = asyncio.ensure_future(request(app, "GET", "/posts"))
+                status, _, body = await asyncio.wait_for(request(app, "GET", "/comments"), 5)
+                status.should.be.equal(200)
+                json.loads(body).should.be.equal({"comments": [{"id": 1, "postId": 1}]})
+                blocked.done().should.be.false
+            return await blocked
+
+        status, _, body = asyncio.run(requests())
+        status.should.be.equal(200)
+        json.loads(body).should.be.equal({"posts": [{"id": 1, "author": "tuxtimo"}]})
+
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}]})
+    def test_changes(self, server):
+        """
+            Test ASGI: wait for changes on the event loop
+        """
+        app = create_asgi_app()
+        start = server.sequence
+        server.insert("posts", {"author": "luck"})
+        status, _, body = call(app, "GET", "/_changes", query="since={}".format(start).encode("latin-1"))
+        status.should.be.equal(200)
+        json.loads(body)["last"].should.be.equal(start + 1)
+        call(app, "GET", "/_changes", query=b"since=x")[0].should.be.equal(400)
+
+        query = "since={}".format(start + 1).encode("latin-1")
+        scope = {"type": "http", "method": "GET", "path": "/_changes", "query_string": query,
+                 "headers": [(b"accept", b"text/event-stream")]}
+        sent = []
+
+        async def receive():
+            if not sent:
+                return {"type": "http.request", "body": b""}
+            await asyncio.sleep(0.2)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        async def run():
+            asyncio.get_running_loop().call_later(0.05, server.remove, "posts", 2)
+            await app(scope, receive, send)
+
+        asyncio.run(run())
+        sent[0]["headers"].should.contain((b"cache-control", b"no-cache"))
+        body = b"".join(m.get("body", b"") for m in sent[1:])
+        event = {"seq": start + 2, "op": "remove", "table": "posts", "id": 2}
+        body.should.contain("id: {}\nevent: change\n".format(start + 2).encode("latin-1"))
+        json.loads(body.split(b"data: ")[1]).should.be.equal(event)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+from unittest import TestCase
+
+from benchmarks.bench import run, summarize
+from benchmarks.compare import compare
+from benchmarks.generate import generate_database
+
+
+class BenchmarksTest(TestCase):
+    """
+        Test the benchmark suite.
+    """
+
+    def test_generate_database(self):
+        """
+            Test generating a reproducible database of related tables
+        """
+        database = generate_database(tables=3, rows=10, columns=4, seed=1)
+        list(database).should.be.equal(["users", "posts", "comments"])
+        len(database["comments"]).should.be.equal(10)
+        sorted(database["posts"][0]).should.be.equal(["category2", "id", "tags3", "title0", "userId", "views1"])
+        database.should.be.equal(generate_database(tables=3, rows=10, columns=4, seed=1))
+        database.should_not.be.equal(generate_database(tables=3, rows=10, columns=4, seed=2))
+
+    def test_run(self):
+        """
+            Test running the benchmarks without http
+        """
+        results = run(sizes=[50], operations=10, repeat=1, duration=0.05, threads=[1, 2], http=False)["results"]
+        sorted(results).should.be.equal(sorted("{}[rows=50]".format(name) for name in (
+            "core.open", "core.open_lazy", "core.get_row", "core.where", "core.where_scan",
+            "core.update", "core.insert", "core.remove", "storage.write",
+            "core.concurrent_reads[threads=1]", "core.concurrent_reads_writer[threads=1]",
+            "core.concurrent_reads[threads=2]", "core.concurrent_reads_writer[threads=2]")))
+        results["core.get_row[rows=50]"]["samples"].should.be.equal(10)
+        results["core.concurrent_reads[threads=2][rows=50]"]["requests"].should.be.greater_than(0)
+
+    def test_compare(self):
+        """
+            Test flagging regressions of latencies and throughputs
+        """
+        baseline = {"get": summarize([10, 20, 30], "us"), "http": {"value": 100, "unit": "req/s", "better": "higher"},
+                    "old": summarize([1], "s")}
+        current = {"get": summarize([25], "us"), "http": {"value": 80, "unit": "req/s", "better": "higher"},
+                   "new": summarize([1], "s")}
+        statuses = {c["name"]: c["status"] for c in compare(baseline, current)}
+        statuses.should.be.equal({"get": "regression", "http": "regression", "old": "removed", "new": "added"})
+
+        current["get"] = summarize([15], "us")
+        current["http"]["value"] = 95
+        statuses = {c["name"]: c["status"] for c in compare(baseline, current)}
+        statuses["get"].should.be.equal("improvement")
+        statuses["http"].should.be.equal("unchanged")
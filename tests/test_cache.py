@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+from unittest import TestCase
+
+from jsonserver.cache import ResponseCache
+
+
+class ResponseCacheTest(TestCase):
+    """
+        Test ResponseCache objects.
+    """
+
+    def test_versioned_entries(self):
+        """
+            Test that entries are only returned for the version they were cached with
+        """
+        cache = ResponseCache(max_bytes=100)
+        cache.get(("table", "posts"), 1).should.be.none
+
+        cache.put(("table", "posts"), 1, b"[]")
+        cache.put(("table", "comments"), 1, b"[1]")
+        cache.get(("table", "posts"), 1).should.be.equal(b"[]")
+
+        cache.get(("table", "posts"), 2).should.be.none
+        cache.get(("table", "posts"), 1).should.be.none
+        cache.get(("table", "comments"), 1).should.be.equal(b"[1]")
+        len(cache).should.be.equal(1)
+        cache.size.should.be.equal(3)
+
+        cache.put(("query", "posts"), 1, b"[]", {"X-Total-Count": "0"})
+        cache.lookup(("query", "posts"), 1).should.be.equal((b"[]", {"X-Total-Count": "0"}))
+        cache.lookup(("table", "comments"), 1).should.be.equal((b"[1]", {}))
+        cache.lookup(("query", "posts"), 2).should.be.none
+
+    def test_lru_eviction(self):
+        """
+            Test that least recently used entries are evicted to stay within the size limit
+        """
+        cache = ResponseCache(max_bytes=10)
+        cache.put("a", 1, b"aaaa")
+        cache.put("b", 1, b"bbbb")
+        cache.get("a", 1).should.be.equal(b"aaaa")
+
+        cache.put("c", 1, b"cccc")
+        cache.get("b", 1).should.be.none
+        cache.get("a", 1).should.be.equal(b"aaaa")
+        cache.get("c", 1).should.be.equal(b"cccc")
+        cache.size.should.be.equal(8)
+
+        cache.put("d", 1, b"d" * 11)
+        cache.get("d", 1).should.be.none
+        cache.size.should.be.equal(8)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+from unittest import TestCase
+
+from jsonserver.codec import StdlibCodec, available_codecs, get_codec
+from jsonserver.storage import JsonStorage
+
+
+class CodecTest(TestCase):
+    """
+        Test the json codecs.
+    """
+
+    def test_available_codecs(self):
+        """
+            Test that the stdlib codec is always available and used as fallback
+        """
+        available_codecs().should.contain("json")
+        get_codec().name.should.be.equal(available_codecs()[0])
+        get_codec("json").should.be.a(StdlibCodec)
+
+        codec = get_codec("json")
+        get_codec(codec).should.be(codec)
+
+        get_codec.when.called_with("yaml").should.throw(ValueError, "Unknown codec 'yaml', expected one of: orjson, ujson, rapidjson, json")
+
+    def test_roundtrip(self):
+        """
+            Test encoding and decoding with every available codec
+        """
+        data = {"posts": [{"id": 1, "title": "jsonserver", "author": "tüxtimo", "url": "http://example.com", "score": 1.5, "draft": False, "tags": None}]}
+        for name in available_codecs():
+            codec = get_codec(name)
+            encoded = codec.dumps(data)
+            encoded.should.be.a(bytes)
+            json.loads(encoded.decode("utf-8")).should.be.equal(data)
+            codec.loads(encoded).should.be.equal(data)
+            codec.loads(json.dumps(data).encode("utf-8")).should.be.equal(data)
+            codec.dumps({"id": 1, "body": "foo"}).should.be.equal(b'{"id":1,"body":"foo"}')
+
+    @with_json_db({"posts": [{"id": 1, "body": "some text"}]})
+    def test_storage_codec(self, dbfile):
+        """
+            Test that json files written with one codec can be read with every other codec
+        """
+        for name in available_codecs():
+            storage = JsonStorage(dbfile, codec=name)
+            storage.codec.name.should.be.equal(name)
+            storage.read().should.be.equal({"posts": [{"id": 1, "body": "some text"}]})
+            storage.write({"posts": [{"id": 1, "body": "some text"}]})
+            storage.close()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+from threading import Thread
+from unittest import TestCase
+
+from jsonserver.commit import GroupCommitter
+
+
+class GroupCommitterTest(TestCase):
+    """
+        Test GroupCommitter objects.
+    """
+
+    def test_coalesce_commits(self):
+        """
+            Test that concurrent commit requests are coalesced into fewer commits
+        """
+        commits = []
+        committer = GroupCommitter(lambda: commits.append(1), window=0.05)
+        committer.start()
+
+        threads = [Thread(target=committer.commit) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        len(commits).should.be.greater_than(0)
+        len(commits).should.be.lower_than(10)
+
+        committer.commit()
+        committer.stop()
+        committer.is_alive().should.be.false
+
+    def test_commit_error(self):
+        """
+            Test that errors of a commit are raised in every waiting writer
+        """
+        def fail():
+            raise OSError("disk full")
+
+        committer = GroupCommitter(fail, window=0)
+        committer.start()
+        committer.commit.when.called_with().should.throw(OSError, "disk full")
+        committer.stop()
+
+    def test_stop_commits_pending_requests(self):
+        """
+            Test that pending commit requests are committed when stopping
+        """
+        commits = []
+        committer = GroupCommitter(lambda: commits.append(1), window=10)
+        committer.start()
+
+        ticket = committer.request()
+        committer.stop()
+        ticket.wait()
+        commits.should.be.equal([1])
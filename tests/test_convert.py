@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+
+from jsonserver.convert import convert, main
+
+
+class ConvertTest(TestCase):
+    """
+        Test the conversion of databases between the storage formats.
+    """
+
+    @with_json_db({"posts": [{"id": 1, "title": "foo", "tags": ["a", "b"]}, {"id": 2, "title": None}], "users": []})
+    def test_convert(self, dbfile):
+        """
+            Test converting a json database to SQLite and MessagePack and back
+        """
+        with open(dbfile + ".log", "w") as f:
+            f.write('{"op":"insert","table":"users","row":{"id":1,"name":"luck"}}\n')
+
+        with TemporaryDirectory() as directory:
+            sqlite, msgpack, exported = (os.path.join(directory, name) for name in ("db.sqlite", "db.msgpack", "db.json"))
+            convert(dbfile, sqlite)
+            convert(sqlite, msgpack)
+            convert(msgpack, exported)
+
+            with open(exported) as f:
+                json.load(f).should.be.equal({"posts": [{"id": 1, "title": "foo", "tags": ["a", "b"]}, {"id": 2, "title": None}],
+                                              "users": [{"id": 1, "name": "luck"}]})
+        os.remove(dbfile + ".log")
+
+    @with_json_db({"posts": []})
+    def test_main(self, dbfile):
+        """
+            Test the command line of the conversion tool
+        """
+        with TemporaryDirectory() as directory:
+            target = os.path.join(directory, "db")
+            main([dbfile, target, "--to", "sqlite"]).should.be.equal(0)
+            main([dbfile, target, "--to", "sqlite"]).should.be.equal(1)
+            main([dbfile, target, "--to", "sqlite", "--force"]).should.be.equal(0)
+            main([os.path.join(directory, "missing.json"), target]).should.be.equal(1)
+            main([target, os.path.join(directory, "db.json"), "--from", "sqlite"]).should.be.equal(0)
+
+            other = os.path.join(directory, "other.sqlite")
+            with open(other, "w") as f:
+                f.write("not a database")
+            main([other, os.path.join(directory, "other.json")]).should.be.equal(1)
+            main([dbfile, other, "--force"]).should.be.equal(0)
+            main([other, os.path.join(directory, "other.json")]).should.be.equal(0)
+            sorted(os.listdir(directory)).should.be.equal(["db", "db.json", "other.json", "other.sqlite"])
+
+            with open(os.path.join(directory, "db.json")) as f:
+                json.load(f).should.be.equal({"posts": []})
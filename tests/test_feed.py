@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+import asyncio
+from threading import Timer
+from unittest import TestCase
+
+from jsonserver.feed import ChangeFeed, events
+from jsonserver.codec import get_codec
+from jsonserver.exceptions import ChangesExpired
+
+
+class ChangeFeedTest(TestCase):
+    """
+        Test the change feed of the json server.
+    """
+
+    def test_events(self):
+        """
+            Test the events of change records
+        """
+        events(1, {"op": "insert", "table": "posts", "row": {"id": 1}}).should.be.equal(
+            [{"seq": 1, "op": "insert", "table": "posts", "id": 1, "row": {"id": 1}}])
+        events(2, {"op": "batch", "table": "posts", "records": [
+            {"op": "update", "table": "posts", "id": 1, "data": {"a": 1}},
+            {"op": "remove", "table": "posts", "id": 2}]}).should.be.equal(
+            [{"seq": 2, "op": "update", "table": "posts", "id": 1, "data": {"a": 1}},
+             {"seq": 2, "op": "remove", "table": "posts", "id": 2}])
+        events(3, {"op": "index", "table": "posts", "column": "a"}).should.be.equal([])
+
+    def test_since(self):
+        """
+            Test reading the events after a sequence number
+        """
+        feed = ChangeFeed(max_size=2)
+        feed.append(1, {"op": "create", "table": "posts"})
+        feed.append(2, {"op": "create", "table": "users"})
+        feed.since(0).should.be.equal(([{"seq": 1, "op": "create", "table": "posts"},
+                                         {"seq": 2, "op": "create", "table": "users"}], 2))
+        feed.since(0, tables=["users"]).should.be.equal(([{"seq": 2, "op": "create", "table": "users"}], 2))
+        feed.since(2).should.be.equal(([], 2))
+        feed.since.when.called_with(5).should.throw(ChangesExpired)
+
+        feed.append(3, {"op": "drop", "table": "posts"})
+        feed.since.when.called_with(0).should.throw(ChangesExpired, "Changes after sequence number '0' expired, the feed starts after '1'")
+        feed.since(1).should.be.equal(([{"seq": 2, "op": "create", "table": "users"},
+                                        {"seq": 3, "op": "drop", "table": "posts"}], 3))
+
+        feed.resize(1)
+        feed.since.when.called_with(1).should.throw(ChangesExpired)
+        feed.since(2)[0].should.have.length_of(1)
+
+        feed.reset(10)
+        feed.since(10).should.be.equal(([], 10))
+        feed.since.when.called_with(3).should.throw(ChangesExpired)
+
+    def test_poll(self):
+        """
+            Test waiting for events
+        """
+        feed = ChangeFeed()
+        feed.poll(None).should.be.equal(([], 0))
+        feed.poll(0, timeout=0).should.be.equal(([], 0))
+
+        Timer(0.05, feed.append, (1, {"op": "create", "table": "posts"})).start()
+        feed.poll(0, timeout=5).should.be.equal(([{"seq": 1, "op": "create", "table": "posts"}], 1))
+
+        async def poll():
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.05, feed.append, 2, {"op": "drop", "table": "posts"})
+            return await feed.poll_async(1, timeout=5)
+
+        asyncio.run(poll()).should.be.equal(([{"seq": 2, "op": "drop", "table": "posts"}], 2))
+
+    def test_stream(self):
+        """
+            Test the events as server-sent events
+        """
+        feed = ChangeFeed(max_size=1)
+        codec = get_codec("json")
+        stream = feed.stream(None, codec, heartbeat=0)
+        next(stream).should.be.equal(b"retry: 1000\n\n")
+        next(stream).should.be.equal(b": keep-alive\n\n")
+
+        feed.append(1, {"op": "create", "table": "posts"})
+        json.loads(next(stream).split(b"data: ")[1]).should.be.equal({"seq": 1, "op": "create", "table": "posts"})
+
+        feed.append(2, {"op": "create", "table": "users"})
+        feed.append(3, {"op": "create", "table": "tags"})
+        next(stream).should.contain(b"event: expired\n")
+        list(stream).should.be.equal([])
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from tests.base import *
+import time
+from threading import Thread
 from unittest import TestCase
 
-from jsonserver.core import JsonServer
-from jsonserver.exceptions import TableNotFound, TableAlreadyExists, RowNotFound
+from jsonserver.core import JsonServer, foreign_key, foreign_key_affixes, is_foreign_key
+from jsonserver.query import Condition
+from jsonserver.exceptions import JsonServerError, TableNotFound, TableAlreadyExists, RowNotFound, IndexNotFound, IndexAlreadyExists
 
 
 class JsonServerTest(TestCase):
@@ -172,7 +175,7 @@ class JsonServerTest(TestCase):
         server.get_table("posts").should.be.equal({"posts": []})
 
         with open(server.dbfile, "r") as f:
-            json.loads(f.read()).should.be.equal({"posts": []})
+            json.loads(f.read()).should.be.equal({"posts": [], "_sequences": [{"id": "posts", "sequence": 2}]})
 
     @with_jsonserver({"posts": [{"author": "tuxtimo", "id": 1, "title": "jsonserver"}, {"author": "tuxtimo", "id": 2, "title": "jsonserver2"}]})
     def test_update_row(self, server):
@@ -195,6 +198,22 @@ class JsonServerTest(TestCase):
         with open(server.dbfile, "r") as f:
             json.loads(f.read()).should.be.equal({"posts": [{"author": "chucknorris", "id": 1, "title": "jsonserver"}, {"author": "tuxtimo", "id": 2, "title": "more fancy title"}]})
 
+    @with_jsonserver({"posts": [{"id": 2, "title": "b"}, {"id": 1, "title": "a"}, {"id": 3, "title": "c"}]})
+    def test_update_unordered_row(self, server):
+        """
+            Test updating rows of a table not ordered by id, in place of the old rows
+        """
+        server.update("posts", 1, {"title": "A"})
+        server.insert("posts", {"title": "d"})
+        server.remove("posts", 2)
+        server.update("posts", 4, {"title": "D"})
+        server.get_table("posts")  # purges the removed row
+        server.update("posts", 3, {"title": "C"})
+        server.update("posts", 1, {"title": "AA"})
+
+        server.get_table("posts").should.be.equal({"posts": [{"id": 1, "title": "AA"}, {"id": 3, "title": "C"},
+                                                             {"id": 4, "title": "D"}]})
+
     @with_jsonserver()
     def test_create_table(self, server):
         """
@@ -236,3 +255,502 @@ class JsonServerTest(TestCase):
             json.loads(data if data else "{}").should.be.equal({})
 
         server.drop.when.called_with("posts").should.throw(TableNotFound, "Table 'posts' not found")
+
+    @with_jsonserver({"posts": [{"author": "tuxtimo", "id": 1, "title": "jsonserver"}, {"author": "tuxtimo", "id": 2, "title": "jsonserver2"}]})
+    def test_primary_key_index(self, server):
+        """
+            Test that the primary key index is kept in sync with the table rows
+        """
+        server.row_exists("posts", 1).should.be.true
+        server.row_exists("posts", 3).should.be.false
+        server.row_exists.when.called_with("comments", 1).should.throw(TableNotFound, "Table 'comments' not found")
+
+        server.remove("posts", 1)
+        server.row_exists("posts", 1).should.be.false
+        server.get_row.when.called_with("posts", 1).should.throw(RowNotFound, "Row with id '1' in table 'posts' not found")
+        server.update.when.called_with("posts", 1, {"title": "foo"}).should.throw(RowNotFound, "Row with id '1' in table 'posts' not found")
+
+        server.insert("posts", {"author": "chucknorris", "title": "roundhouse"})
+        server.get_row("posts", 3).should.be.equal({"author": "chucknorris", "id": 3, "title": "roundhouse"})
+
+        server.update("posts", 3, {"id": 42, "title": "kick"})
+        server.get_row("posts", 3).should.be.equal({"author": "chucknorris", "id": 3, "title": "kick"})
+        server.get_table("posts").should.be.equal({"posts": [{"author": "tuxtimo", "id": 2, "title": "jsonserver2"}, {"author": "chucknorris", "id": 3, "title": "kick"}]})
+
+        server.drop("posts")
+        server.create("posts")
+        server.row_exists("posts", 2).should.be.false
+
+    @with_jsonserver({"posts": [{"author": "tuxtimo", "id": 1, "title": "jsonserver"}, {"author": "tuxtimo", "id": 5, "title": "jsonserver2"}]})
+    def test_autoincrement_sequence(self, server):
+        """
+            Test that row ids are allocated from a monotonic sequence per table
+        """
+        server.insert("posts", {"title": "foo"})
+        server.get_row("posts", 6).should.be.equal({"id": 6, "title": "foo"})
+
+        server.remove("posts", 6)
+        server.insert("posts", {"title": "bar"})
+        server.row_exists("posts", 6).should.be.false
+        server.get_row("posts", 7).should.be.equal({"id": 7, "title": "bar"})
+
+        server.flush()
+        server.open(server.dbfile)
+        server.insert("posts", {"title": "baz"})
+        server.get_row("posts", 8).should.be.equal({"id": 8, "title": "baz"})
+
+    @with_jsonserver({"posts": [{"id": 1}, {"id": 2}], "users": [{"id": 1}]})
+    def test_sequence_persisted(self, server):
+        """
+            Test that ids of removed rows are not reused after the data is read again
+        """
+        server.insert("posts", {}).should.be.equal(3)
+        server.remove("posts", 3, flush=True)
+        with open(server.dbfile) as f:
+            json.load(f).should.be.equal({"posts": [{"id": 1}, {"id": 2}], "users": [{"id": 1}],
+                                          "_sequences": [{"id": "posts", "sequence": 3}]})
+
+        server.open(server.dbfile)
+        server.all().should.be.equal({"posts": [{"id": 1}, {"id": 2}], "users": [{"id": 1}]})
+        server.insert("posts", {}).should.be.equal(4)
+        server.remove("posts", 4, flush=True)
+
+        server.open(server.dbfile, lazy=True)  # the sequences of tables which are not loaded are kept
+        server.insert("users", {}).should.be.equal(2)
+        server.flush()
+        server.open(server.dbfile, journal=True)
+        server.insert("posts", {}).should.be.equal(5)
+        server.remove("posts", 5)
+        server.remove("posts", 2, flush=True)
+
+        server.open(server.dbfile, journal=True)  # replayed from the journal
+        server.insert("posts", {}).should.be.equal(6)
+        server.remove("posts", 6, flush=True)
+        server.compact()
+        server.open(server.dbfile, journal=True)
+        server.insert("posts", {}).should.be.equal(7)
+
+        server.drop("posts")
+        server.create("posts")
+        server.insert("posts", {}).should.be.equal(1)
+        server.create.when.called_with("_sequences").should.throw(JsonServerError)
+
+    @with_jsonserver({"tags": [{"id": 1}, {"id": "python"}, {"id": 3}, {"id": "json"}]})
+    def test_mixed_ids(self, server):
+        """
+            Test that tables with ids of different types are read and continue after the highest integer id
+        """
+        server.get_row("tags", "python").should.be.equal({"id": "python"})
+        server.get_row("tags", 3).should.be.equal({"id": 3})
+        server.insert("tags", {}, flush=True).should.be.equal(4)
+
+        server.open(server.dbfile)
+        server.get_row("tags", 4).should.be.equal({"id": 4})
+        server.remove("tags", 4, flush=True)
+        server.open(server.dbfile)
+        server.insert("tags", {}).should.be.equal(5)
+
+    @with_jsonserver({"comments": [{"body": "foo", "id": 1, "postId": 1}, {"body": "bar", "id": 2, "postId": 1}, {"body": "foo", "id": 3, "postId": 2}], "posts": [{"author": "tuxtimo", "id": 1}, {"author": "tuxtimo", "id": 2}]})
+    def test_secondary_indexes(self, server):
+        """
+            Test that where uses secondary indexes which are kept in sync with the table rows
+        """
+        server.indexes("comments").should.be.equal(["postId"])
+        server.indexes("posts").should.be.equal([])
+
+        server.create_index("comments", "body")
+        server.indexes("comments").should.be.equal(["body", "postId"])
+        server.create_index.when.called_with("comments", "body").should.throw(IndexAlreadyExists, "Index on column 'body' of table 'comments' already exists")
+        server.create_index.when.called_with("comments", "id").should.throw(IndexAlreadyExists, "Index on column 'id' of table 'comments' already exists")
+
+        server.where("comments", postId=1).should.be.equal([{"body": "foo", "id": 1, "postId": 1}, {"body": "bar", "id": 2, "postId": 1}])
+        server.where("comments", postId=1, body="foo").should.be.equal([{"body": "foo", "id": 1, "postId": 1}])
+        server.where("comments", id=3, body="foo").should.be.equal([{"body": "foo", "id": 3, "postId": 2}])
+        server.where("comments", author="tuxtimo").should.be.equal([])
+
+        server.update("comments", 1, {"postId": 2})
+        server.remove("comments", 3)
+        server.insert("comments", {"body": "foo", "postId": 2})
+        server.where("comments", postId=2).should.be.equal([{"body": "foo", "id": 1, "postId": 2}, {"body": "foo", "id": 4, "postId": 2}])
+        server.where("comments", postId=1).should.be.equal([{"body": "bar", "id": 2, "postId": 1}])
+
+        server.insert("posts", {"author": "chucknorris", "userId": 1})
+        server.indexes("posts").should.be.equal(["userId"])
+        server.where("posts", userId=1).should.be.equal([{"author": "chucknorris", "id": 3, "userId": 1}])
+
+        server.drop_index("comments", "body")
+        server.drop_index.when.called_with("comments", "body").should.throw(IndexNotFound, "Index on column 'body' of table 'comments' not found")
+        server.where("comments", body="foo").should.be.equal([{"body": "foo", "id": 1, "postId": 2}, {"body": "foo", "id": 4, "postId": 2}])
+
+    @with_jsonserver({"posts": [{"author": "tuxtimo", "id": 1, "title": "jsonserver"}]}, journal=True)
+    def test_journal(self, server):
+        """
+            Test that changes are appended to the journal and replayed on open
+        """
+        server.create("comments")
+        server.insert("comments", {"body": "foo", "postId": 1})
+        server.insert("posts", {"author": "chucknorris", "title": "roundhouse"})
+        server.update("posts", 1, {"title": "kick"})
+        server.remove("posts", 2, flush=True)
+
+        with open(server.dbfile, "r") as f:
+            json.loads(f.read()).should.be.equal({"posts": [{"author": "tuxtimo", "id": 1, "title": "jsonserver"}]})
+
+        with open(server.dbfile + ".log", "r") as f:
+            len(f.readlines()).should.be.equal(5)
+
+        server.close()
+        server.open(server.dbfile, journal=True)
+        server.all().should.be.equal({"posts": [{"author": "tuxtimo", "id": 1, "title": "kick"}], "comments": [{"body": "foo", "id": 1, "postId": 1}]})
+        server.where("comments", postId=1).should.be.equal([{"body": "foo", "id": 1, "postId": 1}])
+
+        server.insert("posts", {"title": "bar"})
+        server.get_row("posts", 3).should.be.equal({"id": 3, "title": "bar"})
+
+        server.flush()
+        with open(server.dbfile + ".log", "r") as f:
+            f.read().should.be.equal("")
+
+        server.close()
+        server.open(server.dbfile, journal=True)
+        server.all().should.be.equal({"posts": [{"author": "tuxtimo", "id": 1, "title": "kick"}, {"id": 3, "title": "bar"}], "comments": [{"body": "foo", "id": 1, "postId": 1}]})
+
+    @with_jsonserver({"posts": [{"author": "tuxtimo", "id": 1, "title": "jsonserver"}]}, journal=True)
+    def test_compact(self, server):
+        """
+            Test compacting the journal into a snapshot
+        """
+        server.insert("posts", {"title": "foo"})
+        server.update("posts", 1, {"title": "bar"})
+        mark = server._db.mark()
+        server.remove("posts", 2, flush=True)
+
+        server._db.compact(server.snapshot(), mark)
+        server._db.journal_records.should.be.equal(1)
+
+        with open(server.dbfile, "r") as f:
+            json.loads(f.read()).should.be.equal({"posts": [{"author": "tuxtimo", "id": 1, "title": "bar"}]})
+
+        with open(server.dbfile + ".log", "r") as f:
+            f.read().should.be.equal('{"op":"remove","table":"posts","id":2,"sequence":2}\n')
+
+        server.compact()
+        server._db.journal_records.should.be.equal(0)
+
+        server.close()
+        server.open(server.dbfile, journal=True)
+        server.all().should.be.equal({"posts": [{"author": "tuxtimo", "id": 1, "title": "bar"}]})
+
+    @with_jsonserver({"posts": []}, journal=True)
+    def test_compactor(self, server):
+        """
+            Test compacting the journal in the background once it exceeds the thresholds
+        """
+        server.start_compactor(max_size=0, max_records=3)
+        server.insert("posts", {"title": "foo"})
+        server.insert("posts", {"title": "bar"})
+        server._db.journal_records.should.be.equal(2)
+
+        server.insert("posts", {"title": "baz"})
+        for _ in range(100):
+            if server._db.journal_records == 0:
+                break
+            time.sleep(0.01)
+        server.stop_compactor()
+
+        server._db.journal_records.should.be.equal(0)
+        with open(server.dbfile, "r") as f:
+            json.loads(f.read()).should.be.equal({"posts": [{"id": 1, "title": "foo"}, {"id": 2, "title": "bar"}, {"id": 3, "title": "baz"}]})
+
+    @with_jsonserver({"posts": []})
+    def test_compactor_requires_journal(self, server):
+        """
+            Test that compaction is only available for journaled storages
+        """
+        server.start_compactor.when.called_with().should.throw(JsonServerError, "Compaction requires a journaled storage")
+
+    @with_jsonserver({"posts": []})
+    def test_group_commit(self, server):
+        """
+            Test that flushed changes are written by the group committer before returning
+        """
+        server.start_committer(window=0.01)
+        server.insert("posts", {"title": "foo"})
+        server.insert("posts", {"title": "bar"}, flush=True)
+
+        with open(server.dbfile, "r") as f:
+            json.loads(f.read()).should.be.equal({"posts": [{"id": 1, "title": "foo"}, {"id": 2, "title": "bar"}]})
+
+    @with_jsonserver({"posts": [{"id": 1, "title": "jsonserver"}], "comments": []})
+    def test_versions(self, server):
+        """
+            Test that table versions are increased by every change and never reused
+        """
+        posts, comments, database = server.version("posts"), server.version("comments"), server.version()
+
+        server.insert("comments", {"postId": 1})
+        server.version("posts").should.be.equal(posts)
+        server.version("comments").should.be.greater_than(comments)
+        server.version().should.be.greater_than(database)
+
+        for change in (lambda: server.update("posts", 1, {"title": "foo"}), lambda: server.remove("posts", 1),
+                       lambda: server.drop("posts"), lambda: server.create("posts")):
+            posts = server.version("posts")
+            change()
+            server.version("posts").should.be.greater_than(posts)
+
+        posts = server.version("posts")
+        server.read(flush_previous=False)
+        server.version("posts").should.be.greater_than(posts)
+
+    @with_jsonserver({"posts": [{"id": i, "title": str(i)} for i in range(1, 11)], "comments": [{"id": 3}, {"id": 1}, {"id": 2}],
+                      "tags": [{"id": "json"}, {"id": "python"}]})
+    def test_page(self, server):
+        """
+            Test reading pages of a table by offset and by cursor
+        """
+        server.page("posts").should.be.equal((server.get_table("posts")["posts"], 10))
+
+        rows, total = server.page("posts", limit=3, offset=2)
+        [r["id"] for r in rows].should.be.equal([3, 4, 5])
+        total.should.be.equal(10)
+
+        rows, total = server.page("posts", limit=3, after=5)
+        [r["id"] for r in rows].should.be.equal([6, 7, 8])
+        rows, total = server.page("posts", limit=3, after=9)
+        [r["id"] for r in rows].should.be.equal([10])
+
+        server.remove("posts", 7)
+        server.insert("posts", {"title": "11"})
+        rows, total = server.page("posts", limit=3, offset=1, after=5)
+        [r["id"] for r in rows].should.be.equal([8, 9, 10])
+        total.should.be.equal(10)
+
+        rows, total = server.page("comments", limit=2, after=1)
+        [r["id"] for r in rows].should.be.equal([2, 3])
+        rows, total = server.page("comments", after=0)
+        [r["id"] for r in rows].should.be.equal([1, 2, 3])
+
+        rows, total = server.page("tags", limit=2, after=1)
+        rows.should.be.equal([])
+        total.should.be.equal(2)
+        rows, total = server.page("tags", limit=2, after="l")
+        [r["id"] for r in rows].should.be.equal(["python"])
+
+        server.page.when.called_with("users").should.throw(TableNotFound, "Table 'users' not found")
+
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo", "views": 10, "userId": 1},
+                                {"id": 2, "author": "luck", "views": 5, "userId": 2},
+                                {"id": 3, "author": "tuxtimo", "views": 20, "userId": 1},
+                                {"id": 4, "author": "obi", "views": 15, "userId": 1}]})
+    def test_query(self, server):
+        """
+            Test querying rows with conditions, sorting, projection and paging
+        """
+        rows, total = server.query("posts", [Condition.parse("userId", "1"), Condition.parse("views_gte", "15")])
+        [r["id"] for r in rows].should.be.equal([3, 4])
+        total.should.be.equal(2)
+
+        rows, total = server.query("posts", sort="views", order="desc", limit=2, fields=["id", "views"])
+        rows.should.be.equal([{"id": 3, "views": 20}, {"id": 4, "views": 15}])
+        total.should.be.equal(4)
+
+        rows, total = server.query("posts", [Condition.parse("author_ne", "luck")], sort="views", limit=1, offset=1)
+        [r["id"] for r in rows].should.be.equal([4])
+        total.should.be.equal(3)
+
+        rows, total = server.query("posts", [Condition.parse("author", "tuxtimo")], limit=1, after=1)
+        [r["id"] for r in rows].should.be.equal([3])
+
+        rows, total = server.query("posts", fields=["author"], limit=2)
+        rows.should.be.equal([{"author": "tuxtimo"}, {"author": "luck"}])
+
+        server.query.when.called_with("posts", order="up").should.throw(ValueError, "Unknown sort order 'up', expected asc or desc")
+        server.query.when.called_with("users", sort="id").should.throw(TableNotFound, "Table 'users' not found")
+
+    @with_jsonserver({"users": [{"id": 1, "name": "tuxtimo"}, {"id": 2, "name": "luck"}],
+                      "posts": [{"id": 1, "userId": 1}, {"id": 2, "userId": 2}, {"id": 3, "userId": 3}],
+                      "comments": [{"id": 2, "postId": 1}, {"id": 1, "postId": 1}, {"id": 3, "postId": 3}]})
+    def test_embed(self, server):
+        """
+            Test embedding the related rows of other tables
+        """
+        server.get_row("users", 1, embed=["posts"]).should.be.equal({"id": 1, "name": "tuxtimo", "posts": [{"id": 1, "userId": 1}]})
+        server.get_row("posts", 3, expand=["users"]).should.be.equal({"id": 3, "userId": 3, "user": None})
+        server.get_row("users", 1).should_not.have.key("posts")
+
+        rows, total = server.query("posts", embed=["comments"], expand=["users"], fields=["id"], limit=2)
+        rows.should.be.equal([{"id": 1, "user": {"id": 1, "name": "tuxtimo"}, "comments": [{"id": 1, "postId": 1}, {"id": 2, "postId": 1}]},
+                              {"id": 2, "user": {"id": 2, "name": "luck"}, "comments": []}])
+
+        server.drop_index("comments", "postId")  # joined by a scan of the table
+        server.embed("posts", server.get_table("posts")["posts"], ["comments"])[0]["comments"].should.be.equal([{"id": 2, "postId": 1}, {"id": 1, "postId": 1}])
+        server.embed.when.called_with("posts", [], ["likes"]).should.throw(TableNotFound, "Table 'likes' not found")
+
+    @with_jsonserver({"users": [{"id": 1}], "posts": [{"id": 1, "user_id": 1}]})
+    def test_foreign_key_naming(self, server):
+        """
+            Test relations with another naming of foreign key columns
+        """
+        foreign_key("posts").should.be.equal("postId")
+        foreign_key("posts", "{table}_id").should.be.equal("posts_id")
+        foreign_key("users", "{singular}_id").should.be.equal("user_id")
+        is_foreign_key("user_id", "{singular}_id").should.be.ok
+        is_foreign_key("userId", "{singular}_id").should_not.be.ok
+        foreign_key_affixes.when.called_with("id").should.throw(ValueError)
+
+        server.foreign_key_naming = "{singular}_id"
+        try:
+            server.read()
+            server.indexes("posts").should.be.equal(["user_id"])
+            server.get_row_sub_table("users", 1, "posts").should.be.equal({"posts": [{"id": 1, "user_id": 1}]})
+            server.get_row("posts", 1, expand=["users"])["user"].should.be.equal({"id": 1})
+        finally:
+            del server.foreign_key_naming
+
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}, {"id": 2, "author": "luck"}]}, journal=True)
+    def test_bulk(self, server):
+        """
+            Test inserting, updating and removing rows in a single batch
+        """
+        server.create_index("posts", "author")
+        server.insert_many("posts", [{"author": "foo"}, {"author": "bar"}]).should.be.equal([3, 4])
+        server.update_many("posts", {1: {"author": "baz", "id": 7}}).should.be.equal([1])
+        server.remove_many("posts", [2, 2]).should.be.equal([2])
+        server.where("posts", author="baz").should.be.equal([{"id": 1, "author": "baz"}])
+
+        server.bulk.when.called_with("posts", update={1: {"author": "qux"}}, remove=[5]).should.throw(RowNotFound, "Row with id '5' in table 'posts' not found")
+        server.get_row("posts", 1).should.be.equal({"id": 1, "author": "baz"})
+        server.insert_many.when.called_with("users", [{}]).should.throw(TableNotFound, "Table 'users' not found")
+
+        sequence = server.sequence
+        server.bulk.when.called_with("posts", insert=[{"author": "qux"}, "x"], update={1: {"author": "qux"}}, remove=[3]).should.throw(TypeError)
+        server.bulk.when.called_with("posts", update={1: "qux"}, remove=[3]).should.throw(TypeError)
+        server.get_table("posts").should.be.equal({"posts": [{"id": 1, "author": "baz"}, {"id": 3, "author": "foo"}, {"id": 4, "author": "bar"}]})
+        server.sequence.should.be.equal(sequence)  # nothing was published
+
+        result = server.bulk("posts", insert=[{"author": "qux"}], update={3: {"title": "x"}}, remove=[4], flush=True)
+        result.should.be.equal({"insert": [5], "update": [3], "remove": [4]})
+
+        with open(server.dbfile + ".log", "r") as f:
+            len(f.readlines()).should.be.equal(4)
+
+        server.close()
+        server.open(server.dbfile, journal=True)
+        server.get_table("posts").should.be.equal({"posts": [{"id": 1, "author": "baz"}, {"id": 3, "author": "foo", "title": "x"}, {"id": 5, "author": "qux"}]})
+        server.insert("posts", {}).should.be.equal(6)
+        server.get_row("posts", 6).should.be.equal({"id": 6})
+
+    @with_jsonserver({"posts": [{"id": 1, "views": 0, "userId": 1}]})
+    def test_concurrent_readers_and_writers(self, server):
+        """
+            Test that reads are isolated from concurrent writes
+        """
+        table = server.get_table("posts")["posts"]
+        row = server.get_row("posts", 1)
+        errors = []
+
+        def write():
+            try:
+                for i in range(200):
+                    server.update("posts", 1, {"views": i + 1})
+                    server.insert("posts", {"views": 0, "userId": 1})
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                for i in range(200):
+                    rows = server.where("posts", userId=1)
+                    [r["id"] for r in rows].should.be.equal(list(range(1, len(rows) + 1)))
+                    server.snapshot()["posts"][0]["id"].should.be.equal(1)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=write)] + [Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        errors.should.be.equal([])
+        table.should.be.equal([{"id": 1, "views": 0, "userId": 1}])
+        row.should.be.equal({"id": 1, "views": 0, "userId": 1})
+        server.get_row("posts", 1)["views"].should.be.equal(200)
+        server.where("posts", userId=1).should.have.length_of(201)
+
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}]})
+    def test_changes(self, server):
+        """
+            Test the change feed of the data
+        """
+        start = server.changes.last
+        server.insert("posts", {"author": "luck"})
+        server.update("posts", 1, {"author": "obi"})
+        server.bulk("posts", insert=[{"author": "foo"}], remove=[2])
+        server.create_index("posts", "author")
+
+        events, last = server.changes.since(start)
+        last.should.be.equal(server.sequence)
+        [(e["seq"] - start, e["op"], e.get("id")) for e in events].should.be.equal(
+            [(1, "insert", 2), (2, "update", 1), (3, "remove", 2), (3, "insert", 3)])
+        server.changes.since(start, tables=["users"]).should.be.equal(([], last))
+
+        server.read()
+        server.changes.since(last).should.be.equal(([], last))
+
+    @with_jsonserver({"posts": [{"id": 1, "userId": 1}, {"id": 2, "userId": 2}], "users": [{"id": 1}, {"id": 2}],
+                      "tags": [{"id": 1}]}, journal=True, lazy=True)
+    def test_lazy_read(self, server):
+        """
+            Test decoding the tables of a lazily read database on their first access
+        """
+        sorted(server._deferred).should.be.equal(["posts", "tags", "users"])
+        server.table_exists("posts").should.be.true
+        server.get_row("users", 2).should.be.equal({"id": 2})
+        sorted(server._deferred).should.be.equal(["posts", "tags"])
+
+        server.get_row_sub_table("users", 1, "posts").should.be.equal({"posts": [{"id": 1, "userId": 1}]})
+        server.indexes("posts").should.be.equal(["userId"])
+        server.insert("users", {}).should.be.equal(3)
+        server.drop("tags")
+        list(server._deferred).should.be.equal([])
+
+        server.compact()
+        with open(server.dbfile) as f:
+            json.load(f).should.be.equal({"posts": [{"id": 1, "userId": 1}, {"id": 2, "userId": 2}],
+                                          "users": [{"id": 1}, {"id": 2}, {"id": 3}]})
+
+        server.read()
+        server.remove("users", 3, flush=True)
+        server.compact()  # untouched tables are copied as they are
+        list(server._deferred).should.be.equal(["posts"])
+        server.all().should.be.equal({"posts": [{"id": 1, "userId": 1}, {"id": 2, "userId": 2}],
+                                      "users": [{"id": 1}, {"id": 2}]})
+
+    def test_sqlite_storage(self):
+        """
+            Test changes written row by row to a SQLite database
+        """
+        with NamedTemporaryFile(suffix=".sqlite") as tmpfile:
+            server = JsonServer()
+            server.open(tmpfile.name, lazy=True)
+            server.create("posts")
+            server.insert_many("posts", [{"author": "tuxtimo"}, {"author": "luck"}])
+            server.update("posts", 1, {"author": "obi"}, flush=True)
+            server.close()
+
+            server.open(tmpfile.name, lazy=True)
+            list(server._deferred).should.be.equal(["posts"])
+            server.remove("posts", 2)
+            server.close()
+
+            server.open(tmpfile.name)
+            server.all().should.be.equal({"posts": [{"id": 1, "author": "obi"}]})
+            server.insert("posts", {}).should.be.equal(3)  # ids are never reused
+
+            server.open(tmpfile.name)  # the previous database is closed, its pending changes are committed
+            server.insert("posts", {}, flush=True).should.be.equal(4)
+            server.open(tmpfile.name)
+            [row["id"] for row in server.get_table("posts")["posts"]].should.be.equal([1, 3, 4])
+            server.close()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+import time
+from threading import Thread
+from unittest import TestCase
+
+from jsonserver.lock import RWLock
+
+
+class RWLockTest(TestCase):
+    """
+        Test RWLock objects.
+    """
+
+    def test_shared_readers(self):
+        """
+            Test that readers hold the lock at the same time
+        """
+        lock = RWLock()
+        readers = []
+
+        def read():
+            with lock.read():
+                readers.append(1)
+                time.sleep(0.05)
+
+        with lock.read():
+            thread = Thread(target=read)
+            thread.start()
+            thread.join(1)
+            thread.is_alive().should.be.false
+        readers.should.be.equal([1])
+
+    def test_exclusive_writer(self):
+        """
+            Test that a writer excludes readers and takes precedence over new readers
+        """
+        lock = RWLock()
+        events = []
+
+        def write():
+            with lock.write():
+                events.append("write")
+
+        def read():
+            with lock.read():
+                events.append("read")
+
+        lock.acquire_read()
+        writer = Thread(target=write)
+        writer.start()
+        time.sleep(0.05)
+        reader = Thread(target=read)
+        reader.start()
+        time.sleep(0.05)
+        events.should.be.equal([])
+
+        lock.release_read()
+        writer.join(1)
+        reader.join(1)
+        events.should.be.equal(["write", "read"])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+from threading import Thread
+from unittest import TestCase
+
+from jsonserver.metrics import Counter, Histogram, Registry
+
+
+class MetricsTest(TestCase):
+    """
+        Test the metrics and their text format.
+    """
+
+    def test_counter(self):
+        """
+            Test counting in several threads
+        """
+        counter = Counter("requests_total", "Requests.", ("method",))
+
+        def count():
+            for _ in range(1000):
+                counter.inc(("GET",))
+
+        threads = [Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(("POST",), 2)
+
+        counter.value(("GET",)).should.be.equal(4000)
+        counter.value(("POST",)).should.be.equal(2)
+        counter.value(("PUT",)).should.be.equal(0)
+        counter.render().should.be.equal([
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            "requests_total{method=\"GET\"} 4000",
+            "requests_total{method=\"POST\"} 2"])
+
+    def test_histogram(self):
+        """
+            Test observing values in buckets
+        """
+        histogram = Histogram("size_bytes", "Sizes.", buckets=(10, 100))
+        for value in (5, 10, 50, 500):
+            histogram.observe(value)
+
+        histogram.counts().should.be.equal((4, 565))
+        histogram.render().should.be.equal([
+            "# HELP size_bytes Sizes.",
+            "# TYPE size_bytes histogram",
+            "size_bytes_bucket{le=\"10\"} 2",
+            "size_bytes_bucket{le=\"100\"} 3",
+            "size_bytes_bucket{le=\"+Inf\"} 4",
+            "size_bytes_sum 565",
+            "size_bytes_count 4"])
+
+        with histogram.time(("x",)):
+            pass
+        histogram.counts(("x",))[0].should.be.equal(1)
+
+    def test_registry(self):
+        """
+            Test rendering the registered metrics
+        """
+        registry = Registry()
+        registry.gauge("rows", "Rows.", ("table",), lambda: {("a\"b",): 3})
+        registry.counter("errors_total", "Errors.").inc()
+        registry.counter.when.called_with("rows", "Rows.").should.throw(ValueError)
+
+        registry.get("errors_total").value().should.be.equal(1)
+        registry.render().should.be.equal(
+            "# HELP errors_total Errors.\n# TYPE errors_total counter\nerrors_total 1\n"
+            "# HELP rows Rows.\n# TYPE rows gauge\nrows{table=\"a\\\"b\"} 3\n")
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+import time
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+
+from jsonserver.profiling import Profile, Profiler, span
+
+
+class ProfilingTest(TestCase):
+    """
+        Test the profiles of requests.
+    """
+
+    def test_spans(self):
+        """
+            Test that nested spans are not counted twice
+        """
+        profile = Profile(spans=True)
+        with span("lookup"):
+            time.sleep(0.01)
+            with span("filter"):
+                time.sleep(0.02)
+        with span("filter"):
+            pass
+        profile.stop()
+
+        profile.spans["lookup"].should.be.within(0.01, 0.02)
+        profile.spans["filter"].should.be.greater_than_or_equal_to(0.02)
+        sum(profile.spans.values()).should.be.lower_than_or_equal_to(profile.duration)
+        set(profile.breakdown()).should.be.equal({"lookup", "filter", "other"})
+        profile.server_timing().should.match(r"^filter;dur=[\d.]+, lookup;dur=[\d.]+, other;dur=[\d.]+, total;dur=[\d.]+$")
+
+        with span("lookup"):  # no profile is active anymore
+            pass
+        profile.spans.should.have.length_of(2)
+
+    def test_slowest_dumps(self):
+        """
+            Test keeping the cProfile stats of the slowest requests
+        """
+        with TemporaryDirectory() as directory:
+            profiler = Profiler(dump_dir=directory, dump_count=2)
+            profiler.start().profiler.should.be.none
+
+            dumps = []
+            for delay in (0.02, 0.0, 0.03, 0.01):
+                profile = profiler.start(requested=True)
+                time.sleep(delay)
+                dumps.append(profiler.finish(profile, "GET", "/posts?id=1", 200))
+
+            dumps[1].shouldnt.be.none  # written while less than two were kept, displaced by the third
+            dumps[3].should.be.none
+            sorted(os.listdir(directory)).should.be.equal(sorted(os.path.basename(d) for d in (dumps[0], dumps[2])))
+            os.path.basename(dumps[0]).should.match(r"^\d+ms-GET-posts_id_1-0\.prof$")
+
+    def test_single_capture(self):
+        """
+            Test that only one request runs under cProfile at a time
+        """
+        with TemporaryDirectory() as directory:
+            profiler = Profiler(dump_dir=directory)
+            first = profiler.start(requested=True)
+            second = profiler.start(requested=True)
+            first.profiler.shouldnt.be.none
+            second.profiler.should.be.none
+            second.spans.should.be.equal({})
+
+            profiler.finish(second, "GET", "/posts", 200).should.be.none
+            profiler.finish(first, "GET", "/posts", 200).shouldnt.be.none
+            profile = profiler.start(requested=True)
+            profile.profiler.shouldnt.be.none
+            profile.stop()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+from unittest import TestCase
+
+from jsonserver.query import Condition, sort_key
+
+
+class ConditionTest(TestCase):
+    """
+        Test Condition objects.
+    """
+
+    def test_parse(self):
+        """
+            Test parsing conditions from query string arguments
+        """
+        condition = Condition.parse("views_gte", "10")
+        (condition.column, condition.operator, condition.values).should.be.equal(("views", "gte", (10, "10")))
+
+        condition = Condition.parse("created_at", "2015")
+        (condition.column, condition.operator, condition.values).should.be.equal(("created_at", "eq", (2015, "2015")))
+
+        condition = Condition.parse("title_like", "json")
+        (condition.column, condition.operator, condition.values).should.be.equal(("title", "like", ("json",)))
+
+        condition = Condition.parse("_ne", "foo")
+        (condition.column, condition.operator).should.be.equal(("_ne", "eq"))
+
+        Condition.when.called_with("title", "in", "foo").should.throw(ValueError, "Unknown operator 'in'")
+        Condition.parse.when.called_with("title_like", "(").should.throw(ValueError)
+
+    def test_matches(self):
+        """
+            Test checking rows against conditions
+        """
+        row = {"id": 1, "title": "JsonServer", "views": 10, "year": "2015", "draft": False}
+
+        Condition.parse("id", "1").matches(row).should.be.true
+        Condition.parse("year", "2015").matches(row).should.be.true
+        Condition.parse("draft", "false").matches(row).should.be.true
+        Condition.parse("author", "tuxtimo").matches(row).should.be.false
+        Condition.parse("title_ne", "foo").matches(row).should.be.true
+        Condition.parse("author_ne", "tuxtimo").matches(row).should.be.true
+        Condition.parse("views_gte", "10").matches(row).should.be.true
+        Condition.parse("views_gt", "10").matches(row).should.be.false
+        Condition.parse("views_lt", "9.5").matches(row).should.be.false
+        Condition.parse("title_lte", "Z").matches(row).should.be.true
+        Condition.parse("title_like", "^json").matches(row).should.be.true
+        Condition.parse("views_like", "1").matches(row).should.be.true
+        Condition.parse("author_like", ".*").matches(row).should.be.false
+
+    def test_sort_key(self):
+        """
+            Test sorting rows with values of different types
+        """
+        rows = [{"id": 1, "v": "b"}, {"id": 2}, {"id": 3, "v": 2}, {"id": 4, "v": "a"}, {"id": 5, "v": [1]}, {"id": 6, "v": 1.5}]
+        [r["id"] for r in sorted(rows, key=sort_key("v"))].should.be.equal([6, 3, 4, 1, 5, 2])
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+import os
+import json
+import signal
+import tempfile
+import multiprocessing
+from unittest import TestCase
+
+from jsonserver.core import JsonServer
+from jsonserver.replication import ReplicationServer, Replica
+from jsonserver.exceptions import TableNotFound, RowNotFound
+
+
+def run_writer(dbfile, path, ready):
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    server = JsonServer()
+    server.open(dbfile, journal=True)
+    server.create_index("posts", "author")
+    replication = ReplicationServer(server, path)
+    replication.start()
+    ready.set()
+    try:
+        replication.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replication.stop()
+        server.close()
+
+
+class ReplicationTest(TestCase):
+    """
+        Test replicating a json server to another process.
+    """
+
+    @with_json_db({"posts": [{"id": 1, "author": "tuxtimo"}], "comments": [{"id": 1, "postId": 1}]})
+    def test_replica(self, dbfile):
+        """
+            Test that a replica follows the writer and forwards its writes
+        """
+        path = os.path.join(tempfile.mkdtemp(), "writer.sock")
+        context = multiprocessing.get_context("fork")
+        ready = context.Event()
+        writer = context.Process(target=run_writer, args=(dbfile, path, ready))
+        writer.start()
+        ready.wait(10).should.be.true
+
+        server = JsonServer()
+        try:
+            Replica(server, path).start()
+            server.dbfile.should.be.none
+            server.all().should.be.equal({"posts": [{"id": 1, "author": "tuxtimo"}], "comments": [{"id": 1, "postId": 1}]})
+            server.indexes("posts").should.be.equal(["author"])
+
+            server.insert("posts", {"author": "luck"}).should.be.equal(2)
+            server.get_row("posts", 2).should.be.equal({"id": 2, "author": "luck"})
+            server.where("posts", author="luck").should.be.equal([{"id": 2, "author": "luck"}])
+            server.bulk("posts", [{"author": "obi"}], {1: {"title": "foo"}}).should.be.equal({"insert": [3], "update": [1], "remove": []})
+            server.get_row("posts", 1).should.be.equal({"id": 1, "author": "tuxtimo", "title": "foo"})
+            server.remove("comments", 1)
+            server.where("comments", postId=1).should.be.equal([])
+
+            server.remove.when.called_with("comments", 1).should.throw(RowNotFound, "Row with id '1' in table 'comments' not found")
+            server.insert.when.called_with("users", {}).should.throw(TableNotFound, "Table 'users' not found")
+
+            server.flush()
+            with open(dbfile) as f:
+                json.load(f)["posts"].should.have.length_of(3)
+        finally:
+            server.close()
+            writer.terminate()
+            writer.join()
+        writer.exitcode.should.be.equal(0)
+        os.rmdir(os.path.dirname(path))
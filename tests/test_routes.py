@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
 from tests.base import *
+import time
 from unittest import TestCase
 
+from jsonserver.codec import available_codecs
+
 
 class RoutesTestCase(TestCase):
 
@@ -102,7 +105,9 @@ class RoutesTestCase(TestCase):
         response_data = app.get("/").get_data(as_text=True)
         json.loads(response_data).should.be.equal({"posts": [], "comments": []})
 
-        app.post("/posts", **get_json({"row": {"author": "tuxtimo", "body": "some content"}}))
+        response = app.post("/posts", **get_json({"row": {"author": "tuxtimo", "body": "some content"}}))
+        response.status_code.should.be.equal(201)
+        json.loads(response.get_data(as_text=True)).should.be.equal({"id": 1, "author": "tuxtimo", "body": "some content"})
         response_data = app.get("/").get_data(as_text=True)
         json.loads(response_data).should.be.equal({"posts": [{"id": 1, "author": "tuxtimo", "body": "some content"}], "comments": []})
 
@@ -151,3 +156,315 @@ class RoutesTestCase(TestCase):
         app.patch("/posts/2", **get_json({"row": {"author": "obi", "body": "some fancy edited content"}}))
         response_data = app.get("/").get_data(as_text=True)
         json.loads(response_data).should.be.equal({"posts": [{"id": 1, "author": "tuxtimo", "body": "some content"}, {"id": 2, "author": "obi", "body": "some fancy edited content"}], "comments": [{"id": 1, "author": "tuxtimo", "body": "some awesome edited content"}]})
+
+    @with_test_app
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}, {"id": 2, "author": "luck"}]})
+    def test_indexes(self, server, app):
+        """
+            Test HTTP: create and drop secondary indexes
+        """
+        response_data = app.post("/posts/_indexes", **get_json({"column": "author"})).get_data(as_text=True)
+        json.loads(response_data).should.be.equal({"indexes": ["author"]})
+        server.where("posts", author="luck").should.be.equal([{"id": 2, "author": "luck"}])
+
+        response_data = app.delete("/posts/_indexes/author").get_data(as_text=True)
+        json.loads(response_data).should.be.equal({"indexes": []})
+
+    @with_jsonserver({"posts": [{"id": 1, "title": "jsonserver"}]})
+    def test_response_codec(self, server):
+        """
+            Test HTTP: responses are encoded with the codec of the app
+        """
+        for name in available_codecs():
+            app = create_app(codec=name).test_client()
+            response = app.get("/posts/1")
+            response.content_type.should.be.equal("application/json")
+            response.get_data().should.be.equal(b'{"id":1,"title":"jsonserver"}')
+
+    @with_jsonserver({"posts": [{"id": 1, "title": "jsonserver"}], "comments": [{"id": 1, "postId": 1}]})
+    def test_response_cache(self, server):
+        """
+            Test HTTP: cached responses are invalidated by changes of their tables
+        """
+        flask_app = create_app(cache_size=1024)
+        cache = flask_app.config["JSONSERVER_CACHE"]
+        app = flask_app.test_client()
+
+        json.loads(app.get("/posts").get_data(as_text=True)).should.be.equal({"posts": [{"id": 1, "title": "jsonserver"}]})
+        json.loads(app.get("/comments").get_data(as_text=True)).should.be.equal({"comments": [{"id": 1, "postId": 1}]})
+        json.loads(app.get("/posts/1/comments").get_data(as_text=True)).should.be.equal({"comments": [{"id": 1, "postId": 1}]})
+        len(cache).should.be.equal(3)
+
+        server.update("posts", 1, {"title": "cached"})
+        cache.get(("table", "comments"), (server.version("comments"),)).should_not.be.none
+        json.loads(app.get("/posts").get_data(as_text=True)).should.be.equal({"posts": [{"id": 1, "title": "cached"}]})
+
+        server.insert("comments", {"postId": 1})
+        json.loads(app.get("/posts/1/comments").get_data(as_text=True)).should.be.equal({"comments": [{"id": 1, "postId": 1}, {"id": 2, "postId": 1}]})
+        json.loads(app.get("/").get_data(as_text=True)).should.be.equal({"posts": [{"id": 1, "title": "cached"}], "comments": [{"id": 1, "postId": 1}, {"id": 2, "postId": 1}]})
+
+        server.drop("comments")
+        server.create("comments")
+        json.loads(app.get("/comments").get_data(as_text=True)).should.be.equal({"comments": []})
+
+    @with_jsonserver({"posts": [{"id": i, "views": i % 5} for i in range(1, 8)]})
+    def test_cached_query(self, server):
+        """
+            Test HTTP: queries answered from the cache or with 304 are not run again
+        """
+        app = create_app(cache_size=1024 * 1024).test_client()
+        queries = []
+        query = server.query
+        server.query = lambda *args, **kwargs: queries.append(args) or query(*args, **kwargs)
+        try:
+            url = "/posts?views_ne=3&_limit=2"
+            response = app.get(url)
+            headers = response.headers["X-Total-Count"], response.headers["Link"]
+            headers[0].should.be.equal("6")
+
+            response = app.get(url)
+            json.loads(response.get_data(as_text=True)).should.be.equal({"posts": [{"id": 1, "views": 1}, {"id": 2, "views": 2}]})
+            (response.headers["X-Total-Count"], response.headers["Link"]).should.be.equal(headers)
+            app.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code.should.be.equal(304)
+            len(queries).should.be.equal(1)
+
+            server.update("posts", 1, {"views": 3})
+            app.get(url).headers["X-Total-Count"].should.be.equal("5")
+            len(queries).should.be.equal(2)
+        finally:
+            del server.query
+
+    @with_test_app
+    @with_jsonserver({"posts": [{"id": 1, "title": "jsonserver"}, {"id": 2, "title": "jsonserver2"}], "comments": []})
+    def test_conditional_requests(self, server, app):
+        """
+            Test HTTP: ETag and Last-Modified of read routes
+        """
+        past = time.time() - 60  # the data was not changed within the current second
+        os.utime(server.dbfile, (past, past))
+        server.read(flush_previous=False)
+
+        for url in ("/", "/posts", "/posts/1", "/posts/1/comments"):
+            response = app.get(url)
+            response.status_code.should.be.equal(200)
+            etag = response.headers["ETag"]
+            last_modified = response.headers["Last-Modified"]
+
+            response = app.get(url, headers={"If-None-Match": etag})
+            response.status_code.should.be.equal(304)
+            response.get_data().should.be.equal(b"")
+            response.headers["ETag"].should.be.equal(etag)
+
+            response = app.get(url, headers={"If-Modified-Since": last_modified})
+            response.status_code.should.be.equal(304)
+
+        row_etag = app.get("/posts/1").headers["ETag"]
+        table_etag = app.get("/posts").headers["ETag"]
+        server.update("posts", 2, {"title": "foo"})
+
+        app.get("/posts/1", headers={"If-None-Match": row_etag}).status_code.should.be.equal(304)
+        response = app.get("/posts", headers={"If-None-Match": table_etag})
+        response.status_code.should.be.equal(200)
+        response.headers["ETag"].should_not.be.equal(table_etag)
+
+        response = app.get("/posts/2", headers={"If-None-Match": row_etag})
+        response.status_code.should.be.equal(200)
+        json.loads(response.get_data(as_text=True)).should.be.equal({"id": 2, "title": "foo"})
+
+    @with_test_app
+    @with_jsonserver({"posts": [{"id": 1, "title": "jsonserver"}]})
+    def test_modified_since_within_second(self, server, app):
+        """
+            Test HTTP: a change within the second of Last-Modified is not answered with 304
+        """
+        past = time.time() - 60
+        os.utime(server.dbfile, (past, past))
+        server.read(flush_previous=False)
+
+        last_modified = app.get("/posts/1").headers["Last-Modified"]
+        app.put("/posts/1", **get_json({"row": {"title": "foo"}}))
+        response = app.get("/posts/1", headers={"If-Modified-Since": last_modified})
+        response.status_code.should.be.equal(200)
+
+        last_modified = response.headers["Last-Modified"]
+        app.put("/posts/1", **get_json({"row": {"title": "bar"}}))
+        response = app.get("/posts/1", headers={"If-Modified-Since": last_modified})
+        response.status_code.should.be.equal(200)
+        json.loads(response.get_data(as_text=True)).should.be.equal({"id": 1, "title": "bar"})
+
+    @with_test_app
+    @with_jsonserver({"posts": [{"id": i} for i in range(1, 8)], "tags": [{"id": "python"}, {"id": "json"}]})
+    def test_get_table_page(self, server, app):
+        """
+            Test HTTP: get a page of a table
+        """
+        response = app.get("/posts?_limit=3&_offset=3")
+        json.loads(response.get_data(as_text=True)).should.be.equal({"posts": [{"id": 4}, {"id": 5}, {"id": 6}]})
+        response.headers["X-Total-Count"].should.be.equal("7")
+        response.headers["Link"].should.be.equal(
+            '<http://localhost/posts?_limit=3&_offset=0>; rel="first", '
+            '<http://localhost/posts?_limit=3&_offset=0>; rel="prev", '
+            '<http://localhost/posts?_limit=3&_offset=6>; rel="next", '
+            '<http://localhost/posts?_limit=3&_offset=6>; rel="last"')
+
+        response = app.get("/posts?_limit=3&_after=2")
+        json.loads(response.get_data(as_text=True)).should.be.equal({"posts": [{"id": 3}, {"id": 4}, {"id": 5}]})
+        response.headers["Link"].should.be.equal('<http://localhost/posts?_after=5&_limit=3>; rel="next"')
+
+        response = app.get("/posts?_limit=3&_after=5")
+        json.loads(response.get_data(as_text=True)).should.be.equal({"posts": [{"id": 6}, {"id": 7}]})
+        response.headers.should_not.contain("Link")
+
+        app.get("/posts?_limit=-1").status_code.should.be.equal(400)
+        app.get("/posts?_offset=foo").status_code.should.be.equal(400)
+
+        response = app.get("/tags?_limit=3&_after=1")
+        response.status_code.should.be.equal(200)
+        json.loads(response.get_data(as_text=True)).should.be.equal({"tags": []})
+
+    @with_jsonserver({"posts": [{"id": i, "title": str(i)} for i in range(1, 1202)], "comments": [{"id": 1, "postId": 1}]})
+    def test_streamed_response(self, server):
+        """
+            Test HTTP: large tables are streamed in chunks
+        """
+        flask_app = create_app(cache_size=1024 * 1024, stream_threshold=1000)
+        app = flask_app.test_client()
+
+        response = app.get("/posts")
+        response.headers.should_not.contain("Content-Length")
+        json.loads(response.get_data(as_text=True)).should.be.equal(server.get_table("posts"))
+
+        # the streamed response was cached
+        response = app.get("/posts")
+        response.headers.should.contain("Content-Length")
+        json.loads(response.get_data(as_text=True)).should.be.equal(server.get_table("posts"))
+
+        response = app.get("/")
+        response.headers.should_not.contain("Content-Length")
+        json.loads(response.get_data(as_text=True)).should.be.equal(server.all())
+
+        response = app.get("/comments")
+        response.headers.should.contain("Content-Length")
+        json.loads(response.get_data(as_text=True)).should.be.equal({"comments": [{"id": 1, "postId": 1}]})
+
+    @with_test_app
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo", "views": 10}, {"id": 2, "author": "luck", "views": 5}, {"id": 3, "author": "tuxtimo", "views": 20}]})
+    def test_query_table(self, server, app):
+        """
+            Test HTTP: filter, sort and project the rows of a table
+        """
+        response = app.get("/posts?author=tuxtimo&_sort=views&_order=desc&_fields=id,views")
+        json.loads(response.get_data(as_text=True)).should.be.equal({"posts": [{"id": 3, "views": 20}, {"id": 1, "views": 10}]})
+        response.headers["X-Total-Count"].should.be.equal("2")
+
+        response = app.get("/posts?views_gte=10&_limit=1")
+        json.loads(response.get_data(as_text=True)).should.be.equal({"posts": [{"id": 1, "author": "tuxtimo", "views": 10}]})
+        response.headers["X-Total-Count"].should.be.equal("2")
+        response.headers["Link"].should.contain('<http://localhost/posts?_limit=1&_offset=1&views_gte=10>; rel="next"')
+
+        response = app.get("/posts?author_like=^LU")
+        json.loads(response.get_data(as_text=True)).should.be.equal({"posts": [{"id": 2, "author": "luck", "views": 5}]})
+
+        app.get("/posts?_order=up").status_code.should.be.equal(400)
+        app.get("/posts?author_like=(").status_code.should.be.equal(400)
+
+    @with_test_app
+    @with_jsonserver({"users": [{"id": 1, "name": "tuxtimo"}], "posts": [{"id": 1, "userId": 1}, {"id": 2, "userId": 1}],
+                      "comments": [{"id": 1, "postId": 2}]})
+    def test_embed(self, server, app):
+        """
+            Test HTTP: embed related rows with _embed and _expand
+        """
+        response = app.get("/posts?_embed=comments&_expand=users")
+        json.loads(response.get_data(as_text=True)).should.be.equal({"posts": [
+            {"id": 1, "userId": 1, "user": {"id": 1, "name": "tuxtimo"}, "comments": []},
+            {"id": 2, "userId": 1, "user": {"id": 1, "name": "tuxtimo"}, "comments": [{"id": 1, "postId": 2}]}]})
+
+        response = app.get("/users/1?_embed=posts")
+        json.loads(response.get_data(as_text=True)).should.be.equal({"id": 1, "name": "tuxtimo", "posts": [{"id": 1, "userId": 1}, {"id": 2, "userId": 1}]})
+        etag = response.headers["ETag"]
+
+        server.insert("posts", {"userId": 1})
+        response = app.get("/users/1?_embed=posts", headers={"If-None-Match": etag})
+        response.status_code.should.be.equal(200)
+        len(json.loads(response.get_data(as_text=True))["posts"]).should.be.equal(3)
+
+    @with_test_app
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}, {"id": 2, "author": "luck"}]})
+    def test_bulk(self, server, app):
+        """
+            Test HTTP: insert, update and remove rows in a single batch
+        """
+        response = app.post("/posts/_bulk", **get_json({"insert": [{"author": "foo"}, {"author": "bar"}], "update": [{"id": 1, "author": "obi"}], "remove": [2]}))
+        json.loads(response.get_data(as_text=True)).should.be.equal({"insert": [3, 4], "update": [1], "remove": [2]})
+        json.loads(app.get("/posts").get_data(as_text=True)).should.be.equal({"posts": [{"id": 1, "author": "obi"}, {"id": 3, "author": "foo"}, {"id": 4, "author": "bar"}]})
+
+        app.post("/posts/_bulk", **get_json({"update": [{"author": "foo"}]})).status_code.should.be.equal(400)
+        app.post("/posts/_bulk", **get_json({"insert": [1]})).status_code.should.be.equal(400)
+        app.post("/posts/_bulk", **get_json({"remove": ["x"]})).status_code.should.be.equal(400)
+        app.post("/posts/_bulk", **get_json({"update": [{"id": None}]})).status_code.should.be.equal(400)
+        app.post("/posts/_bulk", **get_json({"remove": 1})).status_code.should.be.equal(400)
+        app.post("/posts/_bulk", **get_json([1])).status_code.should.be.equal(400)
+
+    @with_test_app
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}]})
+    def test_changes(self, server, app):
+        """
+            Test HTTP: read the change feed by polling and as server-sent events
+        """
+        start = server.sequence
+        json.loads(app.get("/_changes").get_data(as_text=True)).should.be.equal({"changes": [], "last": start})
+        app.post("/posts", **get_json({"row": {"author": "luck"}}))
+        app.delete("/posts/1")
+
+        response = app.get("/_changes?since={}".format(start))
+        json.loads(response.get_data(as_text=True)).should.be.equal({"changes": [
+            {"seq": start + 1, "op": "insert", "table": "posts", "id": 2, "row": {"id": 2, "author": "luck"}},
+            {"seq": start + 2, "op": "remove", "table": "posts", "id": 1}], "last": start + 2})
+        response = app.get("/_changes?since={}&timeout=1".format(start + 2))
+        json.loads(response.get_data(as_text=True)).should.be.equal({"changes": [], "last": start + 2})
+        response = app.get("/_changes?since={}&table=users".format(start))
+        json.loads(response.get_data(as_text=True)).should.be.equal({"changes": [], "last": start + 2})
+
+        app.get("/_changes?since=x").status_code.should.be.equal(400)
+        server.changes.resize(1)
+        app.get("/_changes?since={}".format(start)).status_code.should.be.equal(410)
+
+        response = app.get("/_changes", headers={"Accept": "text/event-stream", "Last-Event-ID": str(start + 1)})
+        response.status_code.should.be.equal(200)
+        response.mimetype.should.be.equal("text/event-stream")
+        events = response.response
+        next(events).should.be.equal(b"retry: 1000\n\n")
+        next(events).should.contain("id: {}\nevent: change\n".format(start + 2).encode("utf-8"))
+        response.close()
+
+    @with_test_app
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}]})
+    def test_metrics(self, server, app):
+        """
+            Test HTTP: serve the metrics in the Prometheus text format
+        """
+        app.get("/posts/1")
+        app.get("/posts/1")
+
+        response = app.get("/_metrics")
+        response.status_code.should.be.equal(200)
+        response.mimetype.should.be.equal("text/plain")
+        metrics = response.get_data(as_text=True)
+        metrics.should.match(r'jsonserver_http_requests_total\{method="GET",route="/<table>/<id>",status="200"\} \d+')
+        metrics.should.contain('jsonserver_http_request_duration_seconds_bucket{method="GET",route="/<table>/<id>",le="+Inf"}')
+        metrics.should.contain('jsonserver_table_rows{table="posts"} 1')
+
+        create_app(metrics=False).test_client().get("/_metrics").status_code.should.be.equal(404)
+
+    @with_test_app
+    @with_jsonserver({"posts": [{"id": 1, "author": "tuxtimo"}, {"id": 2, "author": "luck"}]})
+    def test_profile(self, server, app):
+        """
+            Test HTTP: profile a request asking for it
+        """
+        app.get("/posts/1").headers.shouldnt.have.key("Server-Timing")
+
+        timing = app.get("/posts?author=luck&_sort=id", headers={"X-Profile": "1"}).headers["Server-Timing"]
+        [entry.split(";")[0] for entry in timing.split(", ")].should.be.equal(
+            ["filter", "lookup", "serialize", "sort", "other", "total"])
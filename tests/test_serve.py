@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+from tests.base import *
+from unittest import TestCase
+
+from jsonserver.serve import serve
+
+
+class ServeTest(TestCase):
+    """
+        Test serving the json server with a production server.
+    """
+
+    def test_invalid_options(self):
+        """
+            Test that invalid options are rejected before the database is loaded
+        """
+        def factory():
+            raise AssertionError("the database must not be loaded")
+
+        serve.when.called_with(factory, factory, server="tornado").should.throw(ValueError, "Unknown server 'tornado', expected one of: waitress, gunicorn, uvicorn")
+        serve.when.called_with(factory, factory, workers=0).should.throw(ValueError, "At least one worker process is required to serve requests")
+        serve.when.called_with(factory, factory, workers=2).should.throw(ValueError, "Several worker processes are only supported by gunicorn")
+        serve.when.called_with(factory, factory, threads=0).should.throw(ValueError, "At least one thread is required to serve requests")
@@ -3,7 +3,10 @@
 from tests.base import *
 from unittest import TestCase
 
-from jsonserver.storage import Storage, JsonStorage
+from tempfile import NamedTemporaryFile
+
+from jsonserver.storage import Storage, JsonStorage, JournalStorage, MsgpackStorage, SqliteStorage, SqliteTable, \
+    DeferredTable, scan_tables, open_storage
 
 
 class StorageTest(TestCase):
@@ -28,6 +31,38 @@ class StorageTest(TestCase):
         data = storage.read()
         data.should.be.equal({"posts": [{"id": 1, "body": "some text"}, {"id": 2, "body": "some text"}]})
 
+    def test_scan_tables(self):
+        """
+            Test finding the tables of a json database without decoding them
+        """
+        data = b' {"posts": [{"id": 1, "body": "]\\"["}, {"id": 2, "tags": ["[", "}"]}], "a\\"b":[[1]] ,"tags":[]}\n'
+        for chunk_size in (1, 4, 1024):  # skip chunks of a table or scan them bracket by bracket
+            tables = scan_tables(data, chunk_size=chunk_size)
+            list(tables).should.be.equal(["posts", 'a"b', "tags"])
+            {name: json.loads(data[start:end]) for name, (start, end) in tables.items()}.should.be.equal(json.loads(data))
+        scan_tables(b"{}").should.be.equal({})
+
+        for invalid in (b"[]", b'{"posts": 1}', b'{"posts": [], "users": {}}', b'{"posts": [', b"{}[]"):
+            scan_tables.when.called_with(invalid).should.throw(ValueError)
+
+    @with_json_db({"posts": [{"id": 1, "body": "some text"}], "tags": [], "meta": {"version": 1}})
+    def test_jsonstorage_read_lazy(self, dbfile):
+        """
+            Test deferring the decoding of the tables of a json file
+        """
+        storage = JsonStorage(dbfile)
+        storage.read_lazy().should.be.equal({"posts": [{"id": 1, "body": "some text"}], "tags": [], "meta": {"version": 1}})
+
+        storage.write({"posts": [{"id": 1, "body": "some text"}], "tags": []})
+        data = storage.read_lazy()
+        data["posts"].should.be.a(DeferredTable)
+        data["posts"].load().should.be.equal([{"id": 1, "body": "some text"}])
+
+        storage.write({"posts": data["posts"], "tags": [{"id": 1}]})  # the memory map outlives the replaced file
+        storage.read().should.be.equal({"posts": [{"id": 1, "body": "some text"}], "tags": [{"id": 1}]})
+        data["tags"].load().should.be.equal([])
+        storage.close()
+
     @with_json_db()
     def test_jsonstorage_write(self, dbfile):
         """
@@ -39,3 +74,137 @@ class StorageTest(TestCase):
         data = {"posts": [{"id": 1, "body": "some text"}, {"id": 2, "body": "some text"}]}
         storage.write(data)
         storage.read().should.be.equal(data)
+
+    @with_json_db({"posts": []})
+    def test_journalstorage_append(self, dbfile):
+        """
+            Test the journal functionality of the JournalStorage object
+        """
+        storage = JournalStorage(dbfile)
+        list(storage.records()).should.be.equal([])
+
+        storage.append({"op": "insert", "table": "posts", "row": {"id": 1}})
+        storage.append({"op": "remove", "table": "posts", "id": 1}, flush=True)
+
+        with open(storage.journalfile, "r") as f:
+            f.read().should.be.equal('{"op":"insert","table":"posts","row":{"id":1}}\n{"op":"remove","table":"posts","id":1}\n')
+
+        list(storage.records()).should.be.equal([{"op": "insert", "table": "posts", "row": {"id": 1}}, {"op": "remove", "table": "posts", "id": 1}])
+
+        storage.write({"posts": []})
+        list(storage.records()).should.be.equal([])
+        storage.close()
+        os.remove(storage.journalfile)
+
+    @with_json_db({"posts": []})
+    def test_journalstorage_torn_record(self, dbfile):
+        """
+            Test that an incomplete record at the end of the journal is discarded
+        """
+        with open(dbfile + ".log", "w") as f:
+            f.write('{"op":"create","table":"comments"}\n{"op":"dr')
+
+        storage = JournalStorage(dbfile)
+        list(storage.records()).should.be.equal([{"op": "create", "table": "comments"}])
+
+        storage.append({"op": "drop", "table": "comments"}, flush=True)
+        list(storage.records()).should.be.equal([{"op": "create", "table": "comments"}, {"op": "drop", "table": "comments"}])
+        storage.close()
+        os.remove(storage.journalfile)
+
+    @with_json_db({"posts": [{"id": 1, "body": "some text"}]})
+    def test_jsonstorage_atomic_write(self, dbfile):
+        """
+            Test that a failing write leaves the json file untouched
+        """
+        class Unserializable(object):
+            pass
+
+        storage = JsonStorage(dbfile, durability="fsync")
+        storage.write.when.called_with({"posts": [{"id": 1}, {"id": 2, "body": Unserializable()}]}).should.throw(TypeError)
+
+        storage.read().should.be.equal({"posts": [{"id": 1, "body": "some text"}]})
+        directory, name = os.path.split(dbfile)
+        [f for f in os.listdir(directory) if f.startswith(name + ".")].should.be.equal([])
+
+        os.chmod(dbfile, 0o640)
+        storage.write({"posts": []})
+        storage.read().should.be.equal({"posts": []})
+        (os.stat(dbfile).st_mode & 0o777).should.be.equal(0o640)
+
+    @with_json_db()
+    def test_jsonstorage_durability(self, dbfile):
+        """
+            Test that only known durability levels are accepted
+        """
+        for durability in ("none", "flush", "fsync"):
+            storage = JsonStorage(dbfile, durability=durability)
+            storage.write({"posts": []})
+            storage.read().should.be.equal({"posts": []})
+            storage.close()
+
+        JsonStorage.when.called_with(dbfile, durability="always").should.throw(ValueError, "Unknown durability 'always', expected one of: none, flush, fsync")
+
+    @with_json_db()
+    def test_open_storage(self, dbfile):
+        """
+            Test selecting the storage by the file extension or the format
+        """
+        for path, format, storage in ((dbfile, None, JsonStorage), (dbfile, "msgpack", MsgpackStorage)):
+            opened = open_storage(path, format=format)
+            opened.should.be.a(storage)
+            opened.close()
+        open_storage(dbfile, journal=True).should.be.a(JournalStorage)
+        open_storage.when.called_with(dbfile, format="xml").should.throw(ValueError, "Unknown storage format 'xml'")
+        os.remove(dbfile + ".log")
+
+        with NamedTemporaryFile(suffix=".sqlite") as tmpfile:
+            storage = open_storage(tmpfile.name)
+            storage.should.be.a(SqliteStorage)
+            storage.close()
+
+    @with_json_db()
+    def test_msgpackstorage(self, dbfile):
+        """
+            Test storing data as MessagePack
+        """
+        storage = MsgpackStorage(dbfile)
+        storage.read().should.be.equal({})
+
+        data = {"posts": [{"id": 1, "body": "some text", "tags": ["a"], "score": 1.5, "draft": None}]}
+        storage.write(data)
+        storage.read().should.be.equal(data)
+        storage.read_lazy().should.be.equal(data)
+        with open(dbfile, "rb") as f:
+            f.read(1).should.be.equal(b"\x81")  # a map with a single key
+        storage.close()
+
+    def test_sqlitestorage(self):
+        """
+            Test storing the rows of the tables in SQLite
+        """
+        with NamedTemporaryFile(suffix=".sqlite") as tmpfile:
+            storage = SqliteStorage(tmpfile.name)
+            storage.read().should.be.equal({})
+
+            storage.write({"posts": [{"id": 1, "body": "some text"}, {"id": 2}], "tags": []})
+            storage.append({"op": "batch", "table": "posts", "records": [
+                {"op": "update", "table": "posts", "id": 1, "data": {"body": "other text"}},
+                {"op": "remove", "table": "posts", "id": 2},
+                {"op": "insert", "table": "posts", "row": {"id": 3}}]})
+            storage.append({"op": "drop", "table": "tags"})
+            storage.append({"op": "create", "table": "users"}, flush=True)
+            storage.journal_records.should.be.equal(0)
+            storage.close()
+            storage.close()
+
+            storage = SqliteStorage(tmpfile.name)
+            storage.read().should.be.equal({"posts": [{"id": 1, "body": "other text"}, {"id": 3}], "users": []})
+            list(storage.records()).should.be.equal([])
+
+            data = storage.read_lazy()
+            data["posts"].should.be.a(SqliteTable)
+            data["posts"].raw().should.be.equal(b'[{"id":1,"body":"other text"},{"id":3}]')
+            storage.write({"posts": data["posts"], "users": [{"id": 1}]})  # deferred tables are kept as they are
+            storage.read().should.be.equal({"posts": [{"id": 1, "body": "other text"}, {"id": 3}], "users": [{"id": 1}]})
+            storage.close()